@@ -0,0 +1,358 @@
+"""Local verification of Supabase access tokens.
+
+Supabase issues JWTs signed either with the project's JWT secret (HS256) or
+with an asymmetric key published on the project's JWKS endpoint. Checking the
+signature, expiry and audience locally lets handlers skip the round trip to
+``supabase.auth.get_user`` for every request. The remote lookup is used when a
+token cannot be verified locally (no secret configured, unknown key id) and,
+with ``revalidate`` on, to confirm a locally verified token once per cache
+entry: a token whose session was signed out is then refused within ``ttl``
+seconds instead of staying valid until it expires.
+
+The algorithm is never taken from the token: secret-signed tokens must be
+HS256 and key-signed ones must use the algorithm of their JWK.
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import jwt
+
+from metrics import count_cache
+
+
+# Statuses with which Supabase refuses a token it no longer accepts
+REVOKED_STATUSES = (401, 403)
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class AuthResult:
+    """Mirrors the shape of supabase's ``UserResponse`` (``result.user.id``)."""
+    user: AuthenticatedUser
+
+
+class SigningKeyCache:
+    """Caches the JWKS signing keys (``PyJWK``) by ``kid`` and refreshes them periodically."""
+
+    def __init__(self, jwks_url=None, jwks=None, ttl=600, min_refresh_interval=30,
+                 fetch_timeout=2.0):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.fetch_timeout = fetch_timeout
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._attempted_at = None
+        self._lock = threading.Lock()
+        if jwks is not None:
+            self.load(jwks)
+
+    def load(self, jwks):
+        """Install keys from a JWKS document (a dict with a ``keys`` list)."""
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            try:
+                keys[jwk.get("kid")] = jwt.PyJWK.from_dict(jwk)
+            except (jwt.PyJWTError, TypeError, ValueError):
+                continue
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _refresh(self):
+        with urllib.request.urlopen(self.jwks_url, timeout=self.fetch_timeout) as resp:
+            self.load(json.loads(resp.read()))
+
+    def get(self, kid):
+        now = time.monotonic()
+        with self._lock:
+            key = self._keys.get(kid)
+            stale = now - self._fetched_at > self.ttl
+            # Unknown key ids must not turn every request into a JWKS fetch
+            throttled = (self._attempted_at is not None
+                         and now - self._attempted_at < self.min_refresh_interval)
+            refresh = (key is None or stale) and self.jwks_url and not throttled
+            if refresh:
+                self._attempted_at = now
+        if refresh:
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"Failed to refresh JWKS: {e}")
+            with self._lock:
+                key = self._keys.get(kid)
+        return key
+
+
+class TokenVerifier:
+    """Verifies bearer tokens locally, backed by a bounded TTL/LRU cache.
+
+    ``get_user(token)`` returns an ``AuthResult`` (or ``None`` for an invalid
+    token) and can be used wherever ``supabase.auth.get_user`` was called.
+    With ``revalidate`` and a ``remote_lookup``, a cache miss also asks the
+    remote lookup, so revocations show up within ``ttl`` seconds. When that
+    lookup fails for another reason than refusing the token (an outage), the
+    local verification stands.
+    """
+
+    def __init__(self, jwt_secret=None, signing_keys=None, audience="authenticated",
+                 remote_lookup: Optional[Callable] = None, max_size=1024, ttl=60,
+                 leeway=0, clock=time.time, revalidate=False):
+        self.jwt_secret = jwt_secret
+        self.signing_keys = signing_keys
+        self.audience = audience
+        self.remote_lookup = remote_lookup
+        self.max_size = max_size
+        self.ttl = ttl
+        self.leeway = leeway
+        self.clock = clock
+        self.revalidate = revalidate and remote_lookup is not None
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "local_verifications": 0,
+            "remote_lookups": 0,
+            "rejections": 0,
+            "revocations": 0,
+        }
+
+    @classmethod
+    def from_env(cls, remote_lookup=None):
+        supabase_url = os.environ.get("SUPABASE_URL")
+        jwks_url = os.environ.get("SUPABASE_JWKS_URL")
+        if not jwks_url and supabase_url:
+            jwks_url = supabase_url.rstrip("/") + "/auth/v1/.well-known/jwks.json"
+        return cls(
+            jwt_secret=os.environ.get("SUPABASE_JWT_SECRET") or None,
+            signing_keys=SigningKeyCache(jwks_url=jwks_url) if jwks_url else None,
+            audience=os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated"),
+            remote_lookup=remote_lookup,
+            max_size=int(os.environ.get("AUTH_CACHE_SIZE", 1024)),
+            ttl=int(os.environ.get("AUTH_CACHE_TTL", 60)),
+            revalidate=os.environ.get("AUTH_REVALIDATE", "true").lower() == "true",
+        )
+
+    # --- cache helpers ---
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _cache_get(self, key):
+        result = self._cache_lookup(key)
+        count_cache("auth", result is not None)
+        return result
+
+    def _cache_lookup(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            result, expires_at = entry
+            if expires_at <= self.clock():
+                del self._cache[key]
+                self._counters["misses"] += 1
+                return None
+            self._cache.move_to_end(key)
+            self._counters["hits"] += 1
+            return result
+
+    def _cache_put(self, key, result, token_exp=None):
+        expires_at = self.clock() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._cache[key] = (result, expires_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    # --- verification ---
+
+    def _resolve_key(self, header):
+        """``(key, allowed algorithms)``, or ``(None, None)`` when only the remote lookup can tell."""
+        if str(header.get("alg", "")).startswith("HS"):
+            return (self.jwt_secret, ["HS256"]) if self.jwt_secret else (None, None)
+        if self.signing_keys is None:
+            return None, None
+        jwk = self.signing_keys.get(header.get("kid"))
+        if jwk is None:
+            return None, None
+        return jwk.key, [jwk.algorithm_name]
+
+    def _verify_locally(self, token):
+        """Returns the verified claims, ``None`` if the token can't be checked
+        locally, and raises ``jwt.PyJWTError`` if it is invalid."""
+        header = jwt.get_unverified_header(token)
+        key, algorithms = self._resolve_key(header)
+        if key is None:
+            return None
+        return jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience=self.audience,
+            leeway=self.leeway,
+            options={"require": ["exp", "sub"]},
+        )
+
+    def _ask_remote(self, token):
+        """``(response, error)`` from the remote lookup."""
+        self._count("remote_lookups")
+        try:
+            return self.remote_lookup(token), None
+        except Exception as e:
+            return None, e
+
+    async def _ask_remote_async(self, token):
+        self._count("remote_lookups")
+        try:
+            response = self.remote_lookup(token)
+            if inspect.isawaitable(response):
+                response = await response
+            return response, None
+        except Exception as e:
+            return None, e
+
+    def _lookup_remote(self, token):
+        if self.remote_lookup is None:
+            return None
+        return self._looked_up(*self._ask_remote(token))
+
+    async def _lookup_remote_async(self, token):
+        if self.remote_lookup is None:
+            return None
+        return self._looked_up(*await self._ask_remote_async(token))
+
+    def _looked_up(self, response, error):
+        if error is not None:
+            print(f"Remote token lookup failed: {error}")
+            return None
+        return self._remote_result(response)
+
+    def _confirmed(self, key, token, result, response, error):
+        """``result`` (verified locally) unless the remote lookup refused the token."""
+        if error is not None and getattr(error, "status", None) not in REVOKED_STATUSES:
+            print(f"Could not revalidate token: {error}")
+        elif self._looked_up(response, error) is None:
+            self._count("revocations")
+            return None
+        self._cache_put(key, result, self._unverified_exp(token))
+        return result
+
+    @staticmethod
+    def _remote_result(response):
+        if not response or not getattr(response, "user", None):
+            return None
+        user = response.user
+        return AuthResult(user=AuthenticatedUser(
+            id=user.id,
+            email=getattr(user, "email", None),
+            role=getattr(user, "role", None),
+        ))
+
+    @staticmethod
+    def _unverified_exp(token):
+        try:
+            return jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except jwt.PyJWTError:
+            return None
+
+    def _verify(self, token, key):
+        """Returns ``(done, result)``; ``done`` is False when only the remote
+        lookup can decide."""
+        try:
+            claims = self._verify_locally(token)
+        except (jwt.PyJWTError, TypeError, ValueError):
+            # TypeError/ValueError: a header that doesn't fit the key (e.g. an unhashable kid)
+            self._count("rejections")
+            return True, None
+
+        if claims is None:
+            return False, None
+        self._count("local_verifications")
+        result = AuthResult(user=AuthenticatedUser(
+            id=claims["sub"],
+            email=claims.get("email"),
+            role=claims.get("role"),
+        ))
+        if not self.revalidate:
+            self._cache_put(key, result, claims.get("exp"))
+        return True, result
+
+    def _remember_remote(self, key, token, result):
+        if result is None:
+            self._count("rejections")
+            return None
+        self._cache_put(key, result, self._unverified_exp(token))
+        return result
+
+    def get_user(self, token):
+        if not token:
+            return None
+        key = self._key(token)
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        done, result = self._verify(token, key)
+        if done and result is not None and self.revalidate:
+            return self._confirmed(key, token, result, *self._ask_remote(token))
+        if done:
+            return result
+        return self._remember_remote(key, token, self._lookup_remote(token))
+
+    async def get_user_async(self, token):
+        """``get_user`` for the async service; ``remote_lookup`` may be a
+        coroutine function. Cache hits are answered inline, while verifying a
+        new token (which may fetch the JWKS) runs on a worker thread."""
+        if not token:
+            return None
+        key = self._key(token)
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        done, result = await asyncio.to_thread(self._verify, token, key)
+        if done and result is not None and self.revalidate:
+            return self._confirmed(key, token, result, *await self._ask_remote_async(token))
+        if done:
+            return result
+        return self._remember_remote(key, token, await self._lookup_remote_async(token))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._cache)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,245 @@
+"""Micro-batching scheduler for the single-record prediction endpoints.
+
+Each sklearn ``transform``/``predict`` call carries a fixed overhead that is far
+larger than the per-row cost. ``MicroBatcher`` collects rows submitted by
+concurrent request threads for up to ``window`` seconds (or until ``max_batch``
+rows are waiting), scores them with one vectorized call and hands each caller
+its own result.
+
+``InferencePool`` runs the larger CPU-bound scoring calls (batch endpoints)
+for the async service on a few worker threads, so they never run on the
+event loop.
+"""
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from predictions import predict_matrix
+
+
+class BatcherOverloaded(Exception):
+    """Raised when the scheduler queue is full and the request should be shed."""
+
+
+class MicroBatcher:
+    def __init__(self, model, scaler, n_features, max_batch=64, window=0.002,
+                 max_queue=1024, name="model"):
+        self.model = model
+        self.scaler = scaler
+        self.n_features = n_features
+        self.max_batch = max_batch
+        self.window = window
+        self.max_queue = max_queue
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._retired = False
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._rows = 0
+        self._rejected = 0
+        self._max_depth = 0
+
+    @classmethod
+    def from_env(cls, model, scaler, n_features, name="model"):
+        return cls(
+            model, scaler, n_features,
+            max_batch=int(os.environ.get("MICROBATCH_MAX_SIZE", 64)),
+            window=float(os.environ.get("MICROBATCH_WINDOW_MS", 2)) / 1000.0,
+            max_queue=int(os.environ.get("MICROBATCH_QUEUE_DEPTH", 1024)),
+            name=name,
+        )
+
+    def _ensure_worker(self):
+        # Started lazily so the thread is created in the process that serves requests.
+        # A retired worker may be exiting, so that case is always checked under the lock.
+        if not self._retired and self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name=f"microbatch-{self.name}", daemon=True
+                )
+                self._worker.start()
+
+    def submit(self, row):
+        """Queue one feature row and return a ``Future`` for its predicted class."""
+        row = np.asarray(row, dtype=float).reshape(-1)
+        if row.shape[0] != self.n_features:
+            raise ValueError(f"Invalid feature length, expected {self.n_features}")
+        # Compiled predictors reject NaN/inf, which would fail the whole batch
+        if not np.isfinite(row).all():
+            raise ValueError("Features must be finite numbers")
+        future = Future()
+        try:
+            self._queue.put_nowait((row, future))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise BatcherOverloaded(f"{self.name} prediction queue is full")
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._max_depth = max(self._max_depth, depth)
+        self._ensure_worker()
+        return future
+
+    def predict(self, row, timeout=None):
+        """Blocking helper for synchronous callers."""
+        return self.submit(row).result(timeout)
+
+    async def predict_async(self, row):
+        """Awaits the prediction without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(row))
+
+    def retire(self):
+        """Stops the worker once the queue has drained; a later ``submit`` starts it again."""
+        self._retired = True
+        try:
+            self._queue.put_nowait(None)  # wakes an idle worker
+        except queue.Full:
+            pass
+
+    def _next(self):
+        # None once a retired batcher has been idle for a second
+        while True:
+            try:
+                item = self._queue.get(timeout=1.0 if self._retired else None)
+            except queue.Empty:
+                with self._worker_lock:
+                    if self._queue.empty():
+                        self._worker = None
+                        return None
+                continue
+            if item is not None:
+                return item
+
+    def _collect(self):
+        first = self._next()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is not None:
+                batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Skip callers that cancelled while waiting in the queue
+            live = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            futures = [future for _, future in live]
+            try:
+                predictions = predict_matrix(self.model, self.scaler, np.vstack([row for row, _ in live]))
+            except Exception:
+                # Score the rows one by one so a bad row only fails its own caller
+                for row, future in live:
+                    self._predict_one(row, future)
+            else:
+                for future, prediction in zip(futures, predictions):
+                    future.set_result(int(prediction))
+            with self._stats_lock:
+                self._batch_sizes[len(futures)] += 1
+                self._rows += len(futures)
+
+    def _predict_one(self, row, future):
+        try:
+            prediction = predict_matrix(self.model, self.scaler, row.reshape(1, -1))[0]
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(int(prediction))
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = dict(sorted(self._batch_sizes.items()))
+            rows, rejected, max_depth = self._rows, self._rejected, self._max_depth
+        batches = sum(sizes.values())
+        return {
+            "name": self.name,
+            "batches": batches,
+            "rows": rows,
+            "mean_batch_size": rows / batches if batches else 0.0,
+            "batch_size_histogram": sizes,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": max_depth,
+            "rejected": rejected,
+        }
+
+
+class InferencePool:
+    """At most ``max_workers`` scoring calls run at once and ``max_pending``
+    more may wait; beyond that ``run`` raises ``BatcherOverloaded``."""
+
+    def __init__(self, max_workers=2, max_pending=32, name="inference"):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.name = name
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._counters = {"calls": 0, "rejected": 0}
+
+    @classmethod
+    def from_env(cls, name="inference"):
+        return cls(
+            max_workers=int(os.environ.get("INFERENCE_WORKERS", 2)),
+            max_pending=int(os.environ.get("INFERENCE_QUEUE_DEPTH", 32)),
+            name=name,
+        )
+
+    def _ensure_executor(self):
+        # Created lazily so the threads belong to the process that serves requests
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._active >= self.max_workers + self.max_pending:
+                self._counters["rejected"] += 1
+                raise BatcherOverloaded(f"{self.name} pool is busy")
+            self._active += 1
+            self._counters["calls"] += 1
+            executor = self._ensure_executor()
+        try:
+            # Run in the caller's context so the call's spans count toward its request
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(executor, context.run, fn, *args)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["active"] = self._active
+        return stats
@@ -0,0 +1,351 @@
+"""In-process stand-ins for Supabase and Gemini, for benchmarks.
+
+``install()`` replaces ``supabase.create_client``, ``supabase.AsyncClient``
+and ``google.generativeai.GenerativeModel`` before the app creates its
+clients, so the service runs its real code paths (query building, the
+Gemini backend, streaming) against in-memory tables and a scripted model.
+
+Each fake sleeps for a configurable time per call to stand in for the
+network: ``BENCH_DB_LATENCY_MS`` per query, ``BENCH_AUTH_LATENCY_MS`` per
+remote token lookup, ``BENCH_LLM_LATENCY_MS`` before the first token and
+``BENCH_LLM_CHUNK_DELAY_MS`` between streamed chunks. Replies are
+deterministic: the same prompt always gets the same text.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import jwt
+
+# Unique keys the real schema enforces and the app relies on
+UNIQUE_KEYS = {"chat_messages": ("session_id", "seq")}
+# Tables whose writes bump session_versions, as the sql/session_versions.sql triggers do
+VERSIONED_TABLES = {"chat_sessions": "chat", "diet_sessions": "diet"}
+
+_WORDS = ("eat", "rest", "hydrate", "walk", "iron", "folate", "protein", "sleep", "calm", "fiber",
+          "gentle", "daily", "small", "meals", "doctor", "check", "vitamins", "fruit", "water", "stretch")
+
+
+class UniqueViolation(Exception):
+    code = "23505"
+
+
+class FakeTables:
+    """Rows per table, shared by the sync and async clients."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.rows = {}
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def run(self, query):
+        with self._lock:
+            self.queries += 1
+            rows = self.rows.setdefault(query.table, [])
+            if query.op in ("insert", "upsert"):
+                return self._bump_versions(query.table, self._insert(query.table, rows, query.payload))
+            matched = [row for row in rows if all(test(row) for test in query.filters)]
+            if query.op == "update":
+                for row in matched:
+                    row.update(query.payload)
+                return self._bump_versions(query.table, [dict(row) for row in matched])
+            if query.op == "delete":
+                for row in matched:
+                    rows.remove(row)
+                return self._bump_versions(query.table, matched)
+            for column, desc in reversed(query.orders):
+                matched.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+            if query.count:
+                query.count = len(matched)
+            if query.limit_n is not None:
+                matched = matched[:query.limit_n]
+            return [query.project(row) for row in matched]
+
+    def _bump_versions(self, table, written):
+        kind = VERSIONED_TABLES.get(table)
+        if kind is not None:
+            versions = self.rows.setdefault("session_versions", [])
+            for row in written:
+                entry = next((v for v in versions if v["user_id"] == row.get("user_id") and v["kind"] == kind), None)
+                if entry is None:
+                    versions.append({"user_id": row.get("user_id"), "kind": kind, "version": 1})
+                else:
+                    entry["version"] += 1
+        return written
+
+    def _insert(self, table, rows, payload):
+        new = [dict(row) for row in (payload if isinstance(payload, list) else [payload])]
+        key = UNIQUE_KEYS.get(table)
+        if key:
+            taken = {tuple(row.get(k) for k in key) for row in rows}
+            for row in new:
+                if tuple(row.get(k) for k in key) in taken:
+                    raise UniqueViolation(f"duplicate key value violates unique constraint (23505) on {table}")
+        rows.extend(new)
+        return [dict(row) for row in new]
+
+
+def _or_filter(expression):
+    # Only the keyset-paging form session_listing.py builds:
+    # updated_at.lt."X",and(updated_at.eq."X",id.lt."Y")
+    m = re.fullmatch(r'(\w+)\.lt\."(.*)",and\(\w+\.eq\."(.*)",(\w+)\.lt\."(.*)"\)', expression)
+    if not m:
+        raise ValueError(f"Unsupported or_ filter: {expression}")
+    column, value, _, tie_column, tie_value = m.groups()
+    return lambda row: str(row.get(column)) < value or (
+        str(row.get(column)) == value and str(row.get(tie_column)) < tie_value)
+
+
+class FakeQuery:
+    def __init__(self, tables, table):
+        self.tables = tables
+        self.table = table
+        self.op = "select"
+        self.payload = None
+        self.columns = None
+        self.filters = []
+        self.orders = []
+        self.limit_n = None
+        self.count = None
+
+    def project(self, row):
+        if not self.columns:
+            return dict(row)
+        return {column: row.get(column) for column in self.columns}
+
+    def select(self, columns="*", count=None, **kwargs):
+        self.op = "select"
+        self.count = count
+        if columns.strip() != "*":
+            self.columns = [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, **kwargs):
+        self.op, self.payload = "upsert", payload
+        return self
+
+    def update(self, payload, **kwargs):
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self, **kwargs):
+        self.op = "delete"
+        return self
+
+    def _filter(self, test):
+        self.filters.append(test)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(lambda row: row.get(column) == value)
+
+    def lt(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) < value)
+
+    def gt(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) > value)
+
+    def gte(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) >= value)
+
+    def lte(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row.get(column) <= value)
+
+    def in_(self, column, values):
+        values = set(values)
+        return self._filter(lambda row: row.get(column) in values)
+
+    def or_(self, expression):
+        return self._filter(_or_filter(expression))
+
+    def order(self, column, desc=False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n, **kwargs):
+        self.limit_n = n
+        return self
+
+    def execute(self):
+        if self.tables.latency:
+            time.sleep(self.tables.latency)
+        data = self.tables.run(self)
+        return SimpleNamespace(data=data, count=self.count)
+
+
+class FakeAsyncQuery(FakeQuery):
+    async def execute(self):
+        if self.tables.latency:
+            await asyncio.sleep(self.tables.latency)
+        data = self.tables.run(self)
+        return SimpleNamespace(data=data, count=self.count)
+
+
+def _user_for(token):
+    claims = jwt.decode(token, options={"verify_signature": False})
+    return SimpleNamespace(user=SimpleNamespace(id=claims["sub"], email=claims.get("email"),
+                                                role=claims.get("role")))
+
+
+class FakeClient:
+    query_class = FakeQuery
+
+    def __init__(self, tables, auth_latency=0.0):
+        self.tables = tables
+        self.auth = SimpleNamespace(get_user=self._get_user)
+        self._auth_latency = auth_latency
+
+    def _get_user(self, token):
+        time.sleep(self._auth_latency)
+        return _user_for(token)
+
+    def table(self, name):
+        return self.query_class(self.tables, name)
+
+    from_ = table
+
+
+class FakeAsyncClient(FakeClient):
+    query_class = FakeAsyncQuery
+
+    async def _get_user(self, token):
+        await asyncio.sleep(self._auth_latency)
+        return _user_for(token)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def scripted_reply(prompt, words=60):
+    """The model's answer to ``prompt``: shaped like what each caller asks for."""
+    seed = int(_digest(prompt)[:8], 16)
+    if "Respond ONLY with a valid JSON" in prompt:
+        return json.dumps(SAMPLE_DIET_PLAN)
+    if "descriptive title" in prompt:
+        return "Pregnancy questions " + _digest(prompt)[:4]
+    if "diet tips" in prompt:
+        return "Eat small meals often\nDrink water through the day\nAdd leafy greens to lunch"
+    return " ".join(_WORDS[(seed + i * 7) % len(_WORDS)] for i in range(words)) + "."
+
+
+SAMPLE_DIET_PLAN = {
+    "overview": {
+        "calories_per_day": "2200-2500",
+        "key_nutrients": ["Folic Acid", "Iron", "Calcium", "Protein"],
+        "foods_to_avoid": ["Raw fish", "Unpasteurized dairy"],
+    },
+    "meal_plans": [{
+        "type": "Balanced Plan",
+        "meals": {
+            "breakfast": {"name": "Oats and fruit", "calories": "400", "items": ["Oats", "Banana", "Milk"]},
+            "lunch": {"name": "Dal and rice", "calories": "550", "items": ["Dal", "Brown rice", "Salad"]},
+            "dinner": {"name": "Paneer and roti", "calories": "500", "items": ["Paneer", "Roti", "Greens"]},
+            "snacks": [{"name": "Evening snack", "items": ["Yogurt", "Almonds"]}],
+        },
+    }],
+    "tips": ["Drink plenty of water", "Eat small, frequent meals"],
+    "supplements": [{"name": "Iron", "dosage": "27 mg daily", "reason": "Prevents anemia"}],
+}
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Stream:
+    def __init__(self, chunks, latency, chunk_delay):
+        self._chunks = chunks
+        self._latency = latency
+        self._chunk_delay = chunk_delay
+
+    def __iter__(self):
+        time.sleep(self._latency)
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                time.sleep(self._chunk_delay)
+            yield _Chunk(chunk)
+
+    async def __aiter__(self):
+        await asyncio.sleep(self._latency)
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                await asyncio.sleep(self._chunk_delay)
+            yield _Chunk(chunk)
+
+
+def _prompt(contents):
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        contents = [contents]
+    return "\n".join(
+        item if isinstance(item, str) else "".join(part.get("text", "") for part in item.get("parts", []))
+        for item in contents
+    )
+
+
+class FakeGenerativeModel:
+    """Answers like ``genai.GenerativeModel`` after ``latency``; streams a few words per chunk."""
+    latency = 0.0
+    chunk_delay = 0.0
+    reply_words = 60
+    calls = 0
+
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    def _reply(self, contents):
+        FakeGenerativeModel.calls += 1
+        return scripted_reply(_prompt(contents), self.reply_words)
+
+    def _chunks(self, text):
+        words = text.split(" ")
+        return [" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "") for i in range(0, len(words), 4)]
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        text = self._reply(contents)
+        if stream:
+            return _Stream(self._chunks(text), self.latency, self.chunk_delay)
+        time.sleep(self.latency)
+        return _Chunk(text)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        text = self._reply(contents)
+        if stream:
+            return _Stream(self._chunks(text), self.latency, self.chunk_delay)
+        await asyncio.sleep(self.latency)
+        return _Chunk(text)
+
+
+def _ms(name, default):
+    return float(os.environ.get(name, default)) / 1000.0
+
+
+def install():
+    """Patches the SDKs; call before the app creates its Supabase clients or LLM backend."""
+    import google.generativeai as genai
+    import supabase
+
+    tables = FakeTables(latency=_ms("BENCH_DB_LATENCY_MS", 5))
+    auth_latency = _ms("BENCH_AUTH_LATENCY_MS", 20)
+    supabase.create_client = lambda *args, **kwargs: FakeClient(tables, auth_latency)
+    supabase.AsyncClient = lambda *args, **kwargs: FakeAsyncClient(tables, auth_latency)
+
+    FakeGenerativeModel.latency = _ms("BENCH_LLM_LATENCY_MS", 300)
+    FakeGenerativeModel.chunk_delay = _ms("BENCH_LLM_CHUNK_DELAY_MS", 20)
+    FakeGenerativeModel.reply_words = int(os.environ.get("BENCH_LLM_REPLY_WORDS", 60))
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeGenerativeModel
+    return tables
@@ -0,0 +1,480 @@
+"""Throughput, latency and memory of the API under scripted workloads, without live services.
+
+Usage: python bench_service.py [--workloads predictions,chat,diet] [--concurrency 32]
+                               [--db-latency-ms 5] [--auth-latency-ms 20] [--llm-latency-ms 300]
+                               [--llm-chunk-delay-ms 20] [--seed 1] [--env KEY=VALUE ...]
+                               [--output bench_service.json] [--baseline OLD.json]
+
+The app runs in a child process against the fakes in bench_fakes.py
+(in-memory Supabase tables and auth, a scripted ``GenerativeModel``), each
+with the injected latency given here. Workloads:
+
+* predictions: a burst of single maternal and fetal predictions, with some
+  batch requests mixed in
+* chat: several users holding long chat sessions, some turns streamed
+* diet: a storm of diet plan requests over a small set of profiles
+
+For each endpoint the run reports requests/s and p50/p95/p99 latency (for
+streams also the time to the first event). Per workload it reports the
+child's RSS before, after and at its peak, its CPU use, and the mean time
+per stage taken from the server's ``/metrics``. Results are written as JSON; with
+``--baseline`` the p95 and requests/s of a previous run are compared.
+Requests are generated from ``--seed``, so two runs send the same traffic.
+
+The load generator shares the machine with the server. Give it a spare
+core: when the server's CPU share stays well below 100% while latency
+climbs, the client is the bottleneck, not the service.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+JWT_SECRET = "bench-secret-" + "x" * 32
+USERS = 50
+
+TRIMESTERS = ["first", "second", "third"]
+CONDITIONS = ["", "gestational diabetes", "anemia", "hypertension"]
+PREFERENCES = ["vegetarian", "non-vegetarian", "vegan", ""]
+QUESTIONS = [
+    "I feel tired all the time, is that normal?",
+    "What should I eat for breakfast this week?",
+    "How much water should I drink?",
+    "Is light exercise safe in my trimester?",
+    "My back hurts in the evening, any tips?",
+    "What are the warning signs I should watch for?",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time a process has used."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def serve(port):
+    """Child process: the app with the SDKs replaced by the fakes."""
+    import bench_fakes
+    bench_fakes.install()
+
+    import uvicorn
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+class MemorySampler:
+    """Peak RSS of a process, sampled in the background while a workload runs."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_mb(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def stage_totals(metrics_text):
+    """``{(route, stage): [seconds, count]}`` from the server's prenova_stage_seconds."""
+    totals = {}
+    for line in metrics_text.splitlines():
+        m = re.match(r'prenova_stage_seconds_(sum|count)\{route="([^"]*)",stage="([^"]*)"[^}]*\} (\S+)', line)
+        if m:
+            kind, route, stage, value = m.groups()
+            entry = totals.setdefault((route, stage), [0.0, 0])
+            entry[0 if kind == "sum" else 1] = float(value)
+    return totals
+
+
+class Bench:
+    def __init__(self, client, base_url, seed, concurrency):
+        import jwt
+
+        self.client = client
+        self.base_url = base_url
+        self.rng = random.Random(seed)
+        self.concurrency = concurrency
+        self.samples = {}  # endpoint -> [(seconds, ok)]
+        self._serial = 0
+        self._headers = [
+            {"Authorization": "Bearer " + jwt.encode(
+                {"sub": f"bench-user-{i}", "aud": "authenticated", "exp": int(time.time()) + 24 * 3600},
+                JWT_SECRET, algorithm="HS256")}
+            for i in range(USERS)
+        ]
+
+    def headers(self, user):
+        return self._headers[user % USERS]
+
+    def _record(self, endpoint, seconds, ok):
+        self.samples.setdefault(endpoint, []).append((seconds, ok))
+
+    async def call(self, endpoint, method, path, user, body=None):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, self.base_url + path, json=body,
+                                                 headers=self.headers(user))
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self._record(endpoint, time.perf_counter() - started, ok)
+        return response.json() if ok and response.status_code != 304 else None
+
+    async def stream(self, endpoint, path, user, body):
+        """Reads a server-sent event stream to the end, timing the first event and the whole."""
+        started = time.perf_counter()
+        first = None
+        ok = False
+        try:
+            async with self.client.stream("POST", self.base_url + path, json=body,
+                                          headers=self.headers(user)) as response:
+                async for line in response.aiter_lines():
+                    if first is None and line.startswith("data:"):
+                        first = time.perf_counter() - started
+                ok = response.status_code < 400
+        except Exception:
+            pass
+        self._record(endpoint, time.perf_counter() - started, ok)
+        if first is not None:
+            self._record(endpoint + " (first event)", first, ok)
+
+    async def run_all(self, jobs, concurrency=None):
+        """Runs the job coroutine functions with at most ``concurrency`` at a time."""
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        async def worker():
+            while not queue.empty():
+                await (queue.get_nowait())()
+
+        await asyncio.gather(*(worker() for _ in range(min(concurrency or self.concurrency, len(jobs)))))
+
+    def serial(self):
+        self._serial += 1
+        return self._serial
+
+
+def maternal_record(rng):
+    return {"age": rng.randint(18, 45), "systolic_bp": rng.randint(90, 160), "diastolic_bp": rng.randint(60, 100),
+            "blood_glucose": round(rng.uniform(6, 15), 1), "body_temp": round(rng.uniform(97, 102), 1),
+            "heart_rate": rng.randint(60, 100)}
+
+
+# Ranges of the 15 CTG features, in the order of predictions.FETAL_FEATURES
+FETAL_RANGES = [(106, 160), (0, 0.02), (0, 0.5), (0, 0.015), (0, 0.015), (0, 0.001), (0, 0.005),
+                (12, 87), (0.2, 7), (0, 91), (0, 50), (3, 180), (50, 159), (122, 238), (0, 18)]
+
+
+def fetal_features(rng):
+    return [round(rng.uniform(low, high), 4) for low, high in FETAL_RANGES]
+
+
+async def predictions(bench, args):
+    rng = bench.rng
+    jobs = []
+    for i in range(args.prediction_requests):
+        user, pick = i % USERS, rng.random()
+        if pick < 0.45:
+            body = maternal_record(rng)
+            jobs.append(lambda user=user, body=body: bench.call(
+                "POST /predict_maternal", "POST", "/predict_maternal", user, body))
+        elif pick < 0.9:
+            body = {"features": fetal_features(rng)}
+            jobs.append(lambda user=user, body=body: bench.call(
+                "POST /predict_fetal", "POST", "/predict_fetal", user, body))
+        else:
+            body = {"records": [maternal_record(rng) for _ in range(50)]}
+            jobs.append(lambda user=user, body=body: bench.call(
+                "POST /predict_maternal/batch", "POST", "/predict_maternal/batch", user, body))
+    await bench.run_all(jobs)
+
+
+async def chat(bench, args):
+    async def conversation(user, questions):
+        session = await bench.call("POST /chat/sessions", "POST", "/chat/sessions", user)
+        if session is None:
+            return
+        path = f"/chat/sessions/{session['id']}"
+        for turn, question in enumerate(questions):
+            if turn % 3 == 2:
+                await bench.stream("POST /chat/sessions/{id}/message/stream", path + "/message/stream", user,
+                                   {"message": question})
+            else:
+                await bench.call("POST /chat/sessions/{id}/message", "POST", path + "/message", user,
+                                 {"message": question})
+            if turn % 4 == 3:
+                await bench.call("GET /chat/sessions", "GET", "/chat/sessions?limit=20", user)
+        await bench.call("GET /chat/sessions/{id}", "GET", path + "?limit=50", user)
+
+    jobs = []
+    for i in range(args.chat_sessions):
+        questions = [bench.rng.choice(QUESTIONS) + f" ({bench.serial()})" for _ in range(args.chat_turns)]
+        jobs.append(lambda user=i, questions=questions: conversation(user, questions))
+    await bench.run_all(jobs)
+
+
+async def diet(bench, args):
+    rng = bench.rng
+    jobs = []
+    for i in range(args.diet_requests):
+        user, pick = i % USERS, rng.random()
+        body = {"trimester": rng.choice(TRIMESTERS), "weight": rng.randrange(50, 85, 5),
+                "health_conditions": rng.choice(CONDITIONS), "dietary_preference": rng.choice(PREFERENCES)}
+        if pick < 0.5:
+            jobs.append(lambda user=user, body=body: bench.call(
+                "POST /diet/sessions", "POST", "/diet/sessions", user, body))
+        elif pick < 0.8:
+            jobs.append(lambda user=user, body=body: bench.call(
+                "POST /diet_plan", "POST", "/diet_plan", user, body))
+        elif pick < 0.9:
+            jobs.append(lambda user=user, body=body: bench.stream(
+                "POST /diet_plan/stream", "/diet_plan/stream", user, body))
+        else:
+            jobs.append(lambda user=user: bench.call(
+                "GET /diet/sessions", "GET", "/diet/sessions?summary=1", user))
+    await bench.run_all(jobs)
+
+
+WORKLOADS = {"predictions": predictions, "chat": chat, "diet": diet}
+
+
+def fetch(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status, response.read().decode()
+
+
+def wait_ready(base_url, server, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            if fetch(base_url + "/readyz")[0] == 200:
+                return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"server was not ready after {timeout}s")
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for endpoint, values in sorted(samples.items()):
+        seconds = [s for s, _ in values]
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": sum(1 for _, ok in values if not ok),
+            "requests_per_s": len(values) / elapsed if elapsed else 0.0,
+            "mean_ms": 1000 * sum(seconds) / len(seconds),
+            **{f"p{int(q * 100)}_ms": 1000 * percentile(seconds, q) for q in (0.5, 0.95, 0.99)},
+        }
+    return endpoints
+
+
+async def run_workload(name, base_url, pid, args):
+    import httpx
+
+    before_stages = stage_totals(fetch(base_url + "/metrics")[1])
+    rss_before = rss_mb(pid)
+    cpu_before = cpu_seconds(pid)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        bench = Bench(client, base_url, f"{args.seed}-{name}", args.concurrency)
+        with MemorySampler(pid) as memory:
+            started = time.perf_counter()
+            await WORKLOADS[name](bench, args)
+            elapsed = time.perf_counter() - started
+    server_cpu = cpu_seconds(pid) - cpu_before
+    after_stages = stage_totals(fetch(base_url + "/metrics")[1])
+
+    stages = {}
+    for (route, stage), (seconds, count) in sorted(after_stages.items()):
+        old_seconds, old_count = before_stages.get((route, stage), (0.0, 0))
+        if count > old_count:
+            stages.setdefault(route, {})[stage] = 1000 * (seconds - old_seconds) / (count - old_count)
+
+    total = sum(len(v) for v in bench.samples.values())
+    return {
+        "duration_s": elapsed,
+        "requests": total,
+        "requests_per_s": total / elapsed if elapsed else 0.0,
+        # Near 1.0 the server is CPU-bound; well below, it waits on the fakes or the client
+        "server_cpu_share": server_cpu / elapsed if elapsed else 0.0,
+        "endpoints": summarize(bench.samples, elapsed),
+        "memory_mb": {"rss_before": rss_before, "rss_after": rss_mb(pid), "rss_peak": max(memory.peak, rss_before)},
+        "stage_mean_ms": stages,
+    }
+
+
+def print_workload(name, result):
+    memory = result["memory_mb"]
+    print(f"\n{name}: {result['requests']} requests in {result['duration_s']:.1f}s "
+          f"({result['requests_per_s']:.1f} req/s, server CPU {result['server_cpu_share']:.0%}), RSS {memory['rss_before']:.0f} -> {memory['rss_after']:.0f} MB "
+          f"(peak {memory['rss_peak']:.0f} MB)")
+    print(f"  {'endpoint':<52} {'n':>6} {'err':>4} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, e in result["endpoints"].items():
+        print(f"  {endpoint:<52} {e['requests']:>6} {e['errors']:>4} {e['requests_per_s']:>8.1f} "
+              f"{e['p50_ms']:>6.1f}ms {e['p95_ms']:>6.1f}ms {e['p99_ms']:>6.1f}ms")
+
+
+def compare(baseline, results):
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for name, result in results["workloads"].items():
+        old = baseline.get("workloads", {}).get(name)
+        if not old:
+            continue
+        for endpoint, e in result["endpoints"].items():
+            o = old["endpoints"].get(endpoint)
+            if not o:
+                continue
+            p95 = (e["p95_ms"] - o["p95_ms"]) / o["p95_ms"] * 100 if o["p95_ms"] else 0.0
+            rps = (e["requests_per_s"] - o["requests_per_s"]) / o["requests_per_s"] * 100 \
+                if o["requests_per_s"] else 0.0
+            print(f"  {name:<12} {endpoint:<52} p95 {o['p95_ms']:7.1f} -> {e['p95_ms']:7.1f}ms ({p95:+5.1f}%)  "
+                  f"req/s {o['requests_per_s']:7.1f} -> {e['requests_per_s']:7.1f} ({rps:+5.1f}%)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--prediction-requests", type=int, default=2000)
+    parser.add_argument("--chat-sessions", type=int, default=16)
+    parser.add_argument("--chat-turns", type=int, default=12)
+    parser.add_argument("--diet-requests", type=int, default=400)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--auth-latency-ms", type=float, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-chunk-delay-ms", type=float, default=20)
+    parser.add_argument("--seed", default="1")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the server, e.g. DIET_PLAN_MODE=llm")
+    parser.add_argument("--output", default="bench_service.json")
+    parser.add_argument("--baseline")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.port)
+        return 0
+
+    names = [name for name in args.workloads.split(",") if name]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+
+    scratch = tempfile.mkdtemp(prefix="bench-service-")
+    server_env = {
+        "SUPABASE_URL": "http://127.0.0.1:9",
+        "SUPABASE_KEY": "bench",
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "LLM_BACKEND": "gemini",
+        "GEMINI_API_KEY": "bench",
+        "WRITE_BEHIND_SPOOL_DIR": os.path.join(scratch, "spool"),
+        "DIET_CACHE_PATH": os.path.join(scratch, "diet_plans.sqlite3"),
+        "BENCH_DB_LATENCY_MS": str(args.db_latency_ms),
+        "BENCH_AUTH_LATENCY_MS": str(args.auth_latency_ms),
+        "BENCH_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "BENCH_LLM_CHUNK_DELAY_MS": str(args.llm_chunk_delay_ms),
+        "PYTHONWARNINGS": "ignore",
+    }
+    server_env.update(item.split("=", 1) for item in args.env)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    # The app finds models.json and diet_library.json relative to its directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, os.path.join(here, "bench_service.py"), "--serve", "--port", str(port)],
+                              env=dict(os.environ, **server_env), cwd=here, stdout=subprocess.DEVNULL)
+    results = {
+        "commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("serve", "port", "output", "baseline")},
+        "server_env": {k: v for k, v in server_env.items() if k not in ("WRITE_BEHIND_SPOOL_DIR", "DIET_CACHE_PATH")},
+        "workloads": {},
+    }
+    try:
+        wait_ready(base_url, server)
+        results["rss_ready_mb"] = rss_mb(server.pid)
+        for name in names:
+            result = asyncio.run(run_workload(name, base_url, server.pid, args))
+            results["workloads"][name] = result
+            print_workload(name, result)
+    finally:
+        server.terminate()
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Resident memory per worker of serve.py as the worker count grows.
+
+Usage: python bench_workers.py [--workers 1,2,4,8] [--requests 200] [--output FILE]
+
+For each worker count, serve.py is started once with preloading (models
+shared copy-on-write) and once with ``--no-preload`` (every worker loads its
+own copy). After the workers have served ``--requests`` maternal predictions,
+each process's RSS, PSS (shared pages divided among the processes mapping
+them) and private memory is read from /proc. Results are printed as a table
+and written as JSON.
+
+The servers run against a fake LLM and an unreachable Supabase URL; tokens are
+signed locally, so no external service is needed.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import jwt
+
+from serve import smaps_rollup
+
+JWT_SECRET = "bench-secret-" + "x" * 32
+BODY = {"age": 30, "systolic_bp": 120, "diastolic_bp": 80, "blood_glucose": 7,
+        "body_temp": 98, "heart_rate": 76}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name is in parentheses and may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def memory_mb(pid):
+    values = smaps_rollup(pid)
+    return {
+        "rss_mb": values.get("Rss", 0) / 1024,
+        "pss_mb": values.get("Pss", 0) / 1024,
+        "private_mb": (values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)) / 1024,
+    }
+
+
+def request(url, body=None, headers=None, timeout=10):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json", **(headers or {})})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return response.status
+
+
+def wait_ready(base_url, parent, workers, timeout=120):
+    """Waits until every worker exists and their memory has stopped growing."""
+    deadline = time.monotonic() + timeout
+    previous = None
+    while time.monotonic() < deadline:
+        time.sleep(1.0)
+        try:
+            request(base_url + "/")
+        except OSError:
+            continue
+        pids = children(parent)
+        if len(pids) < workers:
+            continue
+        current = [smaps_rollup(pid).get("Rss", 0) for pid in pids]
+        if current == previous:
+            return pids
+        previous = current
+    raise RuntimeError(f"{workers} workers were not ready after {timeout}s")
+
+
+def run(workers, preload, requests, env):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1",
+               "--port", str(port), "--log-level", "warning"]
+    if not preload:
+        command.append("--no-preload")
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(base_url, server.pid, workers)
+        token = jwt.encode({"sub": "bench", "aud": "authenticated", "exp": int(time.time()) + 3600},
+                           JWT_SECRET, algorithm="HS256")
+        headers = {"Authorization": f"Bearer {token}"}
+        started = time.perf_counter()
+        for i in range(requests):
+            # Vary the body so no request is answered from the idempotency store
+            request(base_url + "/predict_maternal", dict(BODY, heart_rate=60 + i % 40), headers)
+        elapsed = time.perf_counter() - started
+        pids = wait_ready(base_url, server.pid, workers)
+
+        per_worker = [memory_mb(pid) for pid in pids]
+        parent = memory_mb(server.pid)
+        mean = {k: sum(w[k] for w in per_worker) / len(per_worker) for k in per_worker[0]}
+        return {
+            "mode": "preload" if preload else "no-preload",
+            "workers": workers,
+            "requests": requests,
+            "requests_per_s": requests / elapsed if elapsed else 0.0,
+            "worker_mean": mean,
+            "parent": parent,
+            "total_pss_mb": parent["pss_mb"] + sum(w["pss_mb"] for w in per_worker),
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args(argv)
+
+    spool_dir = tempfile.mkdtemp(prefix="bench-spool-")
+    env = dict(
+        os.environ,
+        SUPABASE_URL="http://127.0.0.1:9",
+        SUPABASE_KEY="bench",
+        SUPABASE_JWT_SECRET=JWT_SECRET,
+        LLM_BACKEND="fake",
+        WRITE_BEHIND_SPOOL_DIR=spool_dir,
+        WRITE_BEHIND_MAX_RETRIES="0",
+        DIET_CACHE_PATH=os.path.join(spool_dir, "diet_plans.sqlite3"),
+    )
+
+    results = []
+    print(f"{'mode':<11} {'workers':>7} {'rss/worker':>11} {'pss/worker':>11} "
+          f"{'private/worker':>15} {'total pss':>10} {'req/s':>8}")
+    for workers in [int(n) for n in args.workers.split(",")]:
+        for preload in (True, False):
+            result = run(workers, preload, args.requests, env)
+            results.append(result)
+            mean = result["worker_mean"]
+            print(f"{result['mode']:<11} {workers:>7} {mean['rss_mb']:>9.1f}MB {mean['pss_mb']:>9.1f}MB "
+                  f"{mean['private_mb']:>13.1f}MB {result['total_pss_mb']:>8.1f}MB "
+                  f"{result['requests_per_s']:>8.1f}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Build the fused scaler+model predictors used by main.py.
+
+Usage: python build_compiled_models.py [--samples N] [--seed S]
+
+Each model/scaler pair is compiled with ``compiled_model.compile_pipeline``
+and checked against ``model.predict(scaler.transform(X))`` on a corpus of
+random rows plus rows sitting exactly on (and one ulp around) every folded
+split threshold. The ``.compiled.npz`` file is only written when every class
+label matches.
+"""
+import argparse
+import sys
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+from compiled_model import compile_pipeline, compiled_path_for, file_checksum
+
+PIPELINES = [
+    ("maternal", "finalized_maternal_model.sav", "scaleX.pkl"),
+    ("fetal", "fetal_health_model.sav", "scaleX1.pkl"),
+]
+
+
+def feature_bounds(scaler):
+    """Rough raw-space range of the training data, used to draw random rows."""
+    if hasattr(scaler, "data_min_"):
+        span = scaler.data_max_ - scaler.data_min_
+        return scaler.data_min_ - 0.1 * span, scaler.data_max_ + 0.1 * span
+    return scaler.mean_ - 4 * scaler.scale_, scaler.mean_ + 4 * scaler.scale_
+
+
+def build_corpus(predictor, scaler, samples, rng):
+    low, high = feature_bounds(scaler)
+    corpus = [rng.uniform(low, high, size=(samples, predictor.n_features))]
+
+    # Put rows right on the folded thresholds, where an inexact fold would flip a branch
+    finite = np.isfinite(predictor.threshold)
+    features = predictor.feature[finite]
+    thresholds = predictor.threshold[finite]
+    for shift in (-np.inf, 0, np.inf):
+        edge = rng.uniform(low, high, size=(len(thresholds), predictor.n_features))
+        with np.errstate(over="ignore"):
+            edge[np.arange(len(thresholds)), features] = np.nextafter(thresholds, shift) if shift else thresholds
+        # Drop rows the original scaler would overflow on
+        with np.errstate(over="ignore", invalid="ignore"):
+            in_range = np.isfinite(scaler.transform(edge)).all(axis=1)
+        corpus.append(edge[np.isfinite(edge).all(axis=1) & in_range])
+    return np.vstack(corpus)
+
+
+def build(name, model_path, scaler_path, samples, rng):
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+
+    predictor = compile_pipeline(model, scaler)
+    predictor.metadata = {
+        "name": name,
+        "model_sha256": file_checksum(model_path),
+        "scaler_sha256": file_checksum(scaler_path),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+    X = build_corpus(predictor, scaler, samples, rng)
+    expected = model.predict(scaler.transform(X))
+    actual = predictor.predict(X)
+    mismatches = int(np.count_nonzero(expected != actual))
+    print(f"{name}: {len(predictor.roots)} trees, {len(predictor.feature)} nodes, "
+          f"{len(X)} rows checked, {mismatches} mismatches")
+    if mismatches:
+        return False
+
+    path = compiled_path_for(model_path)
+    predictor.save(path)
+    print(f"{name}: wrote {path}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=20000,
+                        help="random rows per model in the validation corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore", category=UserWarning)
+    rng = np.random.default_rng(args.seed)
+    ok = all([build(name, m, s, args.samples, rng) for name, m, s in PIPELINES])
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""Build diet_library.json, the meal component library used by diet_library.py.
+
+Usage: python build_diet_library.py [--generate N] [--output PATH]
+
+Every component in the catalogue below is validated (schema, diet labels
+consistent with its items, no foods unsafe in pregnancy) and the library is
+checked to offer enough options for every meal, trimester and diet before
+it is written. ``--generate N`` additionally asks the configured LLM (see
+llm.py) for up to N new components per meal slot; they go through the same
+validation and invalid ones are reported and dropped.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+
+from diet_library import ALLERGENS, CONDITIONS, DIETS, SLOTS, TAGS, encode_library
+
+# slot, name, calories, diet, items, tags, avoid_for, allergens
+CATALOGUE = [
+    ("breakfast", "Vegetable Poha", 380, "vegan", ["Vegetable poha", "Roasted peanuts", "Lemon wedge"],
+     ["iron", "fiber"], [], ["peanut"]),
+    ("breakfast", "Oats Porridge", 420, "vegetarian", ["Oats cooked in milk", "Sliced banana", "Chopped almonds"],
+     ["fiber", "calcium"], [], ["dairy", "nuts"]),
+    ("breakfast", "Moong Dal Chilla", 350, "vegan", ["Moong dal chilla", "Mint chutney", "Fresh guava"],
+     ["protein", "iron", "folate", "low_gi"], [], []),
+    ("breakfast", "Eggs on Toast", 400, "eggetarian", ["Whole grain toast", "Scrambled eggs", "Fresh fruits"],
+     ["protein", "folate"], [], ["gluten", "egg"]),
+    ("breakfast", "Ragi Dosa", 360, "vegan", ["Ragi dosa", "Coconut chutney", "Sambar"],
+     ["calcium", "iron", "low_gi"], [], []),
+    ("breakfast", "Vegetable Upma", 380, "vegetarian", ["Vegetable upma", "Plain curd"],
+     ["fiber", "bland"], [], ["gluten", "dairy"]),
+    ("breakfast", "Yogurt Parfait", 350, "vegetarian", ["Greek yogurt", "Mixed berries", "Ground flaxseed"],
+     ["calcium", "protein", "omega3"], [], ["dairy"]),
+    ("breakfast", "Spinach Omelette", 420, "eggetarian", ["Spinach and cheese omelette", "Multigrain toast"],
+     ["protein", "iron", "calcium"], [], ["egg", "dairy", "gluten"]),
+    ("breakfast", "Tofu Scramble", 390, "vegan", ["Tofu and vegetable scramble", "Whole wheat roti"],
+     ["protein", "iron", "calcium"], [], ["soy", "gluten"]),
+    ("breakfast", "Idli Sambar", 340, "vegan", ["Steamed idli", "Sambar", "Coconut chutney"],
+     ["bland", "protein"], [], []),
+    ("breakfast", "Paneer Paratha", 480, "vegetarian", ["Paneer stuffed paratha", "Plain curd"],
+     ["protein", "calcium"], ["gestational_diabetes", "heartburn", "nausea"], ["dairy", "gluten"]),
+    ("breakfast", "Gentle Start", 280, "vegan", ["Dry whole wheat toast", "Banana", "Ginger tea"],
+     ["bland"], [], ["gluten"]),
+    ("breakfast", "Chicken Keema Toast", 450, "non_vegetarian", ["Chicken keema", "Multigrain toast", "Sliced cucumber"],
+     ["protein", "iron"], ["heartburn", "nausea"], ["gluten"]),
+    ("breakfast", "Quinoa Porridge", 380, "vegan", ["Quinoa cooked in almond milk", "Chopped dates", "Pumpkin seeds"],
+     ["iron", "fiber"], ["gestational_diabetes"], ["nuts"]),
+
+    ("lunch", "Rajma Rice Bowl", 520, "vegan", ["Rajma curry", "Brown rice", "Cucumber salad"],
+     ["protein", "iron", "fiber", "folate"], [], []),
+    ("lunch", "Dal Roti Thali", 540, "vegetarian", ["Dal", "Whole wheat roti", "Palak sabzi", "Plain curd"],
+     ["iron", "calcium", "folate", "protein"], [], ["dairy", "gluten"]),
+    ("lunch", "Grilled Chicken Plate", 550, "non_vegetarian", ["Grilled chicken", "Brown rice", "Steamed vegetables"],
+     ["protein"], [], []),
+    ("lunch", "Chickpea Quinoa Salad", 480, "vegan", ["Chickpeas", "Quinoa", "Mixed greens", "Olive oil dressing"],
+     ["protein", "fiber", "iron", "low_gi"], [], []),
+    ("lunch", "Paneer Tikka Plate", 530, "vegetarian", ["Paneer tikka", "Millet roti", "Green salad"],
+     ["protein", "calcium"], ["heartburn"], ["dairy"]),
+    ("lunch", "Rohu Fish Curry", 560, "pescatarian", ["Rohu fish curry", "Steamed rice", "Stir-fried greens"],
+     ["protein", "omega3"], ["heartburn"], ["fish"]),
+    ("lunch", "Egg Curry Plate", 520, "eggetarian", ["Egg curry", "Whole wheat roti", "Mixed vegetables"],
+     ["protein", "folate"], [], ["egg", "gluten"]),
+    ("lunch", "Moong Khichdi", 450, "vegetarian", ["Moong dal khichdi", "Plain curd", "Steamed carrots"],
+     ["bland", "protein"], [], ["dairy"]),
+    ("lunch", "Tofu Stir-fry", 480, "vegan", ["Tofu and vegetable stir-fry", "Brown rice"],
+     ["protein", "calcium", "iron"], [], ["soy"]),
+    ("lunch", "Lentil Soup and Sandwich", 470, "vegan", ["Lentil soup", "Whole wheat vegetable sandwich", "Green salad"],
+     ["protein", "fiber"], [], ["gluten"]),
+    ("lunch", "Chicken Soup and Bread", 430, "non_vegetarian", ["Chicken and vegetable soup", "Whole wheat bread"],
+     ["protein", "bland"], [], ["gluten"]),
+    ("lunch", "Sambar Rice", 500, "vegan", ["Sambar rice", "Beans poriyal", "Cucumber slices"],
+     ["fiber", "protein"], [], []),
+    ("lunch", "Baked Salmon Bowl", 560, "pescatarian", ["Baked salmon", "Quinoa", "Sauteed spinach"],
+     ["omega3", "protein", "iron"], [], ["fish"]),
+    ("lunch", "Vegetable Pulao", 520, "vegetarian", ["Vegetable pulao", "Cucumber raita", "Sprouts salad"],
+     ["fiber", "folate"], ["gestational_diabetes"], ["dairy"]),
+
+    ("dinner", "Moong Dal and Jowar Roti", 430, "vegan", ["Moong dal", "Jowar roti", "Lauki sabzi"],
+     ["protein", "low_gi", "bland"], [], []),
+    ("dinner", "Grilled Fish Plate", 470, "pescatarian", ["Grilled pomfret", "Baked sweet potato", "Steamed broccoli"],
+     ["omega3", "protein"], [], ["fish"]),
+    ("dinner", "Palak Paneer", 480, "vegetarian", ["Palak paneer", "Whole wheat roti"],
+     ["iron", "calcium", "protein"], [], ["dairy", "gluten"]),
+    ("dinner", "Chicken Stew", 500, "non_vegetarian", ["Chicken and vegetable stew", "Steamed rice"],
+     ["protein", "bland"], [], []),
+    ("dinner", "Daliya Khichdi", 400, "vegan", ["Vegetable daliya khichdi", "Cucumber slices"],
+     ["fiber", "bland", "low_gi"], [], ["gluten"]),
+    ("dinner", "Tofu Vegetable Curry", 450, "vegan", ["Tofu and vegetable curry", "Millet roti"],
+     ["protein", "calcium"], [], ["soy"]),
+    ("dinner", "Egg Bhurji", 440, "eggetarian", ["Egg bhurji", "Whole wheat roti", "Green salad"],
+     ["protein"], [], ["egg", "gluten"]),
+    ("dinner", "Mixed Dal Bowl", 440, "vegan", ["Mixed dal", "Brown rice", "Beans sabzi"],
+     ["protein", "iron", "fiber"], [], []),
+    ("dinner", "Methi Thepla", 420, "vegetarian", ["Methi thepla", "Plain curd", "Tomato salad"],
+     ["iron", "calcium", "folate"], [], ["dairy", "gluten"]),
+    ("dinner", "Chicken Quinoa Bowl", 480, "non_vegetarian", ["Shredded chicken", "Quinoa", "Roasted vegetables"],
+     ["protein", "iron"], [], []),
+    ("dinner", "Paneer Bhurji and Soup", 430, "vegetarian", ["Vegetable soup", "Paneer bhurji", "Multigrain toast"],
+     ["protein", "calcium"], [], ["dairy", "gluten"]),
+    ("dinner", "Chana Masala", 490, "vegan", ["Chana masala", "Brown rice", "Onion salad"],
+     ["protein", "iron", "fiber"], ["heartburn"], []),
+
+    ("snack", "Roasted Chana", 150, "vegan", ["Roasted chana"], ["protein", "iron"], [], []),
+    ("snack", "Fruit Bowl", 120, "vegan", ["Apple slices", "Pear slices"], ["fiber", "bland"], [], []),
+    ("snack", "Yogurt with Walnuts", 200, "vegetarian", ["Greek yogurt", "Walnuts"],
+     ["calcium", "protein", "omega3"], [], ["dairy", "nuts"]),
+    ("snack", "Nut Mix", 180, "vegan", ["Almonds", "Walnuts"], ["omega3", "protein"], [], ["nuts"]),
+    ("snack", "Buttermilk", 80, "vegetarian", ["Buttermilk (chaas)"], ["calcium", "bland"], [], ["dairy"]),
+    ("snack", "Sprouts Chaat", 160, "vegan", ["Moong sprouts chaat"], ["protein", "folate", "fiber"], ["heartburn"], []),
+    ("snack", "Boiled Egg", 80, "eggetarian", ["Hard-boiled egg"], ["protein"], [], ["egg"]),
+    ("snack", "Hummus and Veggies", 180, "vegan", ["Hummus", "Carrot sticks", "Cucumber sticks"],
+     ["protein", "fiber"], [], []),
+    ("snack", "Dates and Figs", 160, "vegan", ["Dates", "Dried figs"], ["iron", "fiber"], ["gestational_diabetes"], []),
+    ("snack", "Roasted Makhana", 120, "vegan", ["Roasted makhana"], ["calcium", "bland", "low_gi"], [], []),
+    ("snack", "Banana and Peanut Butter", 220, "vegan", ["Banana", "Peanut butter"], ["protein", "bland"], [], ["peanut"]),
+    ("snack", "Turmeric Milk", 150, "vegetarian", ["Warm turmeric milk"], ["calcium", "bland"], [], ["dairy"]),
+    ("snack", "Crackers and Cheese", 180, "vegetarian", ["Whole wheat crackers", "Pasteurized cheese"],
+     ["calcium"], ["hypertension"], ["dairy", "gluten"]),
+    ("snack", "Coconut Water and Rice Crackers", 120, "vegan", ["Coconut water", "Rice crackers"], ["bland"], [], []),
+    ("snack", "Soy Smoothie", 190, "vegan", ["Soy milk", "Mixed berries"], ["protein", "calcium"], [], ["soy"]),
+    ("snack", "Chicken Soup Cup", 120, "non_vegetarian", ["Clear chicken soup"], ["protein", "bland"], [], []),
+]
+
+GUIDANCE = {
+    "calorie_extra": {"1": 0, "2": 340, "3": 450},
+    "key_nutrients": {
+        "1": ["Folic Acid", "Iron", "Vitamin B6", "Protein", "Iodine"],
+        "2": ["Calcium", "Iron", "Protein", "Omega-3", "Vitamin D"],
+        "3": ["Iron", "Calcium", "Protein", "Omega-3", "Fiber"],
+    },
+    "foods_to_avoid": {
+        "all": ["Raw fish", "Unpasteurized dairy", "High mercury fish", "Raw eggs", "Deli meats", "Alcohol"],
+        "gestational_diabetes": ["Sugary drinks", "Sweets and desserts", "Refined flour snacks"],
+        "hypertension": ["Pickles and papad", "Salty packaged snacks", "Processed meats"],
+        "heartburn": ["Spicy and fried foods", "Citrus on an empty stomach", "Late heavy dinners"],
+    },
+    "tips": {
+        "all": [
+            "Stay hydrated by drinking 8-10 glasses of water daily",
+            "Include a variety of colorful fruits and vegetables",
+            "Limit caffeine to 200mg per day",
+        ],
+        "1": ["Eat small, frequent meals to help with nausea", "Keep plain crackers nearby for queasy mornings"],
+        "2": ["Add a calcium-rich food to every meal", "Gentle daily walks help digestion and energy"],
+        "3": ["Eat smaller portions more often as space gets tight", "Choose whole grains over refined grains"],
+        "gestational_diabetes": ["Spread carbohydrates evenly across meals and snacks",
+                                 "Pair carbohydrates with protein or fiber"],
+        "hypertension": ["Keep added salt low and check labels for sodium"],
+        "anemia": ["Pair iron-rich foods with vitamin C (lemon, guava, tomato)",
+                   "Avoid tea or coffee within an hour of iron-rich meals"],
+        "nausea": ["Try ginger tea or dry toast before getting up", "Avoid strong smells and greasy food"],
+        "heartburn": ["Stay upright for an hour after eating", "Finish dinner 2-3 hours before bed"],
+        "constipation": ["Increase fiber gradually and drink extra water", "Soaked raisins or prunes can help"],
+    },
+    "supplements": {
+        "all": [
+            {"name": "Prenatal Vitamin", "dosage": "1 tablet daily", "reason": "Comprehensive nutrition support"},
+            {"name": "Iron", "dosage": "27 mg daily", "reason": "Prevents anemia"},
+        ],
+        "1": [{"name": "Folic Acid", "dosage": "400-800 mcg daily", "reason": "Prevents neural tube defects"}],
+        "2": [
+            {"name": "Calcium", "dosage": "1000 mg daily", "reason": "Supports baby's bone development"},
+            {"name": "DHA (Omega-3)", "dosage": "200 mg daily", "reason": "Supports brain and eye development"},
+        ],
+        "3": [
+            {"name": "Calcium", "dosage": "1000 mg daily", "reason": "Supports baby's bone development"},
+            {"name": "DHA (Omega-3)", "dosage": "200 mg daily", "reason": "Supports brain and eye development"},
+        ],
+        "anemia": [{"name": "Iron", "dosage": "As prescribed by your doctor",
+                    "reason": "Treatment doses are usually higher than the preventive 27 mg"}],
+        "gestational_diabetes": [{"name": "Vitamin D", "dosage": "As advised by your doctor",
+                                  "reason": "Often low in gestational diabetes"}],
+    },
+}
+
+# Minimum options per slot:trimester:diet (two plan variants, two snacks each)
+MIN_OPTIONS = {"breakfast": 2, "lunch": 2, "dinner": 2, "snack": 4}
+
+UNSAFE = re.compile(r"\braw\b|sushi|unpasteuri[sz]ed|\bliver\b|shark|swordfish|king mackerel|tilefish|"
+                    r"alcohol|\bwine\b|\bbeer\b|papaya|pineapple|smoked salmon|\bpate\b|soft cheese|brie|camembert")
+MEAT = re.compile(r"chicken|mutton|lamb|beef|pork|bacon|\bham\b|keema")
+FISH = re.compile(r"fish|salmon|pomfret|rohu|prawn|shrimp|tuna|sardine")
+EGG = re.compile(r"\beggs?\b|omelette|bhurji")
+# Allergen classes and what declares them in a component's name and items
+ALLERGEN_ITEMS = {
+    "dairy": re.compile(r"(?<!almond )(?<!soy )(?<!coconut )(?<!oat )milk|curd|yogurt|paneer|cheese|ghee|"
+                        r"(?<!peanut )butter|chaas|raita|cream|kheer"),
+    "gluten": re.compile(r"wheat|roti|toast|bread|paratha|thepla|daliya|upma|crackers|sandwich"),
+    "nuts": re.compile(r"almond|walnut|cashew|pistachio|hazelnut|\bnuts?\b"),
+    "peanut": re.compile(r"peanut|groundnut"),
+    "egg": EGG,
+    "soy": re.compile(r"\bsoy|tofu"),
+    "fish": FISH,
+    "pork": re.compile(r"pork|bacon|\bham\b"),
+}
+# Phrases that look like an allergen or egg dish but aren't
+NOT_ALLERGENS = re.compile(r"(jowar|millet|ragi|bajra) roti|rice crackers|paneer bhurji")
+
+# Free-text preferences and what parse_preference must make of them: the diet
+# level and the allergens that must be excluded. Checked on every build, and the
+# plans assembled for them must not contain anything the text rules out.
+PREFERENCE_CASES = [
+    ("", "non_vegetarian", []),
+    ("non-veg", "non_vegetarian", []),
+    ("I eat chicken and fish", "non_vegetarian", []),
+    ("vegan", "vegan", []),
+    ("plant based, no dairy", "vegan", ["dairy"]),
+    ("vegetarian", "vegetarian", []),
+    ("pure veg", "vegetarian", []),
+    ("vegetarian, no fish", "vegetarian", ["fish"]),
+    ("I don't eat meat", "vegetarian", []),
+    ("I don’t eat meat", "vegetarian", []),
+    ("vegetarian, I hate chicken", "vegetarian", []),
+    ("i avoid chicken and mutton", "vegetarian", []),
+    ("no eggs, vegetarian", "vegetarian", ["egg"]),
+    ("vegetarian but eggs ok", "eggetarian", []),
+    ("eggetarian", "eggetarian", []),
+    ("I don't eat meat or fish, but eggs are fine", "eggetarian", ["fish"]),
+    ("no fish", "non_vegetarian", ["fish"]),
+    ("vegan, eggs ok", "vegan", []),
+    ("pescatarian", "pescatarian", []),
+    ("no meat, fish is fine", "pescatarian", []),
+    ("I eat everything except pork", "non_vegetarian", ["pork"]),
+    ("allergic to milk and nuts", "non_vegetarian", ["dairy", "nuts", "peanut"]),
+    ("allergic to milk, nuts and soy", "non_vegetarian", ["dairy", "nuts", "peanut", "soy"]),
+    ("allergic to dairy, eat nuts", "non_vegetarian", ["dairy"]),
+    ("allergic to nuts, eat dairy", "non_vegetarian", ["nuts", "peanut"]),
+    ("vegetarian, peanut allergy", "vegetarian", ["peanut"]),
+    ("vegan, no soy or gluten", "vegan", ["soy", "gluten"]),
+    ("gluten-free, no eggs and no fish", "non_vegetarian", ["gluten", "egg", "fish"]),
+    ("lactose intolerant vegetarian", "vegetarian", ["dairy"]),
+]
+# Allergies the library can't check; assemble must refuse them so the LLM handles them
+UNRECOGNIZED_CASES = ["allergic to strawberries", "vegetarian, allergic to nuts and kiwi", "sesame allergy"]
+
+
+def check_preferences(library):
+    """Returns the PREFERENCE_CASES that parse or assemble wrongly."""
+    from diet_library import DietLibrary, parse_preference
+
+    plans = DietLibrary(library)
+    problems = []
+    for text, diet, allergens in PREFERENCE_CASES:
+        level, allergen_mask = parse_preference(text)
+        parsed = [a for i, a in enumerate(ALLERGENS) if allergen_mask >> i & 1]
+        if DIETS[level] != diet or sorted(parsed) != sorted(allergens):
+            problems.append(f"{text!r}: parsed as {DIETS[level]} {parsed}, expected {diet} {allergens}")
+            continue
+        plan = plans.assemble(2, 65, "", text)
+        for meal_plan in plan["meal_plans"]:
+            meals = meal_plan["meals"]
+            items = " ".join(
+                " ".join([meal["name"]] + meal["items"]).lower()
+                for meal in [meals["breakfast"], meals["lunch"], meals["dinner"]] + meals["snacks"]
+            )
+            items = NOT_ALLERGENS.sub("", items)
+            excluded = [ALLERGEN_ITEMS[a] for a in allergens]
+            if level < DIETS.index("non_vegetarian"):
+                excluded.append(MEAT)
+            if level < DIETS.index("pescatarian"):
+                excluded.append(FISH)
+            if level < DIETS.index("eggetarian"):
+                excluded.append(EGG)
+            found = next((m for m in (pattern.search(items) for pattern in excluded) if m), None)
+            if found:
+                problems.append(f"{text!r}: plan contains {found.group(0)}")
+    for text in UNRECOGNIZED_CASES:
+        try:
+            plans.assemble(2, 65, "", text)
+        except LookupError:
+            continue
+        problems.append(f"{text!r}: assembled a plan for an allergy the library can't check")
+    return problems
+
+
+def as_dict(entry):
+    slot, name, calories, diet, items, tags, avoid_for, allergens = entry
+    return {"slot": slot, "name": name, "calories": calories, "diet": diet, "items": items,
+            "tags": tags, "avoid_for": avoid_for, "allergens": allergens}
+
+
+def validate_component(c):
+    """Returns a list of problems with one component (empty when it's valid)."""
+    errors = []
+    for field, kind in (("slot", str), ("name", str), ("calories", int), ("diet", str), ("items", list)):
+        if not isinstance(c.get(field), kind):
+            errors.append(f"{field} must be {kind.__name__}")
+    if errors:
+        return errors
+    if c["slot"] not in SLOTS:
+        errors.append(f"unknown slot {c['slot']!r}")
+    if c["diet"] not in DIETS:
+        errors.append(f"unknown diet {c['diet']!r}")
+    if not 50 <= c["calories"] <= 900:
+        errors.append(f"calories {c['calories']} out of range")
+    if not c["items"] or not all(isinstance(item, str) and item.strip() for item in c["items"]):
+        errors.append("items must be non-empty strings")
+    for field, vocab in (("tags", TAGS), ("avoid_for", CONDITIONS), ("allergens", ALLERGENS)):
+        unknown = set(c.get(field, [])) - set(vocab)
+        if unknown:
+            errors.append(f"unknown {field}: {sorted(unknown)}")
+    if errors:
+        return errors
+
+    text = " ".join([c["name"]] + c["items"]).lower()
+    if UNSAFE.search(text):
+        errors.append(f"contains a food to avoid in pregnancy ({UNSAFE.search(text).group(0)})")
+    text = NOT_ALLERGENS.sub("", text)
+    level = DIETS.index(c["diet"])
+    if MEAT.search(text) and c["diet"] != "non_vegetarian":
+        errors.append(f"{MEAT.search(text).group(0)} in a {c['diet']} component")
+    if FISH.search(text) and level < DIETS.index("pescatarian"):
+        errors.append(f"{FISH.search(text).group(0)} in a {c['diet']} component")
+    if FISH.search(text) and not MEAT.search(text) and c["diet"] == "non_vegetarian":
+        errors.append("fish without meat should be pescatarian")
+    if EGG.search(text) and level < DIETS.index("eggetarian"):
+        errors.append(f"egg in a {c['diet']} component")
+    if ALLERGEN_ITEMS["dairy"].search(text) and level == 0:
+        errors.append("dairy in a vegan component")
+    for allergen, pattern in ALLERGEN_ITEMS.items():
+        if pattern.search(text) and allergen not in c.get("allergens", []):
+            errors.append(f"{allergen} not declared as allergen ({pattern.search(text).group(0)})")
+    return errors
+
+
+def check_coverage(library):
+    problems = []
+    for slot, minimum in MIN_OPTIONS.items():
+        for trimester in (1, 2, 3):
+            for diet in DIETS:
+                count = len(library["index"].get(f"{slot}:{trimester}:{diet}", []))
+                if count < minimum:
+                    problems.append(f"{slot}:{trimester}:{diet} has {count} options, needs {minimum}")
+    return problems
+
+
+def generate_components(slot, count):
+    """Asks the LLM for new components for ``slot``; returns the parsed dicts."""
+    from llm import LLMGateway
+
+    prompt = (
+        f"Suggest {count} Indian or international {slot} options that are safe and nutritious during "
+        "pregnancy. Reply with one JSON object per line and nothing else, each with keys: "
+        f'"slot" ("{slot}"), "name", "calories" (integer), "diet" (one of {DIETS}), "items" (list of strings), '
+        f'"tags" (subset of {TAGS}), "avoid_for" (subset of {CONDITIONS}), "allergens" (subset of {ALLERGENS}).'
+    )
+    text = LLMGateway.from_env().generate(prompt, timeout=120)
+    components = []
+    for line in text.splitlines():
+        line = line.strip().rstrip(",")
+        if line.startswith("{"):
+            try:
+                components.append(json.loads(line))
+            except ValueError:
+                print(f"  skipping unparseable line: {line[:80]}")
+    return components
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--generate", type=int, default=0, metavar="N",
+                        help="ask the LLM for up to N extra components per meal slot")
+    parser.add_argument("--output", default="diet_library.json")
+    args = parser.parse_args()
+
+    components = [as_dict(entry) for entry in CATALOGUE]
+    invalid = 0
+    for c in components:
+        errors = validate_component(c)
+        if errors:
+            invalid += 1
+            print(f"{c['name']}: {'; '.join(errors)}")
+    if invalid:
+        print(f"{invalid} catalogue components are invalid")
+        return 1
+
+    if args.generate:
+        names = {c["name"].lower() for c in components}
+        for slot in SLOTS:
+            accepted = 0
+            for c in generate_components(slot, args.generate):
+                errors = validate_component(c)
+                if errors or c.get("slot") != slot or c["name"].lower() in names:
+                    print(f"  rejected {c.get('name')!r}: {'; '.join(errors) or 'duplicate or wrong slot'}")
+                    continue
+                names.add(c["name"].lower())
+                components.append(c)
+                accepted += 1
+            print(f"{slot}: accepted {accepted} generated components")
+
+    library = encode_library(components, GUIDANCE, built_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    problems = check_coverage(library) + check_preferences(library)
+    if problems:
+        print("\n".join(problems))
+        return 1
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(library, f, separators=(",", ":"))
+    print(f"wrote {args.output}: {len(components)} components, {len(library['strings'])} strings, "
+          f"{len(library['index'])} index keys")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Bounded prompt context for the chat endpoints.
+
+Instead of sending a session's whole history to Gemini on every turn, the
+prompt is built from the system prompt, a rolling summary of older turns and
+the most recent turns verbatim. The summary covers every message up to
+``context_summary_seq`` and is stored on the session row (see
+``sql/chat_context_summary.sql``), which the chat endpoints read anyway, so
+it needs no cache of its own. It is only regenerated when enough turns have
+slid out of the verbatim window, so most turns cost one small read and no
+extra LLM call. Prompt sizes go to the per-request metrics
+(``chat_prompt_tokens``, ``chat_messages_omitted``).
+
+``summarize`` is a coroutine function and ``client`` an async Supabase client.
+"""
+import os
+import threading
+
+from metrics import count, span
+
+# Messages per summarization call when folding a long backlog (e.g. a migrated session)
+FOLD_CHUNK = 40
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+class ChatContextManager:
+    def __init__(self, store, client, summarize, system_prompt="", keep_turns=6,
+                 fold_turns=4, max_prompt_tokens=6000, max_summary_tokens=400,
+                 token_counter=estimate_tokens):
+        self.store = store
+        self.client = client
+        self.summarize = summarize
+        self.system_prompt = system_prompt
+        self.keep_turns = keep_turns
+        self.fold_turns = fold_turns
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.count_tokens = token_counter
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "prompt_tokens_total": 0,
+            "prompt_tokens_max": 0,
+            "messages_in_prompt": 0,
+            "messages_omitted": 0,
+            "summaries_generated": 0,
+        }
+
+    @classmethod
+    def from_env(cls, store, client, summarize, system_prompt=""):
+        return cls(
+            store, client, summarize, system_prompt=system_prompt,
+            keep_turns=int(os.environ.get("CHAT_CONTEXT_KEEP_TURNS", 6)),
+            fold_turns=int(os.environ.get("CHAT_CONTEXT_FOLD_TURNS", 4)),
+            max_prompt_tokens=int(os.environ.get("CHAT_CONTEXT_MAX_TOKENS", 6000)),
+            max_summary_tokens=int(os.environ.get("CHAT_CONTEXT_SUMMARY_TOKENS", 400)),
+        )
+
+    # --- summary ---
+
+    async def _store_summary(self, session_id, summary, upto):
+        # Never replace a summary another worker has already taken further
+        await self.client.table('chat_sessions').update({
+            'context_summary': summary,
+            'context_summary_seq': upto,
+        }).eq('id', session_id).lt('context_summary_seq', upto).execute()
+        with self._lock:
+            self._counters["summaries_generated"] += 1
+
+    async def _fold(self, session_id, summary, upto, until):
+        """Folds messages with ``upto < seq < until`` into the summary."""
+        rows = await self.store.between(session_id, after=upto, before=until)
+        for start in range(0, len(rows), FOLD_CHUNK):
+            messages = [{'role': r['role'], 'content': r['content']} for r in rows[start:start + FOLD_CHUNK]]
+            summary = await self.summarize(summary, messages, self.max_summary_tokens)
+        # Hard cap in case the model ignores the requested length
+        summary = summary[:self.max_summary_tokens * 4]
+        upto = rows[-1]['seq'] if rows else upto
+        await self._store_summary(session_id, summary, upto)
+        return summary, upto
+
+    # --- prompt assembly ---
+
+    async def context_for(self, session, user_msg):
+        """Returns ``(summary, recent_messages)`` to put between the system
+        prompt and ``user_msg`` (which is not stored yet)."""
+        session_id = session['id']
+        summary = session.get('context_summary') or ""
+        upto = session.get('context_summary_seq') or 0
+
+        window = 2 * (self.keep_turns + self.fold_turns)
+        rows, _ = await self.store.page(session_id, limit=window)
+        last_seq = rows[-1]['seq'] if rows else 0
+        unsummarized = [r for r in rows if r['seq'] > upto]
+
+        # Up to keep_turns + fold_turns turns stay verbatim; once the window is
+        # full of unsummarized messages the oldest fold_turns turns (and anything
+        # older, for migrated sessions) are folded into the summary.
+        if len(unsummarized) >= window:
+            verbatim = unsummarized[-2 * self.keep_turns:]
+            try:
+                with span('chat_summary'):
+                    summary, upto = await self._fold(session_id, summary, upto, verbatim[0]['seq'])
+                unsummarized = verbatim
+            except Exception as e:
+                # Keep the previous summary; the token budget below still applies
+                print(f"Failed to update chat summary for {session_id}: {e}")
+
+        recent = [{'role': r['role'], 'content': r['content']} for r in unsummarized]
+
+        # Enforce the token budget by dropping the oldest verbatim messages first
+        fixed = self.count_tokens(self.system_prompt) + self.count_tokens(user_msg['content'])
+        if summary:
+            fixed += self.count_tokens(summary)
+        sizes = [self.count_tokens(m['content']) for m in recent]
+        while recent and fixed + sum(sizes) > self.max_prompt_tokens:
+            recent.pop(0)
+            sizes.pop(0)
+        prompt_tokens = fixed + sum(sizes)
+
+        with self._lock:
+            c = self._counters
+            c["requests"] += 1
+            c["prompt_tokens_total"] += prompt_tokens
+            c["prompt_tokens_max"] = max(c["prompt_tokens_max"], prompt_tokens)
+            c["messages_in_prompt"] += len(recent) + 1
+            c["messages_omitted"] += last_seq - len(recent)
+        count("chat_prompt_tokens", prompt_tokens)
+        count("chat_messages_omitted", last_seq - len(recent))
+        return summary, recent
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        requests = stats["requests"]
+        stats["prompt_tokens_avg"] = stats["prompt_tokens_total"] / requests if requests else 0.0
+        return stats
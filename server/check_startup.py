@@ -0,0 +1,149 @@
+"""Checks startup against its time budgets; exits non-zero when one is exceeded.
+
+Usage: python check_startup.py [--runs 3] [--import-budget S] [--first-request-budget S]
+                               [--ready-budget S] [--output FILE]
+
+Measured in fresh interpreters, each a median over ``--runs``:
+
+* import: ``import main``
+* first request: from starting ``uvicorn main:app`` until ``/healthz`` answers
+* ready: from starting the server until ``/readyz`` answers 200
+
+The servers run with the fake LLM and an unreachable Supabase URL, so the
+numbers cover our own startup work and not network latency. Budgets default
+to ``STARTUP_*_BUDGET_S`` from the environment. ``tests/test_startup.py``
+runs the same measurement under pytest, so the suite fails when a budget
+is exceeded.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_import(env):
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, cwd=SERVER_DIR,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_server(env, timeout=120):
+    """Seconds from launching the server to the first /healthz and the first ready /readyz."""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env, cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_request = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if first_request is None and status(base_url + "/healthz") == 200:
+                first_request = time.perf_counter() - started
+            if first_request is not None and status(base_url + "/readyz") == 200:
+                ready = time.perf_counter() - started
+                break
+            time.sleep(0.02)
+    finally:
+        server.terminate()
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    if ready is None:
+        raise RuntimeError(f"server was not ready after {timeout}s")
+    return first_request, ready
+
+
+def default_budgets():
+    return {
+        "import_s": float(os.environ.get("STARTUP_IMPORT_BUDGET_S", 1.5)),
+        "first_request_s": float(os.environ.get("STARTUP_FIRST_REQUEST_BUDGET_S", 2.0)),
+        "ready_s": float(os.environ.get("STARTUP_READY_BUDGET_S", 3.0)),
+    }
+
+
+def measure(runs=3):
+    """Median import, first-request and ready times over ``runs`` fresh starts."""
+    imports, first_requests, readies = [], [], []
+    with tempfile.TemporaryDirectory(prefix="startup-check-") as scratch:
+        env = dict(
+            os.environ,
+            SUPABASE_URL="http://127.0.0.1:9",
+            SUPABASE_KEY="startup-check",
+            LLM_BACKEND="fake",
+            WRITE_BEHIND_SPOOL_DIR=scratch,
+            DIET_CACHE_PATH=os.path.join(scratch, "diet_plans.sqlite3"),
+            PYTHONWARNINGS="ignore",
+        )
+        for _ in range(runs):
+            imports.append(measure_import(env))
+            first_request, ready = measure_server(env)
+            first_requests.append(first_request)
+            readies.append(ready)
+
+    return {
+        "import_s": statistics.median(imports),
+        "first_request_s": statistics.median(first_requests),
+        "ready_s": statistics.median(readies),
+    }
+
+
+def main(argv=None):
+    defaults = default_budgets()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--import-budget", type=float, default=defaults["import_s"])
+    parser.add_argument("--first-request-budget", type=float, default=defaults["first_request_s"])
+    parser.add_argument("--ready-budget", type=float, default=defaults["ready_s"])
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    budgets = {
+        "import_s": args.import_budget,
+        "first_request_s": args.first_request_budget,
+        "ready_s": args.ready_budget,
+    }
+    failed = False
+    for name, value in results.items():
+        ok = value <= budgets[name]
+        failed |= not ok
+        print(f"{name:<16} {value:6.2f}s  budget {budgets[name]:5.2f}s  {'ok' if ok else 'OVER BUDGET'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "budgets": budgets, "runs": args.runs}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""CTG summary features from raw fetal heart rate and contraction signals.
+
+Bedside monitors sample fetal heart rate (FHR, bpm), uterine contractions
+(UC, toco units) and optionally a fetal movement marker at a few Hz.
+``CTGStream`` takes those samples in chunks of any size, averages them into
+1-second epochs and keeps the last ``window_s`` epochs in fixed ring
+buffers, so a session holds the same few arrays however long it runs.
+
+The FHR histogram and the short-term variability sums are updated as
+epochs enter and leave the ring. Episode detection (accelerations,
+decelerations, contractions) and long-term variability run over the ring
+with NumPy when a score is due, every ``score_every_s`` seconds of signal.
+``features()`` returns the 15 inputs of the fetal model in
+``FETAL_FEATURES`` order, with the units of the training data: episode
+counts are per second, variability percentages are of the window's time.
+
+Definitions (SisPorto style, on 1-second epochs):
+
+* FHR outside 50-210 bpm is signal loss; windows with less than
+  ``min_signal_s`` seconds of signal are not scored
+* baseline: mean of the epochs within 10 bpm of the histogram's mode
+* acceleration: at least 15 s above baseline + 15 bpm
+* deceleration: at least 15 s below baseline - 15 bpm; prolonged from 2
+  minutes, severe when shorter but deeper than 45 bpm, light otherwise
+* contraction: at least 30 s above the resting tone (10th percentile) + 15
+* short-term variability: change between successive epochs, abnormal
+  below 1 bpm
+* long-term variability: range of each full minute, abnormal below 5 bpm
+"""
+import os
+
+import numpy as np
+
+from predictions import FETAL_FEATURES
+
+SAMPLE_RATE_HZ = 4
+# Monitors sample at 1-4 Hz; a higher rate would only grow the partial epoch
+MAX_SAMPLE_RATE_HZ = 16
+FHR_MIN, FHR_MAX = 50, 210
+MAX_CHUNK_SAMPLES = 4 * 60 * 5
+
+EPISODE_RISE = 15
+ACCELERATION_S = 15
+DECELERATION_S = 15
+PROLONGED_S = 120
+SEVERE_DEPTH = 45
+CONTRACTION_RISE = 15
+CONTRACTION_S = 30
+ABNORMAL_STV = 1.0
+ABNORMAL_LTV = 5.0
+
+
+class StreamError(ValueError):
+    """Raised for a malformed chunk of samples."""
+
+
+def _runs(mask):
+    """Start and end (exclusive) of every run of True in ``mask``."""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _channel(values, name, n=None):
+    try:
+        array = np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        raise StreamError(f"{name} must be a list of numbers")
+    if array.ndim != 1:
+        raise StreamError(f"{name} must be a list of numbers")
+    if n is not None and len(array) != n:
+        raise StreamError(f"{name} must have as many samples as fhr")
+    return array
+
+
+class CTGStream:
+    """Sliding-window state of one monitoring session."""
+
+    def __init__(self, window_s=600, score_every_s=60, min_signal_s=300, sample_rate=SAMPLE_RATE_HZ):
+        self.window_s = window_s
+        self.score_every_s = score_every_s
+        self.min_signal_s = min(min_signal_s, window_s)
+        self.sample_rate = min(max(int(sample_rate), 1), MAX_SAMPLE_RATE_HZ)
+
+        self.fhr = np.full(window_s, np.nan)
+        self.uc = np.full(window_s, np.nan)
+        self.fm = np.zeros(window_s, dtype=bool)
+        # |change| from the previous epoch, stored at the later epoch's slot
+        self.stv = np.full(window_s, np.nan)
+        self.seconds = 0
+        self.next_score = self.min_signal_s
+        self._pending = (np.empty(0), np.empty(0), np.empty(0, dtype=bool))
+        self._last_fhr = np.nan
+
+        # Kept up to date as epochs enter and leave the window
+        self.hist = np.zeros(FHR_MAX - FHR_MIN + 1, dtype=np.int64)
+        self.signal_s = 0
+        self.stv_sum = 0.0
+        self.stv_n = 0
+        self.stv_low = 0
+
+    @classmethod
+    def from_env(cls, sample_rate=SAMPLE_RATE_HZ):
+        return cls(
+            window_s=int(os.environ.get("CTG_STREAM_WINDOW_S", 600)),
+            score_every_s=int(os.environ.get("CTG_STREAM_SCORE_EVERY_S", 60)),
+            min_signal_s=int(os.environ.get("CTG_STREAM_MIN_SIGNAL_S", 300)),
+            sample_rate=sample_rate,
+        )
+
+    def add(self, fhr, uc, fm=None):
+        """Appends a chunk of samples; returns the number of whole seconds it completed."""
+        fhr = _channel(fhr, "fhr")
+        if len(fhr) > MAX_CHUNK_SAMPLES:
+            raise StreamError(f"Too many samples in one chunk, maximum is {MAX_CHUNK_SAMPLES}")
+        uc = _channel(uc, "uc", len(fhr))
+        fm = np.zeros(len(fhr), dtype=bool) if fm is None else _channel(fm, "fm", len(fhr)) > 0
+
+        pending_fhr, pending_uc, pending_fm = self._pending
+        fhr = np.concatenate([pending_fhr, fhr])
+        uc = np.concatenate([pending_uc, uc])
+        fm = np.concatenate([pending_fm, fm])
+        k = len(fhr) // self.sample_rate
+        cut = k * self.sample_rate
+        self._pending = (fhr[cut:], uc[cut:], fm[cut:])
+        if k == 0:
+            return 0
+
+        fhr = fhr[:cut].reshape(k, self.sample_rate)
+        fhr = np.where((fhr >= FHR_MIN) & (fhr <= FHR_MAX), fhr, np.nan)
+        uc = uc[:cut].reshape(k, self.sample_rate)
+        # An epoch needs half of its samples; nanmean would warn on empty ones
+        fhr_n, uc_n = np.isfinite(fhr).sum(axis=1), np.isfinite(uc).sum(axis=1)
+        fhr_epochs = np.where(fhr_n * 2 >= self.sample_rate,
+                              np.nansum(fhr, axis=1) / np.maximum(fhr_n, 1), np.nan)
+        uc_epochs = np.where(uc_n * 2 >= self.sample_rate,
+                             np.nansum(uc, axis=1) / np.maximum(uc_n, 1), np.nan)
+        fm_epochs = fm[:cut].reshape(k, self.sample_rate).any(axis=1)
+        self._append(fhr_epochs, uc_epochs, fm_epochs)
+        return k
+
+    def _append(self, fhr, uc, fm):
+        k = len(fhr)
+        stv = np.abs(np.diff(np.concatenate([[self._last_fhr], fhr])))
+        self._last_fhr = fhr[-1]
+        skip = max(k - self.window_s, 0)
+        slots = (self.seconds + np.arange(skip, k)) % self.window_s
+        self._account(self.fhr[slots], self.stv[slots], -1)
+        self.fhr[slots], self.uc[slots], self.fm[slots], self.stv[slots] = fhr[skip:], uc[skip:], fm[skip:], stv[skip:]
+        self._account(fhr[skip:], stv[skip:], 1)
+        self.seconds += k
+
+    def _account(self, fhr, stv, sign):
+        valid = np.isfinite(fhr)
+        bins = np.rint(fhr[valid]).astype(np.int64) - FHR_MIN
+        self.hist += sign * np.bincount(bins, minlength=len(self.hist))
+        self.signal_s += sign * int(valid.sum())
+        stv = stv[np.isfinite(stv)]
+        self.stv_sum += sign * float(stv.sum())
+        self.stv_n += sign * len(stv)
+        self.stv_low += sign * int((stv < ABNORMAL_STV).sum())
+
+    def due(self):
+        return self.seconds >= self.next_score
+
+    def scored(self):
+        self.next_score = self.seconds + self.score_every_s
+
+    def window(self):
+        """FHR, UC and movement epochs of the window, oldest first."""
+        n = min(self.seconds, self.window_s)
+        idx = (self.seconds - n + np.arange(n)) % self.window_s
+        return self.fhr[idx], self.uc[idx], self.fm[idx]
+
+    def baseline(self):
+        mode = int(np.argmax(self.hist))
+        lo, hi = max(mode - 10, 0), mode + 11
+        counts = self.hist[lo:hi]
+        return FHR_MIN + lo + float((np.arange(len(counts)) * counts).sum()) / counts.sum()
+
+    def features(self):
+        """The fetal model's inputs for the window, or ``None`` with too little signal."""
+        if self.signal_s < max(self.min_signal_s, 1):
+            return None
+        fhr, uc, fm = self.window()
+        seconds = len(fhr)
+        baseline = round(self.baseline())
+
+        starts, ends = _runs(fhr > baseline + EPISODE_RISE)
+        accelerations = int((ends - starts >= ACCELERATION_S).sum())
+
+        starts, ends = _runs(fhr < baseline - EPISODE_RISE)
+        long_enough = ends - starts >= DECELERATION_S
+        starts, ends = starts[long_enough], ends[long_enough]
+        if len(starts):
+            # Minimum of each fhr[start:end]: reduce over start, end, start, end, ...
+            # boundaries and keep every other result; the sentinel makes end == len valid
+            filled = np.append(np.where(np.isfinite(fhr), fhr, np.inf), np.inf)
+            depth = baseline - np.minimum.reduceat(filled, np.column_stack([starts, ends]).ravel())[::2]
+        else:
+            depth = np.empty(0)
+        prolonged = ends - starts >= PROLONGED_S
+        severe = ~prolonged & (depth > SEVERE_DEPTH)
+        light = ~prolonged & ~severe
+
+        contractions = 0
+        if np.isfinite(uc).any():
+            tone = np.nanpercentile(uc, 10)
+            starts, ends = _runs(uc > tone + CONTRACTION_RISE)
+            contractions = int((ends - starts >= CONTRACTION_S).sum())
+        movements = len(_runs(fm)[0])
+
+        # Ranges of the full minutes that have at least half of their signal
+        minutes = fhr[seconds % 60:].reshape(-1, 60)
+        minutes = minutes[np.isfinite(minutes).sum(axis=1) >= 30]
+        ranges = np.nanmax(minutes, axis=1) - np.nanmin(minutes, axis=1) if len(minutes) else np.empty(0)
+
+        occupied = np.flatnonzero(self.hist)
+        smooth = np.convolve(self.hist, np.ones(5) / 5, mode="same")
+        peaks = (smooth[1:-1] > smooth[:-2]) & (smooth[1:-1] >= smooth[2:]) & (smooth[1:-1] >= 0.01 * self.signal_s)
+
+        values = {
+            "baseline_value": baseline,
+            "accelerations": accelerations / seconds,
+            "fetal_movement": movements / seconds,
+            "uterine_contractions": contractions / seconds,
+            "light_decelerations": int(light.sum()) / seconds,
+            "severe_decelerations": int(severe.sum()) / seconds,
+            "prolonged_decelerations": int(prolonged.sum()) / seconds,
+            "abnormal_short_term_variability": 100.0 * self.stv_low / max(self.stv_n, 1),
+            "mean_value_of_short_term_variability": self.stv_sum / max(self.stv_n, 1),
+            "percentage_of_time_with_abnormal_long_term_variability":
+                100.0 * float((ranges < ABNORMAL_LTV).mean()) if len(ranges) else 0.0,
+            "mean_value_of_long_term_variability": float(ranges.mean()) if len(ranges) else 0.0,
+            "histogram_width": int(occupied[-1] - occupied[0]),
+            "histogram_min": FHR_MIN + int(occupied[0]),
+            "histogram_max": FHR_MIN + int(occupied[-1]),
+            "histogram_number_of_peaks": int(peaks.sum()),
+        }
+        return [float(values[name]) for name in FETAL_FEATURES]
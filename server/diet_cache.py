@@ -0,0 +1,243 @@
+"""Cache for generated diet plans.
+
+Diet requests fall into a small number of combinations, so plans are cached
+under a normalized key: the trimester canonicalized to 1-3, the weight
+bucketed, and the condition/preference text lowercased with filler words
+dropped. Word order, clause punctuation and negations are kept, because they
+decide what a phrase excludes: "allergic to dairy, eat nuts" and "allergic
+to nuts, eat dairy" must not share a plan. Lookups go to an in-memory LRU first and then to a
+SQLite file shared by the workers on this host; both tiers expire entries
+after ``ttl`` seconds and evict the least recently used (memory) or oldest
+(disk) entries when full. Failed generations are never cached.
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import count_cache
+
+_ORDINALS = {
+    "1": 1, "1st": 1, "first": 1, "one": 1, "i": 1,
+    "2": 2, "2nd": 2, "second": 2, "two": 2, "ii": 2,
+    "3": 3, "3rd": 3, "third": 3, "three": 3, "iii": 3,
+}
+_STOPWORDS = {"a", "an", "and", "am", "i", "im", "the", "with", "have", "has", "feel", "feeling",
+              "some", "very", "bit", "little", "my", "of", "to", "is", "slight", "slightly"}
+# Bumped when keys change meaning, so plans stored under older keys go unused
+KEY_VERSION = 2
+_NONE = {"none", "nothing", "na", "nil", "normal", "fine", "ok", "okay", "good", "healthy"}
+
+
+def normalize_trimester(value):
+    for token in re.findall(r"[a-z0-9]+", str(value).lower()):
+        if token in _ORDINALS:
+            return _ORDINALS[token]
+    return str(value).strip().lower()
+
+
+def bucket_weight(value, bucket=5.0):
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        return str(value).strip().lower()
+    return int(weight // bucket * bucket)
+
+
+def normalize_text(value):
+    tokens = [t for t in re.findall(r"[a-z0-9]+|[,.;]", re.sub(r"n['’]t\b", " not", str(value or "").lower()))
+              if t not in _STOPWORDS]
+    words = {t for t in tokens if t.isalnum()}
+    if not words or words <= _NONE:
+        return "none"
+    return re.sub(r" ([,.;])", r"\1", " ".join(tokens)).strip(" ,.;")
+
+
+class DietPlanCache:
+    def __init__(self, path="cache/diet_plans.sqlite3", max_entries=256, max_disk_entries=5000,
+                 ttl=7 * 24 * 3600.0, weight_bucket=5.0, clock=time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.weight_bucket = weight_bucket
+        self.clock = clock
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "generation_seconds": 0.0,
+            "hit_seconds": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.environ.get("DIET_CACHE_PATH", "cache/diet_plans.sqlite3"),
+            max_entries=int(os.environ.get("DIET_CACHE_SIZE", 256)),
+            max_disk_entries=int(os.environ.get("DIET_CACHE_DISK_SIZE", 5000)),
+            ttl=float(os.environ.get("DIET_CACHE_TTL_HOURS", 24 * 7)) * 3600.0,
+            weight_bucket=float(os.environ.get("DIET_CACHE_WEIGHT_BUCKET_KG", 5)),
+        )
+
+    def key(self, kind, trimester, weight, health_conditions, dietary_preference):
+        return json.dumps([
+            KEY_VERSION,
+            kind,
+            normalize_trimester(trimester),
+            bucket_weight(weight, self.weight_bucket),
+            normalize_text(health_conditions),
+            normalize_text(dietary_preference),
+        ])
+
+    # --- disk tier ---
+
+    def _conn(self):
+        # One connection per process; a forked worker opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db.execute("pragma journal_mode=wal")
+            self._db.execute(
+                "create table if not exists diet_plans (key text primary key, plan text not null, created_at real not null)"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _disk_get(self, key, now):
+        with self._db_lock:
+            row = self._conn().execute("select plan, created_at from diet_plans where key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl:
+            with self._db_lock:
+                conn = self._conn()
+                conn.execute("delete from diet_plans where key = ?", (key,))
+                conn.commit()
+            with self._lock:
+                self._counters["expired"] += 1
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _disk_put(self, key, plan, now):
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute("insert or replace into diet_plans values (?, ?, ?)", (key, json.dumps(plan), now))
+            # Drop expired rows, then the oldest ones beyond the size bound
+            conn.execute("delete from diet_plans where created_at < ?", (now - self.ttl,))
+            removed = conn.execute(
+                "delete from diet_plans where key in (select key from diet_plans order by created_at desc limit -1 offset ?)",
+                (self.max_disk_entries,),
+            ).rowcount
+            conn.commit()
+        if removed > 0:
+            with self._lock:
+                self._counters["evictions"] += removed
+
+    # --- memory tier ---
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl:
+                del self._memory[key]
+                self._counters["expired"] += 1
+                return None
+            self._memory.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key, plan, created_at):
+        with self._lock:
+            self._memory[key] = (plan, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    # --- public API ---
+
+    def get(self, key):
+        started = time.perf_counter()
+        now = self.clock()
+        entry = self._memory_get(key, now)
+        tier = "memory_hits"
+        if entry is None:
+            try:
+                entry = self._disk_get(key, now)
+            except sqlite3.Error as e:
+                print(f"Diet cache read failed: {e}")
+                entry = None
+            if entry is not None:
+                tier = "disk_hits"
+                self._memory_put(key, *entry)
+        count_cache("diet_plan", entry is not None)
+        if entry is None:
+            return None
+        with self._lock:
+            self._counters[tier] += 1
+            self._counters["hit_seconds"] += time.perf_counter() - started
+        return entry[0]
+
+    def put(self, key, plan):
+        now = self.clock()
+        self._memory_put(key, plan, now)
+        try:
+            self._disk_put(key, plan, now)
+        except sqlite3.Error as e:
+            print(f"Diet cache write failed: {e}")
+        with self._lock:
+            self._counters["stores"] += 1
+
+    async def get_or_generate_async(self, key, generate):
+        """Returns the cached plan for ``key``, or awaits ``generate()`` and caches
+        its result. Exceptions from ``generate`` propagate and nothing is stored.
+        The SQLite tier is read and written on a worker thread."""
+        plan = await asyncio.to_thread(self.get, key)
+        if plan is not None:
+            return plan
+        started = time.perf_counter()
+        plan = await generate()
+        with self._lock:
+            self._counters["misses"] += 1
+            self._counters["generation_seconds"] += time.perf_counter() - started
+        await asyncio.to_thread(self.put, key, plan)
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        with self._db_lock:
+            conn = self._conn()
+            conn.execute("delete from diet_plans")
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_size"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        avg_generation = stats["generation_seconds"] / stats["misses"] if stats["misses"] else 0.0
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        stats["llm_calls_saved"] = hits
+        stats["avg_generation_seconds"] = avg_generation
+        stats["avg_hit_seconds"] = stats["hit_seconds"] / hits if hits else 0.0
+        stats["estimated_seconds_saved"] = hits * avg_generation - stats["hit_seconds"]
+        return stats
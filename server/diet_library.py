@@ -0,0 +1,368 @@
+"""Deterministic diet plan assembly from a prebuilt component library.
+
+``build_diet_library.py`` validates a catalogue of meal components and
+writes ``diet_library.json``: interned strings, one compact row per component
+with bitmasks for trimesters, tags, unsuitable conditions and allergens, and
+an index of candidate components per ``slot:trimester:diet``. At runtime
+``DietLibrary.assemble`` turns any diet request into a plan with the same
+schema the LLM path returns, in well under a millisecond per plan.
+
+Diets are ordered levels (vegan < vegetarian < eggetarian < pescatarian <
+non-vegetarian); a component is allowed for every level at or above its own.
+"""
+import hashlib
+import json
+import os
+import re
+
+from diet_cache import normalize_text, normalize_trimester
+
+FORMAT_VERSION = 2
+
+SLOTS = ["breakfast", "lunch", "dinner", "snack"]
+DIETS = ["vegan", "vegetarian", "eggetarian", "pescatarian", "non_vegetarian"]
+TAGS = ["iron", "calcium", "protein", "fiber", "folate", "omega3", "bland", "low_gi"]
+CONDITIONS = ["gestational_diabetes", "hypertension", "anemia", "nausea", "heartburn", "constipation"]
+ALLERGENS = ["dairy", "gluten", "nuts", "egg", "soy", "fish", "peanut", "pork"]
+
+# Tags that help with each condition, and those emphasized in each trimester
+CONDITION_TAGS = {
+    "gestational_diabetes": {"low_gi", "fiber"},
+    "hypertension": {"calcium"},
+    "anemia": {"iron"},
+    "nausea": {"bland"},
+    "heartburn": {"bland"},
+    "constipation": {"fiber"},
+}
+TRIMESTER_TAGS = {1: {"folate", "bland"}, 2: {"calcium", "protein"}, 3: {"iron", "omega3", "fiber"}}
+
+_CONDITION_PATTERNS = [
+    ("gestational_diabetes", r"diabet|gdm|sugar|glucose"),
+    ("hypertension", r"hypertens|blood pressure|\bbp\b|pre-?eclampsia"),
+    ("anemia", r"anaemi|anemi|low (iron|hb|haemoglobin|hemoglobin)|iron deficien"),
+    ("nausea", r"nause|morning sickness|vomit"),
+    ("heartburn", r"heartburn|acid|reflux|indigestion"),
+    ("constipation", r"constipat"),
+]
+# What names each allergen class, in preferences and in component items
+ALLERGEN_FOODS = {
+    "dairy": r"dairy|\bmilk|lactose|cheese|paneer|\bcurd|yogh?urt|\bghee|butter",
+    "gluten": r"gluten|wheat|maida|\batta\b",
+    "nuts": r"\bnuts?\b|tree[ -]?nuts?|almond|walnut|cashew|pistachio|hazelnut",
+    "peanut": r"peanut|groundnut",
+    "egg": r"\beggs?\b",
+    "soy": r"\bsoy|\bsoya|tofu",
+    "fish": r"fish|seafood|prawn|shrimp|salmon",
+    "pork": r"pork|bacon|\bham\b",
+}
+_FOOD = re.compile("|".join(ALLERGEN_FOODS.values()))
+_MEAT = r"non[ -]?veg|\bmeat|chicken|mutton|\blamb\b|beef|poultry|keema"
+_DIET_WORD = r"vegan|vegetarian|\bveg\b|eggetarian|pesc[ae]tarian|anything|everything"
+
+# A negation; its scope runs to the end of the sentence but stops at "but"
+# or at the first list item that isn't a food ("no eggs, vegetarian")
+_NEGATION = re.compile(
+    r"\b(?P<allergy>allergic to|allergy to|allergies to|intolerant to)\b|"
+    r"\b(?:no|not|never|without|avoids?|avoiding|excludes?|excluding|except|apart from|other than|hates?|"
+    r"dislikes?|(?:do|does|did|wo|ca)n['’]?t|cannot)\b"
+)
+_SCOPE_END = re.compile(r"[.;!?]|\bbut\b")
+_LIST_SEPARATOR = re.compile(r",|&|/|\band\b|\bor\b|\bnor\b")
+_ALLOWED = re.compile(r"\b(?:is|are|ok|okay|fine|allowed)\b")
+_LIST_FILLER = re.compile(r"^(?:also |any |all |other |even |too )*")
+# "<food> allergy", "<food>-free", "<food> intolerance"
+_ALLERGY_SUFFIX = re.compile(r"([a-z]+)[ -](?:allerg\w*|intoleran\w*|free)\b")
+_NOT_A_FOOD = {"food", "foods", "severe", "mild", "known", "no", "any", "some", "multiple", "other", "sugar"}
+
+MEAL_PLAN_TYPES = ["Balanced Plan", "Alternative Plan", "Variety Plan"]
+
+
+def mask(values, vocab):
+    bits = 0
+    for value in values:
+        bits |= 1 << vocab.index(value)
+    return bits
+
+
+def _ends_list(item, allergy):
+    if _ALLOWED.search(item) or re.search(rf"\b(?:i|eats?|like|love|prefer|am)\b|{_DIET_WORD}", item):
+        return True
+    # Anything can follow "allergic to"; other negations only list foods
+    return not allergy and not re.match(rf"(?:{_FOOD.pattern}|{_MEAT})", item)
+
+
+def _negated_scopes(text):
+    """``(is_allergy, items, (start, end))`` for every negation in ``text``.
+
+    ``items`` are the list items the negation applies to: the first one
+    always, later ones until one says something else ("eat nuts", "fish is
+    fine", "vegetarian").
+    """
+    scopes, covered = [], 0
+    for m in _NEGATION.finditer(text):
+        if m.start() < covered:
+            continue
+        end = _SCOPE_END.search(text, m.end())
+        end = end.start() if end else len(text)
+        allergy = m.group("allergy") is not None
+        items, position = [], m.end()
+        for n, part in enumerate(_LIST_SEPARATOR.split(text[m.end():end])):
+            item = _LIST_FILLER.sub("", part.strip())
+            if n and item and _ends_list(item, allergy):
+                break
+            if item:
+                items.append(item)
+            position = text.index(part, position) + len(part) if part else position
+        scopes.append((allergy, items, (m.start(), position)))
+        covered = position
+    return scopes
+
+
+def _allergens_in(text):
+    found = {name for name, pattern in ALLERGEN_FOODS.items() if re.search(pattern, text)}
+    if "nuts" in found:
+        found.add("peanut")  # "allergic to nuts" is not the time to tell the two apart
+    return found
+
+
+def unrecognized_allergies(text):
+    """Allergies in ``text`` that name nothing the library knows (e.g. "allergic
+    to strawberries"); plans for those come from the LLM instead."""
+    text = " ".join(str(text or "").lower().split())
+    unknown = [item for allergy, items, _ in _negated_scopes(text) if allergy
+               for item in items if not _allergens_in(item)]
+    unknown += [word for word in _ALLERGY_SUFFIX.findall(text)
+                if word not in _NOT_A_FOOD and not _allergens_in(word) and not re.match(r"celiac|coeliac", word)]
+    return unknown
+
+
+def parse_preference(text):
+    """Returns ``(diet_level, allergen_mask)`` for free-text dietary preferences.
+
+    Foods after a negation ("no fish", "I don't eat meat", "allergic to milk
+    and nuts", "everything except pork") are exclusions: excluded meat caps
+    the level at vegetarian, excluded foods of an allergen class become
+    allergens. When the remaining text names more than one diet, the most
+    restrictive one wins.
+    """
+    text = " ".join(str(text or "").lower().split())
+    scopes = _negated_scopes(text)
+    negated = " ".join(item for _, items, _ in scopes for item in items)
+    positive, cut = [], 0
+    for _, _, (start, end) in scopes:
+        positive.append(text[cut:start])
+        cut = end
+    positive = " ".join(positive + [text[cut:]])
+
+    vegan, vegetarian, eggetarian, pescatarian, non_vegetarian = range(len(DIETS))
+    levels = []
+    if re.search(r"non[ -]?veg|omnivor|\bmeat|chicken|mutton|\blamb\b|pork|beef", positive):
+        levels.append(non_vegetarian)
+    veg_text = re.sub(r"non[ -]?veg\w*", " ", positive)
+    if re.search(r"pesc[ae]tarian|pesco", veg_text):
+        levels.append(pescatarian)
+    if re.search(r"vegan|plant[ -]based", veg_text):
+        levels.append(vegan)
+    eggs_allowed = re.search(r"eggetarian|\bovo|\beggs? (are |is )?(ok|okay|fine|allowed)|\beats? eggs?", veg_text)
+    if eggs_allowed:
+        levels.append(eggetarian)
+    if re.search(r"\bveg\b|\bveggie|vegetarian", veg_text):
+        levels.append(vegetarian)
+    if re.search(_MEAT, negated):
+        levels.append(vegetarian)
+    level = min(levels) if levels else non_vegetarian
+    # "vegetarian, eggs are fine" and "no meat, eggs ok" describe an eggetarian
+    if level == vegetarian and eggs_allowed and not re.search(r"\beggs?\b", negated):
+        level = eggetarian
+    # and "no meat, fish is fine" a pescatarian
+    if level in (vegetarian, eggetarian) and re.search(r"\bfish\b|seafood", positive) and \
+            not re.search(r"\bfish\b|seafood", negated):
+        level = pescatarian
+
+    allergens = _allergens_in(negated)
+    for word in _ALLERGY_SUFFIX.findall(text):
+        allergens |= _allergens_in(word)
+    if re.search(r"lactose", text):
+        allergens.add("dairy")
+    if re.search(r"celiac|coeliac", text):
+        allergens.add("gluten")
+    return level, mask(allergens, ALLERGENS)
+
+
+def parse_conditions(text):
+    text = " ".join(str(text or "").lower().split())
+    return {name for name, pattern in _CONDITION_PATTERNS if re.search(pattern, text)}
+
+
+def payload_checksum(library):
+    body = {k: v for k, v in library.items() if k != "checksum"}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def encode_library(components, guidance, built_at=None):
+    """Packs validated component dicts into the compact on-disk format."""
+    strings, string_ids = [], {}
+
+    def intern(value):
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    rows, index = [], {}
+    for i, c in enumerate(components):
+        level = DIETS.index(c["diet"])
+        trimesters = c.get("trimesters") or [1, 2, 3]
+        rows.append([
+            SLOTS.index(c["slot"]), intern(c["name"]), int(c["calories"]),
+            [intern(item) for item in c["items"]], level, mask(trimesters, [1, 2, 3]),
+            mask(c.get("tags", []), TAGS), mask(c.get("avoid_for", []), CONDITIONS),
+            mask(c.get("allergens", []), ALLERGENS),
+        ])
+        for trimester in trimesters:
+            for diet in DIETS[level:]:
+                index.setdefault(f"{c['slot']}:{trimester}:{diet}", []).append(i)
+
+    library = {
+        "format": FORMAT_VERSION,
+        "built_at": built_at,
+        "vocab": {"slots": SLOTS, "diets": DIETS, "tags": TAGS, "conditions": CONDITIONS, "allergens": ALLERGENS},
+        "strings": strings,
+        "components": rows,
+        "index": index,
+        "guidance": guidance,
+    }
+    library["checksum"] = payload_checksum(library)
+    return library
+
+
+class DietLibrary:
+    def __init__(self, library):
+        vocab = library["vocab"]
+        if library.get("format") != FORMAT_VERSION or vocab != {
+            "slots": SLOTS, "diets": DIETS, "tags": TAGS, "conditions": CONDITIONS, "allergens": ALLERGENS
+        }:
+            raise ValueError("Diet library was built with a different format; rebuild it")
+        self.strings = library["strings"]
+        self.components = library["components"]
+        self.index = library["index"]
+        self.guidance = library["guidance"]
+
+    @classmethod
+    def load(cls, path="diet_library.json"):
+        """Returns the library at ``path``, or ``None`` if it's missing or corrupt."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                library = json.load(f)
+            if library.get("checksum") != payload_checksum(library):
+                raise ValueError("checksum mismatch")
+            return cls(library)
+        except Exception as e:
+            print(f"Failed to load diet library {path}: {e}")
+            return None
+
+    # --- selection ---
+
+    def _candidates(self, slot, trimester, level, conditions_mask, allergen_mask):
+        ids = self.index.get(f"{slot}:{trimester}:{DIETS[level]}", [])
+        allowed = [i for i in ids if not self.components[i][8] & allergen_mask]
+        suitable = [i for i in allowed if not self.components[i][7] & conditions_mask]
+        # Only unsuitable-for-condition options left: prefer something over nothing,
+        # allergens are never relaxed
+        return suitable or allowed
+
+    def _ranked(self, ids, level, wanted_tags, seed):
+        def rank(i):
+            row = self.components[i]
+            score = 2 * bin(row[6] & wanted_tags[0]).count("1") + bin(row[6] & wanted_tags[1]).count("1")
+            if level >= 2 and row[4] == level:
+                score += 1  # include some egg/meat dishes for those who eat them
+            tiebreak = hashlib.md5(f"{seed}:{row[1]}".encode()).hexdigest()
+            return -score, tiebreak
+        return sorted(ids, key=rank)
+
+    def _meal(self, i):
+        row = self.components[i]
+        return {"name": self.strings[row[1]], "calories": str(row[2]), "items": [self.strings[s] for s in row[3]]}
+
+    def _snacks(self, ranked, used, remaining):
+        # Two of the best-ranked snacks not used by an earlier variant, closest to the calorie gap
+        pool = [i for i in ranked if i not in used][:8] or ranked[:8]
+        if len(pool) < 2:
+            return pool
+        best = min(
+            ((a, b) for n, a in enumerate(pool) for b in pool[n + 1:]),
+            key=lambda pair: abs(self.components[pair[0]][2] + self.components[pair[1]][2] - remaining),
+        )
+        return list(best)
+
+    def _guidance(self, section, trimester, conditions):
+        entries = self.guidance[section]
+        # Most specific first, so condition entries override same-named general ones
+        keys = sorted(conditions) + [str(trimester), "all"]
+        out, seen = [], set()
+        for key in keys:
+            for entry in entries.get(key, []):
+                marker = entry["name"] if isinstance(entry, dict) else entry
+                if marker not in seen:
+                    seen.add(marker)
+                    out.append(entry)
+        return out
+
+    def target_calories(self, trimester, weight):
+        try:
+            base = min(max(float(weight) * 30, 1800), 2400)
+        except (TypeError, ValueError):
+            base = 2000
+        return int(round((base + self.guidance["calorie_extra"].get(str(trimester), 300)) / 50) * 50)
+
+    def assemble(self, trimester, weight, health_conditions, dietary_preference, variants=2):
+        """Builds a plan for the request. Raises ``LookupError`` if the library
+        has nothing for some meal under the requested restrictions."""
+        trimester = normalize_trimester(trimester)
+        if trimester not in (1, 2, 3):
+            trimester = 2
+        unknown = unrecognized_allergies(dietary_preference)
+        if unknown:
+            raise LookupError(f"Unrecognized allergies: {', '.join(unknown)}")
+        level, allergen_mask = parse_preference(dietary_preference)
+        conditions = parse_conditions(health_conditions)
+        conditions_mask = mask(conditions, CONDITIONS)
+        condition_tags = set().union(*(CONDITION_TAGS[c] for c in conditions)) if conditions else set()
+        wanted = (mask(condition_tags, TAGS), mask(TRIMESTER_TAGS[trimester], TAGS))
+        seed = f"{trimester}|{normalize_text(health_conditions)}|{normalize_text(dietary_preference)}"
+        target = self.target_calories(trimester, weight)
+
+        ranked = {}
+        for slot in SLOTS:
+            ids = self._candidates(slot, trimester, level, conditions_mask, allergen_mask)
+            if not ids:
+                raise LookupError(f"No {slot} options for this diet")
+            ranked[slot] = self._ranked(ids, level, wanted, seed)
+
+        meal_plans, used_snacks = [], set()
+        for variant in range(max(1, min(variants, len(MEAL_PLAN_TYPES)))):
+            meals = {slot: self._meal(ranked[slot][variant % len(ranked[slot])])
+                     for slot in ("breakfast", "lunch", "dinner")}
+            remaining = target - sum(int(meals[slot]["calories"]) for slot in meals)
+            snacks = self._snacks(ranked["snack"], used_snacks, remaining)
+            used_snacks.update(snacks)
+            meals["snacks"] = [
+                {"name": self.strings[self.components[i][1]],
+                 "items": [self.strings[s] for s in self.components[i][3]]}
+                for i in snacks
+            ]
+            meal_plans.append({"type": MEAL_PLAN_TYPES[variant], "meals": meals})
+
+        return {
+            "overview": {
+                "calories_per_day": f"{target - 100}-{target + 100}",
+                "key_nutrients": self.guidance["key_nutrients"][str(trimester)],
+                "foods_to_avoid": self._guidance("foods_to_avoid", trimester, conditions),
+            },
+            "meal_plans": meal_plans,
+            "tips": self._guidance("tips", trimester, conditions),
+            "supplements": self._guidance("supplements", trimester, conditions),
+        }
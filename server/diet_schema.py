@@ -0,0 +1,394 @@
+"""Diet plan schema and an incremental parser for model output.
+
+The model is asked for one JSON object with ``overview``, ``meal_plans``,
+``tips`` and ``supplements``. ``StructuredDietPlan`` consumes its output as
+it streams in and reports each top-level section (and each ``meal_plans``
+entry) as soon as its JSON value is complete. Every section is checked
+against the schema below: small deviations (numbers for strings, a string
+instead of a list, trailing commas, a cut-off final section) are repaired,
+and a section that can't be repaired is replaced with the same section of a
+reference plan, so one bad section no longer discards the whole plan.
+"""
+import json
+import re
+
+MEALS = ("breakfast", "lunch", "dinner")
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+class SchemaError(ValueError):
+    """Raised when a section can't be repaired to match the schema."""
+
+
+def _text(value, field):
+    if isinstance(value, bool) or value is None:
+        raise SchemaError(f"{field} must be a string")
+    if isinstance(value, (int, float)):
+        return str(value)
+    if not isinstance(value, str) or not value.strip():
+        raise SchemaError(f"{field} must be a non-empty string")
+    return value.strip()
+
+
+def _text_list(value, field):
+    if isinstance(value, str):
+        value = [part for part in re.split(r"[,;\n]", value) if part.strip()]
+    if not isinstance(value, list):
+        raise SchemaError(f"{field} must be a list of strings")
+    items = []
+    for item in value:
+        try:
+            items.append(_text(item, field))
+        except SchemaError:
+            continue  # drop the bad entry, keep the rest
+    if not items:
+        raise SchemaError(f"{field} has no valid entries")
+    return items
+
+
+def _object(value, field):
+    if not isinstance(value, dict):
+        raise SchemaError(f"{field} must be an object")
+    return value
+
+
+def check_overview(value):
+    value = _object(value, "overview")
+    return {
+        "calories_per_day": _text(value.get("calories_per_day"), "overview.calories_per_day"),
+        "key_nutrients": _text_list(value.get("key_nutrients"), "overview.key_nutrients"),
+        "foods_to_avoid": _text_list(value.get("foods_to_avoid"), "overview.foods_to_avoid"),
+    }
+
+
+def check_meal(value, field):
+    value = _object(value, field)
+    meal = {
+        "name": _text(value.get("name"), f"{field}.name"),
+        "items": _text_list(value.get("items"), f"{field}.items"),
+    }
+    if "calories" in value:
+        meal["calories"] = _text(value["calories"], f"{field}.calories")
+    return meal
+
+
+def check_meal_plan(value, index=0):
+    value = _object(value, "meal_plan")
+    meals = _object(value.get("meals"), "meal_plan.meals")
+    checked = {}
+    for slot in MEALS:
+        checked[slot] = check_meal(meals.get(slot), f"meals.{slot}")
+        checked[slot].setdefault("calories", "")
+    snacks = meals.get("snacks") or []
+    if isinstance(snacks, dict):
+        snacks = [snacks]
+    checked["snacks"] = []
+    for i, snack in enumerate(snacks if isinstance(snacks, list) else []):
+        try:
+            snack = check_meal(snack, f"meals.snacks[{i}]")
+        except SchemaError:
+            continue
+        checked["snacks"].append({"name": snack["name"], "items": snack["items"]})
+    plan_type = value.get("type")
+    return {
+        "type": plan_type.strip() if isinstance(plan_type, str) and plan_type.strip() else f"Meal Plan {index + 1}",
+        "meals": checked,
+    }
+
+
+def check_tips(value):
+    return _text_list(value, "tips")
+
+
+def check_supplements(value):
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list):
+        raise SchemaError("supplements must be a list")
+    supplements = []
+    for entry in value:
+        try:
+            entry = _object(entry, "supplement")
+            supplements.append({
+                "name": _text(entry.get("name"), "supplement.name"),
+                "dosage": _text(entry.get("dosage", "As advised by your doctor"), "supplement.dosage"),
+                "reason": _text(entry.get("reason", ""), "supplement.reason") if entry.get("reason") else "",
+            })
+        except SchemaError:
+            continue
+    if not supplements:
+        raise SchemaError("supplements has no valid entries")
+    return supplements
+
+
+def loads_lenient(text):
+    """``json.loads`` that tolerates trailing commas and typographic quotes."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", text.translate(_SMART_QUOTES)))
+
+
+def plan_events(plan):
+    """The ``StructuredDietPlan`` events for an already complete plan."""
+    events = [("overview", plan["overview"])]
+    events += [("meal_plan", {"index": i, "plan": p}) for i, p in enumerate(plan["meal_plans"])]
+    events += [("tips", plan["tips"]), ("supplements", plan["supplements"])]
+    return events
+
+
+class JSONSectionScanner:
+    """Finds complete top-level values in a JSON object that arrives in pieces.
+
+    ``feed`` returns ``(key, index, text)`` for each value completed by the
+    new text; ``index`` is the position inside an array key listed in
+    ``split_arrays`` (those arrays are reported one element at a time) and
+    ``None`` otherwise. Anything before the first ``{`` (such as a markdown
+    fence) is ignored.
+    """
+
+    def __init__(self, split_arrays=()):
+        self.split_arrays = set(split_arrays)
+        self.text = ""
+        self.pos = 0
+        self.started = False
+        self.finished = False
+        self.stack = []
+        self.marks = []  # per open bracket: where its last element or member starts
+        self.in_string = False
+        self.escape = False
+        self.expect = "key"
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.splitting = False
+        self.item_start = None
+        self.item_index = 0
+
+    def _end_value(self, end, out):
+        if not self.splitting and self.value_start is not None:
+            out.append((self.key, None, self.text[self.value_start:end]))
+        self.value_start = None
+        self.splitting = False
+        self.expect = "after_value"
+
+    def _end_item(self, end, out):
+        if self.item_start is not None:
+            out.append((self.key, self.item_index, self.text[self.item_start:end]))
+            self.item_index += 1
+        self.item_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        out = []
+        text = self.text
+        while self.pos < len(text) and not self.finished:
+            i, c = self.pos, text[self.pos]
+            self.pos += 1
+            if not self.started:
+                if c == "{":
+                    self.started = True
+                    self.stack.append(c)
+                    self.marks.append(i + 1)
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        self.key = loads_lenient(text[self.key_start:i + 1])
+                        self.key_start = None
+                        self.expect = "colon"
+                continue
+            if c.isspace():
+                continue
+            depth = len(self.stack)
+
+            if depth == 1:
+                if self.expect == "key":
+                    if c == '"':
+                        self.in_string = True
+                        self.key_start = i
+                    elif c == "}":
+                        self.finished = True
+                    continue
+                if self.expect == "colon":
+                    if c == ":":
+                        self.expect = "value"
+                    continue
+                if self.expect == "value":
+                    self.value_start = i
+                    self.expect = "in_value"
+                    self.splitting = c == "[" and self.key in self.split_arrays
+                    self.item_index = 0
+                elif c in ",}":
+                    if self.expect == "in_value":
+                        self._end_value(i, out)  # scalar value
+                    self.expect = "key"
+                    if c == "}":
+                        self.finished = True
+                    continue
+
+            in_split_array = self.splitting and depth == 2
+            if in_split_array and c == ",":
+                self._end_item(i, out)
+                continue
+            if in_split_array and c == "]":
+                self._end_item(i, out)
+                self.stack.pop()
+                self.marks.pop()
+                self._end_value(i + 1, out)
+                continue
+            if in_split_array and self.item_start is None:
+                self.item_start = i
+            if c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.stack.append(c)
+                self.marks.append(i + 1)
+            elif c == ",":
+                self.marks[-1] = i
+            elif c in "}]":
+                self.stack.pop()
+                self.marks.pop()
+                if len(self.stack) == 1 and self.expect == "in_value":
+                    self._end_value(i + 1, out)  # object or array value closed
+                elif len(self.stack) == 2 and self.splitting:
+                    self._end_item(i + 1, out)  # array element closed
+        return out
+
+    def close(self):
+        """Returns the value that was cut off, trimmed back to its last complete part.
+
+        The incomplete element of the innermost open array (or, outside
+        arrays, the incomplete member of the innermost open object) is
+        dropped rather than guessed at, and the brackets around it are
+        closed. A value with nothing complete left - a cut-off scalar or a
+        ``split_arrays`` element - comes back as ``(key, index, None)``.
+        """
+        if self.finished or not self.started:
+            return []
+        start = self.item_start if self.splitting else self.value_start
+        if start is None:
+            return []
+        self.finished = True
+        index = self.item_index if self.splitting else None
+        base = 2 if self.splitting else 1
+        arrays = [d for d in range(1, len(self.stack)) if self.stack[d] == "["]
+        depth = arrays[-1] if arrays else len(self.stack) - 1
+        if depth < base:
+            return [(self.key, index, None)]
+        cut = self.marks[depth]
+        if depth == len(self.stack) - 1 and not self.in_string:
+            if _complete(self.text[cut:], self.stack[depth]):
+                cut = len(self.text)
+        tail = self.text[start:cut].rstrip().rstrip(",")
+        closers = "".join("}" if b == "{" else "]" for b in reversed(self.stack[base:depth + 1]))
+        return [(self.key, index, tail + closers)]
+
+
+def _complete(part, bracket):
+    """Whether ``part``, the text after an array's or object's last comma, is a whole element or member."""
+    part = part.strip().lstrip(",").strip()
+    if not part or part[-1] in "0123456789.-+eE" and not part.endswith(("true", "false")):
+        return False  # nothing there, or a number that may have been cut short
+    try:
+        loads_lenient(f"[{part}]" if bracket == "[" else f"{{{part}}}")
+    except ValueError:
+        return False
+    return True
+
+
+class StructuredDietPlan:
+    """Builds a schema-valid diet plan from streamed model output.
+
+    ``feed(text)`` and ``finish()`` return ``(event, payload)`` pairs:
+    ``("overview", dict)``, ``("meal_plan", {"index": i, "plan": dict})``,
+    ``("tips", list)`` and ``("supplements", list)``. Sections the model
+    didn't produce, or that couldn't be repaired, come from ``reference``.
+    """
+
+    CHECKS = {"overview": check_overview, "tips": check_tips, "supplements": check_supplements}
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.scanner = JSONSectionScanner(split_arrays=("meal_plans",))
+        self.plan = {"overview": None, "meal_plans": [], "tips": None, "supplements": None}
+        self.repaired = []
+        self.replaced = []
+        self.accepted = 0  # sections (and meal plans) taken from the model
+
+    def _section(self, key, index, text):
+        if key == "meal_plans":
+            try:
+                value = loads_lenient(text)
+            except ValueError:
+                value = None
+            if index is None:
+                # meal_plans wasn't an array, or came in one piece
+                values = value if isinstance(value, list) else [value]
+                events = []
+                for v in values:
+                    events.extend(self._meal_plan(len(self.plan["meal_plans"]), v))
+                return events
+            return self._meal_plan(index, value)
+
+        check = self.CHECKS.get(key)
+        if check is None or self.plan.get(key) is not None:
+            return []  # unknown or repeated key
+        try:
+            value = check(loads_lenient(text))
+            self.accepted += 1
+        except (ValueError, SchemaError) as e:
+            print(f"Replacing invalid diet plan section {key}: {e}")
+            self.replaced.append(key)
+            value = self.reference[key]
+        self.plan[key] = value
+        return [(key, value)]
+
+    def _meal_plan(self, index, value):
+        try:
+            plan = check_meal_plan(value, index)
+            self.accepted += 1
+        except SchemaError as e:
+            references = self.reference["meal_plans"]
+            if len(self.plan["meal_plans"]) >= len(references):
+                print(f"Dropping invalid meal plan {index}: {e}")
+                return []
+            print(f"Replacing invalid meal plan {index}: {e}")
+            self.replaced.append(f"meal_plans[{index}]")
+            plan = references[len(self.plan["meal_plans"])]
+        self.plan["meal_plans"].append(plan)
+        return [("meal_plan", {"index": len(self.plan["meal_plans"]) - 1, "plan": plan})]
+
+    def feed(self, text):
+        events = []
+        for key, index, raw in self.scanner.feed(text):
+            events.extend(self._section(key, index, raw))
+        return events
+
+    def finish(self):
+        events = []
+        for key, index, raw in self.scanner.close():
+            self.repaired.append(key if index is None else f"{key}[{index}]")
+            if raw is not None:
+                events.extend(self._section(key, index, raw))
+        for key in ("overview", "tips", "supplements"):
+            if self.plan[key] is None:
+                self.replaced.append(key)
+                self.plan[key] = self.reference[key]
+                events.append((key, self.plan[key]))
+        if not self.plan["meal_plans"]:
+            self.replaced.append("meal_plans")
+            for plan in self.reference["meal_plans"]:
+                self.plan["meal_plans"].append(plan)
+                events.append(("meal_plan", {"index": len(self.plan["meal_plans"]) - 1, "plan": plan}))
+        return events
+
+    def result(self):
+        return dict(self.plan)
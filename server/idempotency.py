@@ -0,0 +1,189 @@
+"""Idempotency keys and single-flight deduplication for expensive endpoints.
+
+A client that times out and retries sends the same ``Idempotency-Key``
+header again. The first request with a key computes the response; requests
+arriving while it runs wait for it and get the same response, and later ones
+get it replayed from a short-lived in-memory store. Reusing a key with a
+different body is rejected.
+
+Without the header a request is only deduplicated on endpoints whose
+response is decided by the body (diet plans, chat messages), and only while
+in flight (keyed by user, route and body); nothing is kept afterwards.
+Elsewhere two identical bodies can be two real events, such as two equal
+vitals readings, so they are both processed.
+
+Entries are per process. Retries that land on another worker are
+deduplicated there, not across workers.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused with a different request body."""
+
+
+class IdempotencyTimeout(Exception):
+    """Raised when the request sharing our key doesn't finish in time."""
+
+
+class StoredResponse:
+    __slots__ = ("status", "body", "content_type")
+
+    def __init__(self, status, body, content_type):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+
+class _Flight:
+    __slots__ = ("fingerprint", "done", "response", "expires", "waiters")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+        self.expires = None
+        # (loop, future) of each coroutine waiting for the flight
+        self.waiters = []
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def request_key(scope, method, path, idempotency_key, body, by_body=False):
+    """Returns ``(key, fingerprint, keep)`` for a request, or ``None`` if it
+    isn't deduplicated.
+
+    Without an idempotency key a request is only deduplicated ``by_body``, and
+    then only while in flight: ``keep`` is False.
+    """
+    fingerprint = hashlib.sha256(body or b"").hexdigest()
+    if idempotency_key:
+        return f"{scope}:{method}:{path}:key:{idempotency_key}", fingerprint, True
+    if not by_body:
+        return None
+    return f"{scope}:{method}:{path}:body:{fingerprint}", fingerprint, False
+
+
+class IdempotencyStore:
+    def __init__(self, ttl=300.0, max_entries=10000, wait_timeout=60.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"computed": 0, "shared": 0, "replayed": 0, "conflicts": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.environ.get("IDEMPOTENCY_TTL_S", 300)),
+            max_entries=int(os.environ.get("IDEMPOTENCY_MAX_KEYS", 10000)),
+            wait_timeout=float(os.environ.get("IDEMPOTENCY_WAIT_S", 60)),
+        )
+
+    def _evict(self, now):
+        # Completed entries are kept in completion order, so expired ones come first
+        stale = []
+        over = len(self._entries) - self.max_entries
+        for key, flight in self._entries.items():
+            if flight.expires is None:
+                continue  # still in flight
+            if flight.expires > now and over <= 0:
+                break
+            stale.append(key)
+            over -= 1
+        for key in stale:
+            del self._entries[key]
+
+    def _enter(self, key, fingerprint):
+        """Returns ``(response, flight)``: ``(None, None)`` to compute the
+        response, a stored response to share, or a flight to wait for."""
+        with self._lock:
+            self._evict(self.clock())
+            flight = self._entries.get(key)
+            if flight is None:
+                self._entries[key] = _Flight(fingerprint)
+                self._counters["computed"] += 1
+                return None, None
+            if flight.fingerprint != fingerprint:
+                self._counters["conflicts"] += 1
+                raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+            if flight.response is not None:
+                self._counters["replayed"] += 1
+                return flight.response, None
+            self._counters["shared"] += 1
+            return None, flight
+
+    async def begin_async(self, key, fingerprint):
+        """Returns ``None`` if the caller should compute the response (and then
+        call ``finish`` or ``abandon``), otherwise the shared ``StoredResponse``.
+        A request waiting for a duplicate in flight awaits a future on its own
+        loop, not a worker thread."""
+        while True:
+            response, flight = self._enter(key, fingerprint)
+            if flight is None:
+                return response
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                # finish/abandon set done before collecting waiters under the lock
+                if flight.done.is_set():
+                    future.set_result(None)
+                else:
+                    flight.waiters.append((loop, future))
+            try:
+                await asyncio.wait_for(future, self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise IdempotencyTimeout("The original request with this key is still running")
+            if flight.response is not None:
+                return flight.response
+            # The original request failed without a response; try to take over
+
+    def finish(self, key, response, keep=True):
+        """Publishes the leader's response; it is replayed for ``ttl`` seconds if ``keep``."""
+        with self._lock:
+            flight = self._entries.get(key)
+            if flight is None:
+                return
+            flight.response = response
+            if keep:
+                flight.expires = self.clock() + self.ttl
+                self._entries.move_to_end(key)
+            else:
+                del self._entries[key]
+        self._release(flight)
+
+    def abandon(self, key):
+        """Called when the leader failed without a response; waiters retry."""
+        with self._lock:
+            flight = self._entries.pop(key, None)
+        if flight is not None:
+            self._release(flight)
+
+    def _release(self, flight):
+        flight.done.set()
+        with self._lock:
+            waiters, flight.waiters = flight.waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # the waiter's loop has closed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+        return stats
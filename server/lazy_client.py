@@ -0,0 +1,30 @@
+"""Proxy that creates an SDK client on first use.
+
+Importing the Supabase SDK and building its clients is a noticeable part of
+startup. Handlers and helpers are given a ``LazyClient`` instead, so the app
+can be imported (and answer liveness probes) first; the client is created by
+warm-up or, failing that, by the first call that needs it.
+"""
+import threading
+
+
+class LazyClient:
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def created(self):
+        return self._client is not None
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        # Only reached for attributes the proxy itself doesn't have
+        return getattr(self.get(), name)
@@ -0,0 +1,557 @@
+"""Gateway for every LLM call made by the servers (chat, titles, summaries, diet plans).
+
+``LLMGateway`` wraps one backend and adds what the bare SDK calls lacked:
+
+* a semaphore bounding the number of calls in flight,
+* a deadline per call, passed down to the backend's HTTP timeout,
+* retries of transient failures with full-jitter exponential backoff, and
+* optional hedging of async calls: if one hasn't answered after
+  ``hedge_after`` seconds, a second identical call is started and the first
+  answer wins.
+
+Backends are Gemini (default), a local Ollama-compatible HTTP server and a
+deterministic in-process fake for tests and benchmarks, chosen with
+``LLM_BACKEND``. Callers pass prompts in the Gemini ``contents`` shapes the
+handlers already build (a string, one message dict or a list of them).
+
+The service calls ``agenerate``/``astream``: they await the backend's
+non-blocking client, so a call in flight holds no thread, and a missed
+deadline cancels the request instead of abandoning it. ``generate`` is the
+blocking call for command-line tools such as build_diet_library.py, with
+its own concurrency bound and no hedging.
+
+Every call is timed as the ``llm`` stage of the request making it, and its
+prompt and reply tokens (estimated from their length) are counted.
+
+Backends import their SDKs on first use. ``load`` does that ahead of time
+(e.g. in a parent before it forks workers) and ``awarm`` additionally opens
+a connection where the backend has one to open.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from chat_context import estimate_tokens
+from metrics import count, span
+
+
+class LLMError(Exception):
+    """Base class for gateway errors."""
+
+
+class LLMTimeout(LLMError):
+    """Raised when a call misses its deadline."""
+
+
+class LLMOverloaded(LLMError):
+    """Raised when no concurrency slot frees up before the deadline."""
+
+
+def to_messages(contents):
+    """Normalizes Gemini ``contents`` to ``[{"role": "user"|"assistant", "content": str}]``."""
+    if isinstance(contents, str):
+        return [{"role": "user", "content": contents}]
+    if isinstance(contents, dict):
+        contents = [contents]
+    messages = []
+    for item in contents:
+        if isinstance(item, str):
+            messages.append({"role": "user", "content": item})
+            continue
+        text = "".join(part.get("text", "") for part in item.get("parts", []))
+        role = "assistant" if item.get("role") in ("model", "assistant") else "user"
+        messages.append({"role": role, "content": text})
+    return messages
+
+
+# --- backends ---
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, model_name="gemini-2.0-flash", api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._transient = ()
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        # The SDK takes most of a second to import, so it is loaded on first use
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    from google.api_core import exceptions
+
+                    genai.configure(api_key=self.api_key)
+                    self._transient = (
+                        exceptions.ResourceExhausted, exceptions.ServiceUnavailable,
+                        exceptions.InternalServerError, exceptions.DeadlineExceeded,
+                    )
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def load(self):
+        return self.model
+
+    async def awarm(self):
+        await asyncio.to_thread(self.load)
+
+    def _contents(self, contents):
+        return [
+            {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+            for m in to_messages(contents)
+        ]
+
+    def generate(self, contents, timeout):
+        response = self.model.generate_content(self._contents(contents), request_options={"timeout": timeout})
+        return response.text
+
+    async def agenerate(self, contents, timeout):
+        response = await self.model.generate_content_async(
+            self._contents(contents), request_options={"timeout": timeout}
+        )
+        return response.text
+
+    async def astream(self, contents, timeout):
+        response = await self.model.generate_content_async(
+            self._contents(contents), stream=True, request_options={"timeout": timeout}
+        )
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+    def is_transient(self, error):
+        return isinstance(error, self._transient)
+
+
+class OllamaBackend:
+    """Talks to an Ollama-compatible ``/api/chat`` endpoint."""
+    name = "ollama"
+
+    def __init__(self, model, base_url="http://localhost:11434"):
+        import httpx
+
+        if not model:
+            raise ValueError("OLLAMA_MODEL_ID must be set for the ollama backend")
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self._httpx = httpx
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        # Only the command-line tools call synchronously; servers never open this one
+        if self._client is None:
+            self._client = self._httpx.Client(base_url=self.base_url)
+        return self._client
+
+    @property
+    def async_client(self):
+        # Created on first use, inside the event loop that serves requests
+        if self._async_client is None:
+            self._async_client = self._httpx.AsyncClient(base_url=self.base_url)
+        return self._async_client
+
+    def load(self):
+        pass
+
+    async def awarm(self):
+        # Opens a pooled connection before the first chat request needs one
+        response = await self.async_client.get("/api/tags", timeout=5)
+        response.raise_for_status()
+
+    def _body(self, contents, stream):
+        return {"model": self.model, "messages": to_messages(contents), "stream": stream}
+
+    def generate(self, contents, timeout):
+        response = self.client.post("/api/chat", json=self._body(contents, False), timeout=timeout)
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+
+    async def agenerate(self, contents, timeout):
+        response = await self.async_client.post("/api/chat", json=self._body(contents, False), timeout=timeout)
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+
+    async def astream(self, contents, timeout):
+        async with self.async_client.stream(
+            "POST", "/api/chat", json=self._body(contents, True), timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                text = data.get("message", {}).get("content", "")
+                if text:
+                    yield text
+                if data.get("done"):
+                    return
+
+    def is_transient(self, error):
+        if isinstance(error, self._httpx.HTTPStatusError):
+            return error.response.status_code == 429 or error.response.status_code >= 500
+        return isinstance(error, self._httpx.TransportError)
+
+
+class FakeBackend:
+    """Deterministic stand-in: the reply depends only on the prompt.
+
+    ``latency`` is the time to the first token and ``chunk_delay`` the time
+    between streamed words, so tests and benchmarks can model a slow model
+    without network access.
+    """
+    name = "fake"
+
+    def __init__(self, latency=0.0, chunk_delay=0.0, reply=None):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.reply = reply
+
+    def load(self):
+        pass
+
+    async def awarm(self):
+        pass
+
+    def _reply(self, contents):
+        if self.reply is not None:
+            return self.reply
+        messages = to_messages(contents)
+        last = messages[-1]["content"] if messages else ""
+        digest = hashlib.sha256(json.dumps(messages).encode()).hexdigest()[:8]
+        return f"Fake reply {digest} to {len(messages)} messages about: {' '.join(last.split()[:12])}"
+
+    def _wait(self, seconds, timeout):
+        if seconds > timeout:
+            time.sleep(max(timeout, 0))
+            raise LLMTimeout("fake backend exceeded the deadline")
+        time.sleep(seconds)
+
+    def generate(self, contents, timeout):
+        self._wait(self.latency, timeout)
+        return self._reply(contents)
+
+    async def _async_wait(self, seconds, timeout):
+        if seconds > timeout:
+            await asyncio.sleep(max(timeout, 0))
+            raise LLMTimeout("fake backend exceeded the deadline")
+        await asyncio.sleep(seconds)
+
+    async def agenerate(self, contents, timeout):
+        await self._async_wait(self.latency, timeout)
+        return self._reply(contents)
+
+    async def astream(self, contents, timeout):
+        await self._async_wait(self.latency, timeout)
+        for i, word in enumerate(self._reply(contents).split(" ")):
+            if i:
+                await asyncio.sleep(self.chunk_delay)
+            yield word if i == 0 else " " + word
+
+    def is_transient(self, error):
+        return False
+
+
+# --- gateway ---
+
+class LLMGateway:
+    def __init__(self, backend, max_concurrency=8, timeout=30.0, max_retries=2,
+                 backoff=0.5, max_backoff=8.0, hedge_after=None):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = asyncio.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=1000)
+        self._counters = {
+            "calls": 0,
+            "streams": 0,
+            "errors": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        kind = os.environ.get("LLM_BACKEND", "gemini").lower()
+        if kind == "ollama":
+            backend = OllamaBackend(
+                os.environ.get("OLLAMA_MODEL_ID"),
+                base_url=os.environ.get("OLLAMA_URL", "http://localhost:11434"),
+            )
+        elif kind == "fake":
+            backend = FakeBackend(
+                latency=float(os.environ.get("LLM_FAKE_LATENCY_MS", 0)) / 1000.0,
+                chunk_delay=float(os.environ.get("LLM_FAKE_CHUNK_DELAY_MS", 0)) / 1000.0,
+            )
+        elif kind == "gemini":
+            backend = GeminiBackend(
+                os.environ.get("GEMINI_MODEL", "gemini-2.0-flash"),
+                api_key=os.environ.get("GEMINI_API_KEY"),
+            )
+        else:
+            raise ValueError(f"Unknown LLM_BACKEND {kind!r}")
+        hedge_after = float(os.environ.get("LLM_HEDGE_AFTER_MS", 0)) / 1000.0
+        return cls(
+            backend,
+            max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 8)),
+            timeout=float(os.environ.get("LLM_TIMEOUT_S", 30)),
+            max_retries=int(os.environ.get("LLM_MAX_RETRIES", 2)),
+            hedge_after=hedge_after or None,
+        )
+
+    def load(self):
+        """Imports the backend's SDK now rather than on the first call."""
+        self.backend.load()
+
+    async def awarm(self):
+        await self.backend.awarm()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counters[key] += n
+
+    @staticmethod
+    def _count_tokens(contents=None, reply=None):
+        if contents is not None:
+            count("llm_calls")
+            count("llm_prompt_tokens", sum(estimate_tokens(m["content"]) for m in to_messages(contents)))
+        if reply:
+            count("llm_reply_tokens", estimate_tokens(reply))
+
+    def _acquire(self, deadline):
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            self._count("rejected")
+            raise LLMOverloaded(f"no free {self.backend.name} slot before the deadline")
+        with self._lock:
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _call(self, contents, deadline):
+        self._acquire(deadline)
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeout("deadline passed while waiting for a slot")
+            return self.backend.generate(contents, remaining)
+        finally:
+            self._release()
+
+    def _is_transient(self, error):
+        return isinstance(error, (LLMTimeout, LLMOverloaded, TimeoutError, ConnectionError)) or \
+            self.backend.is_transient(error)
+
+    def _sleep_before_retry(self, delay, deadline):
+        # Full jitter, but never past the deadline
+        pause = min(random.uniform(0, delay), deadline - time.monotonic())
+        if pause <= 0:
+            return False
+        time.sleep(pause)
+        return True
+
+    def generate(self, contents, timeout=None):
+        """Blocking ``agenerate`` for scripts that run outside an event loop."""
+        with span("llm"):
+            return self._generate(contents, timeout)
+
+    def _generate(self, contents, timeout):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        started = time.perf_counter()
+        self._count("calls")
+        self._count_tokens(contents)
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                text = self._call(contents, deadline)
+                with self._lock:
+                    self._latencies.append(time.perf_counter() - started)
+                self._count_tokens(reply=text)
+                return text
+            except Exception as e:
+                if isinstance(e, (LLMTimeout, TimeoutError)):
+                    self._count("timeouts")
+                retry = attempt < self.max_retries and self._is_transient(e)
+                if not retry or not self._sleep_before_retry(delay, deadline):
+                    self._count("errors")
+                    raise
+                self._count("retries")
+                delay = min(delay * 2, self.max_backoff)
+
+    # --- async API ---
+
+    async def _aacquire(self, deadline):
+        try:
+            await asyncio.wait_for(self._async_slots.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._count("rejected")
+            raise LLMOverloaded(f"no free {self.backend.name} slot before the deadline")
+        with self._lock:
+            self._in_flight += 1
+
+    def _arelease(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._async_slots.release()
+
+    async def _acall(self, contents, deadline):
+        await self._aacquire(deadline)
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeout("deadline passed while waiting for a slot")
+            try:
+                return await asyncio.wait_for(self.backend.agenerate(contents, remaining), remaining)
+            except asyncio.TimeoutError:
+                raise LLMTimeout(f"{self.backend.name} call exceeded its deadline")
+        finally:
+            self._arelease()
+
+    async def _ahedged_call(self, contents, deadline):
+        primary = asyncio.ensure_future(self._acall(contents, deadline))
+        done, _ = await asyncio.wait({primary}, timeout=min(self.hedge_after, max(0.0, deadline - time.monotonic())))
+        if done or time.monotonic() >= deadline:
+            return await primary
+
+        self._count("hedges")
+        hedge = asyncio.ensure_future(self._acall(contents, deadline))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise LLMTimeout(f"{self.backend.name} call exceeded its deadline")
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Unlike threads, the losing call can actually be stopped
+            for task in pending:
+                task.cancel()
+
+    async def _asleep_before_retry(self, delay, deadline):
+        pause = min(random.uniform(0, delay), deadline - time.monotonic())
+        if pause <= 0:
+            return False
+        await asyncio.sleep(pause)
+        return True
+
+    async def agenerate(self, contents, timeout=None):
+        """Returns the model's reply to ``contents`` as text."""
+        with span("llm"):
+            return await self._agenerate(contents, timeout)
+
+    async def _agenerate(self, contents, timeout):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        started = time.perf_counter()
+        self._count("calls")
+        self._count_tokens(contents)
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.hedge_after:
+                    text = await self._ahedged_call(contents, deadline)
+                else:
+                    text = await self._acall(contents, deadline)
+                with self._lock:
+                    self._latencies.append(time.perf_counter() - started)
+                self._count_tokens(reply=text)
+                return text
+            except Exception as e:
+                if isinstance(e, (LLMTimeout, TimeoutError)):
+                    self._count("timeouts")
+                retry = attempt < self.max_retries and self._is_transient(e)
+                if not retry or not await self._asleep_before_retry(delay, deadline):
+                    self._count("errors")
+                    raise
+                self._count("retries")
+                delay = min(delay * 2, self.max_backoff)
+
+    async def astream(self, contents, timeout=None):
+        """Yields the reply in text chunks as the backend produces them.
+
+        Failures before the first chunk are retried like ``agenerate``; once
+        text has been yielded the stream can't be replayed, so later errors
+        propagate. The concurrency slot is held until the stream is consumed
+        or closed.
+        """
+        with span("llm"):
+            self._count_tokens(contents)
+            reply = []
+            try:
+                async for text in self._astream(contents, timeout):
+                    reply.append(text)
+                    yield text
+            finally:
+                self._count_tokens(reply="".join(reply))
+
+    async def _astream(self, contents, timeout):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._count("streams")
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            await self._aacquire(deadline)
+            yielded = False
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMTimeout("deadline passed while waiting for a slot")
+                async for text in self.backend.astream(contents, remaining):
+                    yielded = True
+                    yield text
+                return
+            except Exception as e:
+                if isinstance(e, (LLMTimeout, TimeoutError)):
+                    self._count("timeouts")
+                retry = not yielded and attempt < self.max_retries and self._is_transient(e)
+                if not retry or not await self._asleep_before_retry(delay, deadline):
+                    self._count("errors")
+                    raise
+                self._count("retries")
+                delay = min(delay * 2, self.max_backoff)
+            finally:
+                self._arelease()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["backend"] = self.backend.name
+            stats["in_flight"] = self._in_flight
+            latencies = sorted(self._latencies)
+        if latencies:
+            stats["latency_p50"] = latencies[len(latencies) // 2]
+            stats["latency_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return stats
@@ -1,163 +1,1479 @@
-from fastapi import FastAPI, HTTPException, Request, Header, Depends
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
-from dotenv import load_dotenv
+"""The Prenova API: chat, diet plans and risk predictions as one ASGI service.
+
+Handlers are coroutines. Supabase is reached through the async client and
+LLM calls through ``LLMGateway.agenerate``/``astream``, so a request waiting
+on Gemini or the database holds no thread. Model inference is CPU-bound and
+runs off the event loop: single records on the micro-batchers' worker
+threads, batch scoring on a bounded ``InferencePool``. Models come from the
+``ModelRegistry`` and every stored prediction records the version used.
+
+Routes, request bodies and responses (including ``{"error": ...}`` bodies
+and status codes) are the ones the Flask app served.
+
+Importing this module only defines the app; models, SDKs and client
+connections are loaded by the warm-up that starts with the server (or by
+``preload`` in a parent that forks workers). ``/healthz`` answers from the
+start, ``/readyz`` once the models are loaded and warm.
+
+Each request is traced (see metrics.py): auth, Supabase queries, LLM calls
+and inference are timed as stages and exported with the components' own
+counters on ``/metrics``.
+
+Run with: uvicorn main:app --host 0.0.0.0 --port 5000 (or serve.py for several workers)
+"""
+import asyncio
+import functools
+import hmac
 import os
-import joblib
+import uuid
+from datetime import datetime
+from urllib.parse import urlencode
+
 import numpy as np
-import google.generativeai as genai
-from supabase import create_client, Client
-import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+from auth import TokenVerifier
+from batching import BatcherOverloaded, InferencePool
+from model_registry import ModelRegistry
+from lazy_client import LazyClient
+import metrics
+from metrics import TRACE_HEADER, TraceMiddleware, TracedClient, count_cache, span
+from warmup import WarmUp
+from write_behind import WriteBehindBuffer
+from message_store import ChatMessageStore
+from chat_context import ChatContextManager
+from streaming import StreamRelay, sse_event
+from llm import LLMGateway
+from titles import TitleWorker, heuristic_title
+from diet_cache import DietPlanCache
+from diet_library import DietLibrary
+from diet_schema import StructuredDietPlan, plan_events
+from session_listing import SessionListing, ListingError, parse_limit, NEXT_CURSOR_HEADER
+from read_cache import ReadCache, etag_matches
+from ctg_stream import CTGStream, StreamError, SAMPLE_RATE_HZ, MAX_SAMPLE_RATE_HZ
+from trends import TrendReader, TrendError, parse_weeks, DEFAULT_WEEKS, MAX_WEEKS, DEFAULT_WINDOW, MAX_WINDOW
+from idempotency import (
+    IdempotencyStore, IdempotencyConflict, IdempotencyTimeout, StoredResponse, REPLAY_HEADER, request_key
+)
+from predictions import (
+    MATERNAL_FEATURES, FETAL_FEATURES, MATERNAL_RISK_LABELS, FETAL_HEALTH_LABELS,
+    MAX_BATCH_ROWS, score_records, predict_matrix
+)
 
-# Load environment variables
 load_dotenv()
 
 app = FastAPI()
 
-# CORS Middleware
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "Link", TRACE_HEADER, "Server-Timing"],
 )
 
-# Supabase & Gemini setup
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-OLLAMA_MODEL_ID = os.getenv("OLLAMA_MODEL_ID")
+# Added last so it is outermost and times the whole request, CORS included
+app.add_middleware(TraceMiddleware, **TraceMiddleware.options_from_env())
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
 if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Missing Supabase credentials")
-
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Models and scalers
-maternal_model = joblib.load("finalized_maternal_model.sav")
-maternal_scaler = joblib.load("scaleX.pkl")
-fetal_model = joblib.load("fetal_health_model.sav")
-fetal_scaler = joblib.load("scaleX1.pkl")
-
-# Gemini model
-genai.configure(api_key=GEMINI_API_KEY)
-chatmodel = genai.GenerativeModel("gemini-2.0-flash")
-
-# --- Schemas ---
-class DoctorProfile(BaseModel):
-    name: str
-    phone: str
-    specialty: str
-    location: str
-    profile_image_url: str
-
-class MaternalVitals(BaseModel):
-    age: float
-    systolic_bp: float
-    diastolic_bp: float
-    blood_glucose: float
-    body_temp: float
-    heart_rate: float
-
-class FetalFeatures(BaseModel):
-    features: List[float]
-
-class DietRequest(BaseModel):
-    trimester: str
-    weight: float
-    health_conditions: str
-    dietary_preference: str
-
-# --- Utility ---
-def verify_token(auth_header: str) -> str:
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="No valid token provided")
-    token = auth_header.split(" ")[1]
-    user_data = supabase.auth.get_user(token)
+    raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY environment variables")
+
+# Queries through either client are timed and counted as database round trips
+def create_async_supabase():
+    from supabase import AsyncClient
+    return TracedClient(AsyncClient(SUPABASE_URL, SUPABASE_KEY))
+
+def create_sync_supabase():
+    from supabase import create_client
+    return TracedClient(create_client(SUPABASE_URL, SUPABASE_KEY))
+
+# Handlers use the async client; the write-behind buffer's own thread keeps a sync one.
+# Both are created by warm-up or first use, not at import.
+supabase = LazyClient(create_async_supabase)
+supabase_sync = LazyClient(create_sync_supabase)
+
+# All chat, title, summary and diet calls go through one bounded, deadline-aware gateway
+llm = LLMGateway.from_env()
+
+# Generated diet plans are reused for requests that normalize to the same key
+diet_cache = DietPlanCache.from_env()
+
+# Diet plans are assembled from the prebuilt library (build_diet_library.py); the LLM
+# only adds personalized tips on top. DIET_PLAN_MODE=llm generates whole plans instead.
+diet_library = DietLibrary.load("diet_library.json")
+DIET_PLAN_MODE = os.environ.get("DIET_PLAN_MODE", "library")
+DIET_LLM_PERSONALIZE = os.environ.get("DIET_LLM_PERSONALIZE", "false").lower() == "true"
+
+# Retried requests share or replay the original response instead of recomputing it
+idempotency_store = IdempotencyStore.from_env()
+
+# Verifies bearer tokens locally; only falls back to supabase.auth.get_user on a miss
+token_verifier = TokenVerifier.from_env(remote_lookup=lambda token: supabase.auth.get_user(token))
+
+# vitals/ctg rows are stored in the background; responses don't depend on them
+prediction_writer = WriteBehindBuffer.from_env(supabase_sync).install_shutdown_hook()
+
+# Chat turns are appended as rows to chat_messages instead of rewriting chat_sessions.messages
+message_store = ChatMessageStore(supabase)
+
+# Session lists are paged by (updated_at, id); ?summary=1 drops the heavy columns
+chat_session_listing = SessionListing(supabase, 'chat_sessions', ['id', 'title', 'created_at', 'updated_at'])
+diet_session_listing = SessionListing(
+    supabase, 'diet_sessions',
+    ['id', 'title', 'trimester', 'weight', 'health_conditions', 'dietary_preference',
+     'diet_plan', 'created_at', 'updated_at'],
+    heavy=['diet_plan'],
+)
+
+# Vitals/ctg trends come from weekly aggregates kept up to date by insert triggers
+trend_reader = TrendReader(supabase)
+
+# Session reads are cached per user (with ETags) and dropped by the handlers that write them
+read_cache = ReadCache.from_env()
+
+# Models are loaded from models.json on first use and hot-swapped when it changes. Each
+# version coalesces concurrent single-record predictions in its own micro-batcher and
+# runs on the fused predictor from build_compiled_models.py when present.
+models = ModelRegistry.from_env()
+
+# Required by the /admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Batch scoring runs on a few worker threads, never on the event loop
+inference_pool = InferencePool.from_env()
+
+# System prompt for the AI assistant
+SYSTEM_PROMPT = {
+    "role": "system",
+    "content": "You are NOVA, an AI assistant that is here to help users with their pregnancy journey. "
+               "You will only provide accurate and helpful information related to pregnancy, avoiding any "
+               "medical advice or unrelated topics. Be polite and respectful at all times. "
+               "Format your responses using markdown for better readability with headings, bullet points, "
+               "and emphasis where appropriate."
+                "And give only consised response all the time only give fully description when asked by the user"
+                "like explain, describe and any similar meaning words"
+}
+
+async def generate_chat_title(first_message):
+    """Generate a meaningful title for the chat session based on the first message"""
+    prompt = f"Generate a short, descriptive title (max 6 words) for a chat that starts with: '{first_message[:100]}'"
+    return await llm.agenerate([{"role": "user", "parts": [{"text": prompt}]}])
+
+# LLM titles are generated in the background; new sessions get a heuristic title meanwhile
+title_worker = TitleWorker.from_env(generate_chat_title, supabase)
+TITLE_PUSH_WAIT = float(os.environ.get("TITLE_PUSH_WAIT_MS", 3000)) / 1000.0
+
+async def summarize_conversation(previous_summary, messages, max_tokens):
+    """Fold older chat messages into the rolling summary used as chat context"""
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    prompt = (
+        "Update the summary of an ongoing pregnancy-support chat between a user and NOVA. "
+        "Keep facts about the user (trimester, symptoms, preferences, concerns) and the key "
+        f"points already answered. Reply with the summary only, in at most {max_tokens * 3 // 4} words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+    return (await llm.agenerate(prompt)).strip()
+
+# Prompts carry the system prompt, a rolling summary and only the latest turns verbatim
+chat_context = ChatContextManager.from_env(
+    message_store, supabase, summarize_conversation, system_prompt=SYSTEM_PROMPT["content"]
+)
+
+# --- Helpers ---
+
+def error(message, status):
+    return JSONResponse({'error': message}, status_code=status)
+
+async def request_user(request):
+    """``(user_id, None)`` for a valid bearer token, otherwise ``(None, 401 response)``"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None, error('No valid token provided', 401)
+    with span('auth'):
+        user_data = await token_verifier.get_user_async(auth_header.split(' ')[1])
+    if not user_data or not user_data.user:
+        return None, error('Invalid token', 401)
+    return user_data.user.id, None
+
+async def request_user_id(request):
+    """User id of the request's bearer token, or None"""
+    user_id, _ = await request_user(request)
+    return user_id
+
+def query_int(request, name):
+    """Integer query parameter, or None when missing or malformed"""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return None
+
+async def migrate_legacy_messages(session):
+    """Move a session's legacy messages array into chat_messages rows on first use"""
+    legacy = [msg for msg in (session.get('messages') or []) if msg.get('role') != 'system']
+    if legacy and await message_store.import_legacy(session['id'], legacy):
+        await supabase.table('chat_sessions').update({'messages': [SYSTEM_PROMPT]}).eq('id', session['id']).execute()
+
+def build_gemini_messages(history, summary=None):
+    """Convert stored messages to Gemini format, with the system prompt first"""
+    # Include system prompt as user message to Gemini
+    gemini_messages = [{"role": "user", "parts": [{"text": SYSTEM_PROMPT["content"]}]}]
+    if summary:
+        gemini_messages.append({"role": "user", "parts": [{"text": f"Summary of our conversation so far: {summary}"}]})
+    for msg in history:
+        if msg["role"] == "user":
+            gemini_messages.append({"role": "user", "parts": [{"text": msg["content"]}]})
+        elif msg["role"] == "assistant":
+            gemini_messages.append({"role": "model", "parts": [{"text": msg["content"]}]})
+    return gemini_messages
+
+async def save_chat_turn(session, user_id, user_msg, reply):
+    """Store a user message and its reply, titling new sessions.
+
+    Returns the current title and a task for the LLM title, which is
+    ``None`` unless one was scheduled for this turn.
+    """
+    assistant_msg = {"role": "assistant", "content": reply}
+
+    # Append both messages as new rows; the rest of the history is untouched
+    user_seq, _ = await message_store.append(session['id'], [user_msg, assistant_msg])
+
+    # Title a new session right away; the LLM title replaces it when ready
+    current_title = session['title']
+    new_title = current_title == 'New Chat' and user_seq == 1
+    if new_title:
+        current_title = heuristic_title(user_msg['content'])
+
+    update_data = {
+        'title': current_title,
+        'updated_at': datetime.utcnow().isoformat()
+    }
+
+    await supabase.table('chat_sessions').update(update_data).eq('id', session['id']).execute()
+    read_cache.invalidate(user_id, 'chat', session['id'])
+
+    # Scheduled after the update so the worker finds the placeholder it replaces
+    title_task = None
+    if new_title:
+        title_task = schedule_title(user_id, session['id'], user_msg['content'], current_title)
+    return current_title, title_task
+
+def schedule_title(user_id, session_id, first_message, placeholder):
+    """Start the LLM title; cached reads of the session are dropped once it is written"""
+    title_task = title_worker.schedule(session_id, first_message, placeholder)
+    if title_task is not None:
+        title_task.add_done_callback(lambda _: read_cache.invalidate(user_id, 'chat', session_id))
+    return title_task
+
+async def list_sessions(listing, request, user_id):
+    """One page of a session list; the cursor for the next page goes in a header.
+
+    Query parameters: ``limit``, ``cursor``, ``fields`` (comma-separated) and
+    ``summary``. The body stays a plain list so existing clients keep working.
+    """
+    args = request.query_params
+    try:
+        rows, next_cursor = await listing.page(
+            user_id,
+            fields=args.get('fields'),
+            summary=args.get('summary', '').lower() in ('1', 'true', 'yes'),
+            limit=parse_limit(args.get('limit')),
+            cursor=args.get('cursor'),
+        )
+    except ListingError as e:
+        return error(str(e), 400)
+
+    headers = {}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+        next_url = request.url.replace(query=urlencode(dict(args, cursor=next_cursor)))
+        headers['Link'] = f'<{next_url}>; rel="next"'
+    return JSONResponse(rows, headers=headers)
+
+def idempotent(by_body=False):
+    """Deduplicate retries of a view by Idempotency-Key. With ``by_body``, requests
+    without the header are also merged while an identical one is in flight."""
+    def decorate(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            request = kwargs['request']
+            user_id = await request_user_id(request)
+            if user_id is None:
+                return await view(*args, **kwargs)  # let the view reject it
+
+            flight = request_key(
+                user_id, request.method, request.url.path,
+                request.headers.get('Idempotency-Key'), await request.body(), by_body=by_body
+            )
+            if flight is None:
+                return await view(*args, **kwargs)
+            key, fingerprint, keep = flight
+            try:
+                shared = await idempotency_store.begin_async(key, fingerprint)
+            except IdempotencyConflict as e:
+                return error(str(e), 422)
+            except IdempotencyTimeout as e:
+                return error(str(e), 409)
+            count_cache('idempotency', shared is not None)
+            if shared is not None:
+                return Response(shared.body, status_code=shared.status, media_type=shared.content_type,
+                                headers={REPLAY_HEADER: 'true'})
+
+            try:
+                response = await view(*args, **kwargs)
+            except BaseException:
+                idempotency_store.abandon(key)
+                raise
+            stored = StoredResponse(response.status_code, response.body, response.headers.get('content-type'))
+            # Server errors are shared with concurrent waiters but not replayed later
+            idempotency_store.finish(key, stored, keep=keep and response.status_code < 500)
+            return response
+        return wrapper
+    return decorate
+
+SESSION_TABLES = {'chat': 'chat_sessions', 'diet': 'diet_sessions'}
+
+async def session_version(kind, user_id, session_id=None):
+    """What a cached session read is checked against before it is served.
+
+    A session's ``updated_at``; for a list, the user's row in
+    ``session_versions``, which triggers bump on every insert, update and
+    delete of their sessions (sql/session_versions.sql). Both are one
+    primary-key read and see writes handled by other workers.
+    """
+    if session_id is not None:
+        result = await supabase.table(SESSION_TABLES[kind]).select('updated_at').eq(
+            'id', session_id).eq('user_id', user_id).execute()
+        return result.data[0]['updated_at'] if result.data else None
+    result = await supabase.table('session_versions').select('version').eq(
+        'user_id', user_id).eq('kind', kind).limit(1).execute()
+    return result.data[0]['version'] if result.data else 0
+
+def cached_read(kind):
+    """Serve a session read from read_cache, with an ETag; If-None-Match gets a 304.
+    An entry is only served while the session's version is unchanged."""
+    def decorate(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            request = kwargs['request']
+            user_id = await request_user_id(request)
+            if user_id is None:
+                return await view(*args, **kwargs)  # let the view reject it
+            session_id = kwargs.get('session_id')
+            key = read_cache.key(user_id, kind, session_id, request.url.query.encode())
+            token = read_cache.begin()
+            version = await session_version(kind, user_id, session_id)
+            entry = read_cache.get(key, version)
+            count_cache('session_read', entry is not None)
+            if entry is None:
+                response = await view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                headers = {h: response.headers[h] for h in (NEXT_CURSOR_HEADER, 'Link') if h in response.headers}
+                entry = read_cache.put(key, token, response.body, headers, version)
+
+            headers = dict(entry.headers, ETag=f'"{entry.etag}"')
+            headers['Cache-Control'] = 'private, no-cache'
+            if etag_matches(request.headers.get('If-None-Match'), entry.etag):
+                return Response(status_code=304, headers=headers)
+            return Response(entry.body, media_type='application/json', headers=headers)
+        return wrapper
+    return decorate
+
+# ===== CHAT SESSION ENDPOINTS =====
+
+@app.get('/chat/sessions')
+@cached_read('chat')
+async def get_chat_sessions(request: Request):
+    """Get the authenticated user's chat sessions, most recent first, one page at a time"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        return await list_sessions(chat_session_listing, request, user_id)
+
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.post('/chat/sessions')
+async def create_chat_session(request: Request):
+    """Create a new chat session"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        session_id = str(uuid.uuid4())
+
+        # Create new session with system prompt
+        session_data = {
+            'id': session_id,
+            'user_id': user_id,
+            'title': 'New Chat',
+            'messages': [SYSTEM_PROMPT],
+            'created_at': datetime.utcnow().isoformat(),
+            'updated_at': datetime.utcnow().isoformat()
+        }
+
+        result = await supabase.table('chat_sessions').insert(session_data).execute()
+        read_cache.invalidate(user_id, 'chat', session_id)
+
+        return JSONResponse(result.data[0], status_code=201)
+
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.get('/chat/sessions/{session_id}')
+@cached_read('chat')
+async def get_chat_session(request: Request, session_id: str):
+    """Get a specific chat session with its messages"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        # Optional paging: ?limit=N returns the newest N messages, ?before=<seq> goes further back
+        args = request.query_params
+        limit = None
+        if 'limit' in args:
+            try:
+                limit = parse_limit(args['limit'])
+            except ListingError as e:
+                return error(str(e), 400)
+        before = query_int(request, 'before')
+        if 'before' in args and before is None:
+            return error('before must be an integer', 400)
+
+        session_data = await supabase.table('chat_sessions').select(
+            'id, title, messages, created_at, updated_at'
+        ).eq('id', session_id).eq('user_id', user_id).execute()
+
+        if not session_data.data:
+            return error('Session not found', 404)
+
+        session = session_data.data[0]
+        await migrate_legacy_messages(session)
+
+        response = {
+            'id': session['id'],
+            'title': session['title'],
+            'created_at': session['created_at'],
+            'updated_at': session['updated_at']
+        }
+
+        if limit:
+            rows, next_before = await message_store.page(session_id, before=before, limit=limit)
+            response['messages'] = [
+                {'role': row['role'], 'content': row['content'], 'seq': row['seq']} for row in rows
+            ]
+            response['next_before'] = next_before
+        else:
+            response['messages'] = await message_store.history(session_id)
+
+        return JSONResponse(response)
+
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.delete('/chat/sessions/{session_id}')
+async def delete_chat_session(request: Request, session_id: str):
+    """Delete a specific chat session"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        result = await supabase.table('chat_sessions').delete().eq(
+            'id', session_id
+        ).eq('user_id', user_id).execute()
+
+        if not result.data:
+            return error('Session not found', 404)
+
+        await message_store.delete_session(session_id)
+        read_cache.invalidate(user_id, 'chat', session_id)
+
+        return JSONResponse({'message': 'Session deleted successfully'})
+
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.post('/chat/sessions/{session_id}/message')
+@idempotent(by_body=True)
+async def send_message_to_session(request: Request, session_id: str):
+    """Send a message to a specific chat session"""
+    try:
+        data = await request.json()
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        session_data = await supabase.table('chat_sessions').select(
+            'id, title, messages, context_summary, context_summary_seq'
+        ).eq('id', session_id).eq('user_id', user_id).execute()
+
+        if not session_data.data:
+            return error('Session not found', 404)
+
+        session = session_data.data[0]
+        await migrate_legacy_messages(session)
+
+        user_msg = {"role": "user", "content": data['message']}
+        summary, recent = await chat_context.context_for(session, user_msg)
+
+        reply = await llm.agenerate(build_gemini_messages(recent + [user_msg], summary))
+        current_title, title_task = await save_chat_turn(session, user_id, user_msg, reply)
+
+        return JSONResponse({
+            "content": reply,
+            "title": current_title,
+            "title_pending": title_task is not None
+        })
+
+    except Exception as e:
+        print(f"Error in send_message_to_session: {e}")
+        return error(str(e), 500)
+
+@app.post('/chat/sessions/{session_id}/message/stream')
+async def stream_message_to_session(request: Request, session_id: str):
+    """Send a message to a chat session and stream the reply as server-sent events"""
+    try:
+        data = await request.json()
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        session_data = await supabase.table('chat_sessions').select(
+            'id, title, messages, context_summary, context_summary_seq'
+        ).eq('id', session_id).eq('user_id', user_id).execute()
+
+        if not session_data.data:
+            return error('Session not found', 404)
+
+        session = session_data.data[0]
+        await migrate_legacy_messages(session)
+
+        user_msg = {"role": "user", "content": data['message']}
+        summary, recent = await chat_context.context_for(session, user_msg)
+        chunks = llm.astream(build_gemini_messages(recent + [user_msg], summary))
+
+        title_tasks = []
+
+        async def on_complete(text):
+            title, title_task = await save_chat_turn(session, user_id, user_msg, text)
+            if title_task is not None:
+                title_tasks.append(title_task)
+            return {"content": text, "title": title, "title_pending": title_task is not None}
+
+        async def events():
+            async for event in StreamRelay(chunks, on_complete).events():
+                yield event
+            # Push the LLM title if it arrives shortly; otherwise the sessions list has it later
+            for title_task in title_tasks:
+                try:
+                    title = await asyncio.wait_for(asyncio.shield(title_task), TITLE_PUSH_WAIT)
+                    yield sse_event({"title": title}, event="title")
+                except asyncio.TimeoutError:
+                    pass
+
+        # Each chunk goes out as a "delta" event; a final "done" event carries
+        # the full reply and title once it has been stored
+        return StreamingResponse(
+            events(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+    except Exception as e:
+        print(f"Error in stream_message_to_session: {e}")
+        return error(str(e), 500)
+
+# ===== LEGACY CHAT ENDPOINTS (for backward compatibility) =====
+
+@app.get('/chat')
+async def chatbot_get(request: Request):
+    """Legacy endpoint - redirects to session-based approach"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        # Get the most recent session
+        sessions_data = await supabase.table('chat_sessions').select(
+            'id, messages'
+        ).eq('user_id', user_id).order('updated_at', desc=True).limit(1).execute()
+
+        if sessions_data.data:
+            session = sessions_data.data[0]
+            await migrate_legacy_messages(session)
+            return JSONResponse(await message_store.history(session['id']))
+        else:
+            return JSONResponse([])
+
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.post('/chat')
+async def chatbot_post(request: Request):
+    """Legacy endpoint - creates new session if none exists"""
+    try:
+        data = await request.json()
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        # Get or create a session
+        sessions_data = await supabase.table('chat_sessions').select(
+            'id, messages, context_summary, context_summary_seq'
+        ).eq('user_id', user_id).order('updated_at', desc=True).limit(1).execute()
+
+        if sessions_data.data:
+            session = sessions_data.data[0]
+            session_id = session['id']
+            await migrate_legacy_messages(session)
+        else:
+            session_id = str(uuid.uuid4())
+            session = {'id': session_id}
+
+            session_data = {
+                'id': session_id,
+                'user_id': user_id,
+                'title': 'New Chat',
+                'messages': [SYSTEM_PROMPT],
+                'created_at': datetime.utcnow().isoformat(),
+                'updated_at': datetime.utcnow().isoformat()
+            }
+            await supabase.table('chat_sessions').insert(session_data).execute()
+
+        user_msg = {"role": "user", "content": data['message']}
+        summary, recent = await chat_context.context_for(session, user_msg)
+
+        reply = await llm.agenerate(build_gemini_messages(recent + [user_msg], summary))
+        assistant_msg = {"role": "assistant", "content": reply}
+        user_seq, _ = await message_store.append(session_id, [user_msg, assistant_msg])
+
+        # Title new sessions heuristically now and with the LLM in the background
+        title = heuristic_title(data['message']) if user_seq == 1 else None
+
+        update_data = {
+            'updated_at': datetime.utcnow().isoformat()
+        }
+        if title:
+            update_data['title'] = title
+
+        await supabase.table('chat_sessions').update(update_data).eq('id', session_id).execute()
+        read_cache.invalidate(user_id, 'chat', session_id)
+        if title:
+            schedule_title(user_id, session_id, data['message'], title)
+
+        return JSONResponse({"response": reply})
+
+    except Exception as e:
+        print(e)
+        return error(str(e), 500)
+
+# ===== PROFILE AND PREDICTION ENDPOINTS =====
+
+@app.post('/create_doctor_profile')
+async def create_doctor_profile(request: Request):
+    '''Simple endpoint for us to dump some data into a table'''
+    try:
+        data = await request.json()
+        doctor_data = {
+            'name': data.get('name'),
+            'phone': data.get('phone'),
+            'specialty': data.get('specialty'),
+            'location': data.get('location'),
+            'profile_image_url': data.get('profile_image_url'),
+        }
+
+        result = await supabase.table('doctors').upsert(doctor_data).execute()
+
+        return JSONResponse({"message": "Doctor profile created successfully", "data": result.data})
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.post('/predict_maternal')
+@idempotent()
+async def predict_maternal(request: Request):
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        data = await request.json()
+        try:
+            features = [
+                float(data["age"]),
+                float(data["systolic_bp"]),
+                float(data["diastolic_bp"]),
+                float(data["blood_glucose"]),
+                float(data["body_temp"]),
+                float(data["heart_rate"])
+            ]
+        except (KeyError, TypeError, ValueError):
+            return error(f'Missing or non-numeric values, expected {", ".join(MATERNAL_FEATURES)}', 400)
+        if not np.isfinite(features).all():
+            return error('Features must be finite numbers', 400)
+
+        maternal = await models.aget('maternal')
+        try:
+            with span('inference'):
+                prediction = await maternal.batcher.predict_async(features)
+        except BatcherOverloaded as e:
+            return error(str(e), 503)
+        risk_level = MATERNAL_RISK_LABELS[prediction]
+
+        # Queue for insert into vitals table
+        vital_data = {
+            'UID': user_id,
+            'age': data["age"],
+            'systolic_bp': data["systolic_bp"],
+            'diastolic_bp': data["diastolic_bp"],
+            'blood_glucose': data["blood_glucose"],
+            'body_temp': data["body_temp"],
+            'heart_rate': data["heart_rate"],
+            'prediction': prediction,
+            'model_version': maternal.version
+        }
+        await prediction_writer.awrite('vitals', vital_data)
+
+        return JSONResponse({"prediction": risk_level, "model_version": maternal.version})
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.post('/predict_fetal')
+@idempotent()
+async def predict_fetal(request: Request):
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        data = await request.json()
+        if not data or "features" not in data:
+            return error('Missing required feature data', 400)
+
+        # Ensure feature list has correct length
+        try:
+            features = np.array(data["features"], dtype=float)
+        except (TypeError, ValueError):
+            return error('Features must be numbers', 400)
+        expected_feature_length = len(FETAL_FEATURES)
+        if features.ndim != 1 or features.shape[0] != expected_feature_length:
+            return error(f'Invalid feature length, expected {expected_feature_length}', 400)
+        if not np.isfinite(features).all():
+            return error('Features must be finite numbers', 400)
+
+        # Scale and predict through the active version's micro-batcher
+        fetal = await models.aget('fetal')
+        try:
+            with span('inference'):
+                prediction = await fetal.batcher.predict_async(features)
+        except BatcherOverloaded as e:
+            return error(str(e), 503)
+        except Exception as e:
+            return error(f'Prediction failed: {str(e)}', 500)
+
+        # The model's classes are 0-2 (Normal, Suspect, Pathological)
+        prediction_result = FETAL_HEALTH_LABELS.get(prediction, "Unknown")
+
+        ctg_data = {
+            'UID': user_id,
+            **{k: float(v) for k, v in zip(FETAL_FEATURES, features.flatten())},
+            'prediction': prediction,
+            'model_version': fetal.version
+        }
+
+        try:
+            await prediction_writer.awrite('ctg', ctg_data)
+        except Exception as e:
+            return error(f'Database insert failed: {str(e)}', 500)
+
+        return JSONResponse({"prediction": prediction, "status": prediction_result, "model_version": fetal.version})
+
+    except Exception as e:
+        return error(f"Unexpected error: {str(e)}", 500)
+
+async def batch_records(request):
+    """Extract the list of records from a batch prediction request body"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    records = data.get('records') if isinstance(data, dict) else data
+    if not isinstance(records, list) or not records:
+        return None, error('Expected a non-empty list of records', 400)
+    if len(records) > MAX_BATCH_ROWS:
+        return None, error(f'Too many records, maximum is {MAX_BATCH_ROWS}', 413)
+    return records, None
+
+@app.post('/predict_maternal/batch')
+async def predict_maternal_batch(request: Request):
+    """Score many maternal vitals records with a single transform/predict call"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        records, failure = await batch_records(request)
+        if failure:
+            return failure
+
+        maternal = await models.aget('maternal')
+        try:
+            with span('inference'):
+                X, scored, errors = await inference_pool.run(
+                    score_records, records, MATERNAL_FEATURES, maternal.predictor, maternal.predictor_scaler
+                )
+        except BatcherOverloaded as e:
+            return error(str(e), 503)
+
+        results = [{'index': i, 'error': message} for i, message in errors.items()]
+        vital_rows = []
+        for i, prediction in scored:
+            results.append({'index': i, 'prediction': MATERNAL_RISK_LABELS.get(prediction, "Unknown")})
+            vital_data = {'UID': user_id}
+            # Same columns as the single-record endpoint
+            vital_data.update({k: float(v) for k, v in zip(MATERNAL_FEATURES, X[i])})
+            vital_data['prediction'] = prediction
+            vital_data['model_version'] = maternal.version
+            vital_rows.append(vital_data)
+
+        if vital_rows:
+            try:
+                await prediction_writer.awrite_many('vitals', vital_rows)
+            except Exception as e:
+                return error(f'Database insert failed: {str(e)}', 500)
+
+        results.sort(key=lambda r: r['index'])
+        return JSONResponse({"results": results, "scored": len(scored), "failed": len(errors),
+                             "model_version": maternal.version})
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.post('/predict_fetal/batch')
+async def predict_fetal_batch(request: Request):
+    """Score many CTG feature vectors with a single transform/predict call"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        records, failure = await batch_records(request)
+        if failure:
+            return failure
+
+        fetal = await models.aget('fetal')
+        try:
+            with span('inference'):
+                X, scored, errors = await inference_pool.run(
+                    score_records, records, FETAL_FEATURES, fetal.predictor, fetal.predictor_scaler
+                )
+        except BatcherOverloaded as e:
+            return error(str(e), 503)
+
+        results = [{'index': i, 'error': message} for i, message in errors.items()]
+        ctg_rows = []
+        for i, prediction in scored:
+            results.append({
+                'index': i,
+                'prediction': prediction,
+                'status': FETAL_HEALTH_LABELS.get(prediction, "Unknown")
+            })
+            ctg_data = {'UID': user_id}
+            ctg_data.update({k: float(v) for k, v in zip(FETAL_FEATURES, X[i])})
+            ctg_data['prediction'] = prediction
+            ctg_data['model_version'] = fetal.version
+            ctg_rows.append(ctg_data)
+
+        if ctg_rows:
+            try:
+                await prediction_writer.awrite_many('ctg', ctg_rows)
+            except Exception as e:
+                return error(f'Database insert failed: {str(e)}', 500)
+
+        results.sort(key=lambda r: r['index'])
+        return JSONResponse({"results": results, "scored": len(scored), "failed": len(errors),
+                             "model_version": fetal.version})
+    except Exception as e:
+        return error(f"Unexpected error: {str(e)}", 500)
+
+# ===== CTG STREAM ENDPOINT =====
+
+@app.websocket('/ctg/stream')
+async def ctg_stream(websocket: WebSocket):
+    """Score a monitoring session from raw FHR/UC samples as they arrive.
+
+    Each message is ``{"fhr": [...], "uc": [...], "fm": [...]}`` with samples
+    at ``?rate=`` Hz (4 by default, at most 16; ``fm`` is optional). Features and a score
+    are sent back every CTG_STREAM_SCORE_EVERY_S seconds of signal; send
+    ``{"end": true}`` to finish. The last score is stored as a ctg row unless
+    ``?store=false``. Browsers can't set headers on a WebSocket, so the token
+    may also come as ``?access_token=``.
+    """
+    auth_header = websocket.headers.get('Authorization', '')
+    token = auth_header[7:] if auth_header.startswith('Bearer ') else websocket.query_params.get('access_token')
+    user_data = await token_verifier.get_user_async(token) if token else None
     if not user_data or not user_data.user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    return user_data.user.id
-
-# --- Endpoints ---
-
-@app.post("/create_doctor_profile")
-def create_doctor_profile(data: DoctorProfile):
-    result = supabase.table('doctors').upsert(data.dict()).execute()
-    return {"message": "Doctor profile created successfully", "data": result.data}
-
-@app.post("/predict_maternal")
-def predict_maternal(vitals: MaternalVitals, authorization: str = Header(...)):
-    user_id = verify_token(authorization)
-    features = np.array([
-        vitals.age, vitals.systolic_bp, vitals.diastolic_bp,
-        vitals.blood_glucose, vitals.body_temp, vitals.heart_rate
-    ]).reshape(1, -1)
-    scaled = maternal_scaler.transform(features)
-    prediction = maternal_model.predict(scaled)[0]
-    risk_map = {0: "Normal", 1: "Suspect", 2: "Pathological"}
-    risk_level = risk_map.get(int(prediction), "Unknown")
-
-    supabase.table('vitals').insert({
-        'UID': user_id,
-        **vitals.dict(),
-        'prediction': int(prediction)
-    }).execute()
-
-    return {"prediction": risk_level}
-
-@app.post("/predict_fetal")
-def predict_fetal(data: FetalFeatures, authorization: str = Header(...)):
-    user_id = verify_token(authorization)
-    if len(data.features) != 15:
-        raise HTTPException(status_code=400, detail="Invalid feature length, expected 15")
-
-    features = np.array(data.features).reshape(1, -1)
-    scaled = fetal_scaler.transform(features)
-    prediction = int(fetal_model.predict(scaled)[0])
-
-    health_status = {1: "Normal", 2: "Suspect", 3: "Pathological"}
-    prediction_result = health_status.get(prediction, "Unknown")
-
-    feature_names = [
-        'baseline_value', 'accelerations', 'fetal_movement', 'uterine_contractions',
-        'light_decelerations', 'severe_decelerations', 'prolonged_decelerations',
-        'abnormal_short_term_variability', 'mean_value_of_short_term_variability',
-        'percentage_of_time_with_abnormal_long_term_variability', 'mean_value_of_long_term_variability',
-        'histogram_width', 'histogram_min', 'histogram_max', 'histogram_number_of_peaks'
-    ]
-
-    record = dict(zip(feature_names, map(float, data.features)))
-    record['UID'] = user_id
-    record['prediction'] = prediction
-
-    supabase.table('ctg').insert(record).execute()
-
-    return {"prediction": prediction, "status": prediction_result}
-
-@app.post("/diet_plan")
-def pregnancy_diet(req: DietRequest, authorization: str = Header(...)):
-    user_id = verify_token(authorization)
+        await websocket.close(code=1008)
+        return
+    user_id = user_data.user.id
+    rate = min(max(query_int(websocket, 'rate') or SAMPLE_RATE_HZ, 1), MAX_SAMPLE_RATE_HZ)
+    store = websocket.query_params.get('store', 'true').lower() not in ('0', 'false', 'no')
+
+    await websocket.accept()
+    # One connection holds the session's window, so a session never spans workers
+    stream = CTGStream.from_env(sample_rate=rate)
+    last = None
+    scores = 0
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await websocket.send_json({'type': 'error', 'error': 'Expected a JSON object'})
+                continue
+            if message.get('end'):
+                break
+            try:
+                stream.add(message.get('fhr'), message.get('uc'), message.get('fm'))
+            except StreamError as e:
+                await websocket.send_json({'type': 'error', 'error': str(e)})
+                continue
+            if not stream.due():
+                continue
+
+            features = stream.features()
+            if features is None:
+                stream.scored()
+                await websocket.send_json({'type': 'signal_loss', 'second': stream.seconds,
+                                           'signal_seconds': stream.signal_s})
+                continue
+            fetal = await models.aget('fetal')
+            try:
+                prediction = await fetal.batcher.predict_async(np.array(features))
+            except BatcherOverloaded as e:
+                # Tried again with the next chunk
+                await websocket.send_json({'type': 'error', 'error': str(e)})
+                continue
+            stream.scored()
+            scores += 1
+            last = (features, prediction, fetal.version)
+            await websocket.send_json({
+                'type': 'score',
+                'second': stream.seconds,
+                'features': dict(zip(FETAL_FEATURES, features)),
+                'prediction': prediction,
+                'status': FETAL_HEALTH_LABELS.get(prediction, "Unknown"),
+                'model_version': fetal.version,
+            })
+    except WebSocketDisconnect:
+        return
+    finally:
+        if store and last is not None:
+            features, prediction, version = last
+            await prediction_writer.awrite('ctg', {
+                'UID': user_id,
+                **dict(zip(FETAL_FEATURES, features)),
+                'prediction': prediction,
+                'model_version': version,
+            })
+
+    await websocket.send_json({'type': 'summary', 'seconds': stream.seconds, 'scores': scores,
+                               'stored': store and last is not None})
+    await websocket.close()
+
+# ===== TREND ENDPOINTS =====
+
+async def get_trends(request, kind):
+    """Weekly statistics for one kind; query parameters ``weeks`` and ``window``"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        args = request.query_params
+        try:
+            weeks = parse_weeks(args.get('weeks'), 'weeks', DEFAULT_WEEKS, MAX_WEEKS)
+            window = parse_weeks(args.get('window'), 'window', DEFAULT_WINDOW, MAX_WINDOW)
+        except TrendError as e:
+            return error(str(e), 400)
+
+        return JSONResponse(await trend_reader.trends(user_id, kind, weeks=weeks, window=window))
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.get('/vitals/trends')
+async def get_vitals_trends(request: Request):
+    """Rolling means, min/max, slopes and risk counts per week of the user's vitals"""
+    return await get_trends(request, 'vitals')
+
+@app.get('/ctg/trends')
+async def get_ctg_trends(request: Request):
+    """Rolling means, min/max, slopes and health counts per week of the user's CTG readings"""
+    return await get_trends(request, 'ctg')
+
+# ===== MODEL ADMIN ENDPOINTS =====
+
+def admin_denied(request):
+    supplied = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return error('Forbidden', 403)
+    return None
+
+@app.get('/admin/models')
+async def get_models(request: Request):
+    """Active version and checksums of every loaded model"""
+    denied = admin_denied(request)
+    if denied:
+        return denied
+    return JSONResponse({'models': models.describe(), 'stats': models.stats()})
+
+@app.post('/admin/models/reload')
+async def reload_models(request: Request):
+    """Re-read models.json now and swap in changed versions; body may name the models"""
+    denied = admin_denied(request)
+    if denied:
+        return denied
+    try:
+        body = await request.json() if await request.body() else {}
+        names = body.get('models') or None
+        active, errors = await asyncio.to_thread(models.reload, names)
+    except Exception as e:
+        return error(str(e), 500)
+    return JSONResponse({'active': active, 'errors': errors}, status_code=422 if errors else 200)
+
+# ===== DIET ENDPOINTS =====
+
+@app.get('/diet/sessions')
+@cached_read('diet')
+async def get_diet_sessions(request: Request):
+    """Get the authenticated user's diet sessions, most recent first, one page at a time"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        return await list_sessions(diet_session_listing, request, user_id)
+
+    except Exception as e:
+        print(f"Error fetching diet sessions: {e}")
+        import traceback
+        traceback.print_exc()
+        return error(str(e), 500)
+
+@app.post('/diet/sessions')
+@idempotent(by_body=True)
+async def create_diet_session(request: Request):
+    """Create a new diet session and generate recommendations"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        data = await request.json()
+        session_id = str(uuid.uuid4())
+
+        print(f"Creating diet session for user: {user_id}")
+        print(f"Request data: {data}")
+
+        diet_plan = await generate_structured_diet_plan(
+            data['trimester'],
+            data['weight'],
+            data['health_conditions'],
+            data['dietary_preference']
+        )
+
+        print(f"Generated diet plan: {len(diet_plan.get('meal_plans', []))} meal plans, {len(diet_plan.get('tips', []))} tips")
+
+        title = f"{data['trimester']} Trimester - {data['weight']}kg"
+
+        session_data = {
+            'id': session_id,
+            'user_id': user_id,
+            'title': title,
+            'trimester': data['trimester'],
+            'weight': data['weight'],
+            'health_conditions': data['health_conditions'],
+            'dietary_preference': data['dietary_preference'],
+            'diet_plan': diet_plan,
+            'created_at': datetime.utcnow().isoformat(),
+            'updated_at': datetime.utcnow().isoformat()
+        }
+
+        result = await supabase.table('diet_sessions').insert(session_data).execute()
+        read_cache.invalidate(user_id, 'diet', session_id)
+        print(f"Successfully created diet session: {session_id}")
+
+        return JSONResponse(result.data[0], status_code=201)
+
+    except Exception as e:
+        print(f"Error creating diet session: {e}")
+        import traceback
+        traceback.print_exc()
+        return error(str(e), 500)
+
+@app.get('/diet/sessions/{session_id}')
+@cached_read('diet')
+async def get_diet_session(request: Request, session_id: str):
+    """Get a specific diet session with its recommendations"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        session_data = await supabase.table('diet_sessions').select('*').eq(
+            'id', session_id
+        ).eq('user_id', user_id).execute()
+
+        if not session_data.data:
+            return error('Session not found', 404)
+
+        return JSONResponse(session_data.data[0])
+
+    except Exception as e:
+        return error(str(e), 500)
+
+@app.delete('/diet/sessions/{session_id}')
+async def delete_diet_session(request: Request, session_id: str):
+    """Delete a specific diet session"""
+    try:
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        result = await supabase.table('diet_sessions').delete().eq(
+            'id', session_id
+        ).eq('user_id', user_id).execute()
+
+        if not result.data:
+            return error('Session not found', 404)
+
+        read_cache.invalidate(user_id, 'diet', session_id)
+
+        return JSONResponse({'message': 'Session deleted successfully'})
+
+    except Exception as e:
+        return error(str(e), 500)
+
+async def generate_structured_diet_plan(trimester, weight, health_conditions, dietary_preference):
+    """Return a structured diet plan for the request"""
+    if diet_library is not None and DIET_PLAN_MODE == 'library':
+        try:
+            plan = diet_library.assemble(trimester, weight, health_conditions, dietary_preference)
+        except LookupError as e:
+            # e.g. an allergy the library can't check: the model plans around it
+            print(f"Diet library has no plan for this request, asking the model: {e}")
+        else:
+            if DIET_LLM_PERSONALIZE:
+                await personalize_diet_plan(plan, trimester, weight, health_conditions, dietary_preference)
+            return plan
+
+    # Whole plans from the LLM, reusing the plan of an equivalent earlier request
+    key = diet_cache.key('structured', trimester, weight, health_conditions, dietary_preference)
+    try:
+        return await diet_cache.get_or_generate_async(
+            key, lambda: request_diet_plan(trimester, weight, health_conditions, dietary_preference)
+        )
+    except Exception as e:
+        print(f"Error generating diet plan: {e}")
+        # Fallback plans are not cached, so the next request tries the model again
+        return create_fallback_diet_plan(trimester, weight, dietary_preference)
+
+def diet_plan_prompt(trimester, weight, health_conditions, dietary_preference):
+    """Prompt asking the LLM for a whole diet plan as JSON"""
+    return f"""
+    You are a professional nutritionist. Create a comprehensive pregnancy diet plan for:
+    - Trimester: {trimester}
+    - Weight: {weight}kg
+    - Health Conditions: {health_conditions or 'None'}
+    - Dietary Preference: {dietary_preference or 'No specific preference'}
+
+    IMPORTANT: Respond ONLY with a valid JSON object. Do not include any markdown formatting or explanations.
+
+    {{
+        "overview": {{
+            "calories_per_day": "2200-2500",
+            "key_nutrients": ["Folic Acid", "Iron", "Calcium", "Protein", "Omega-3"],
+            "foods_to_avoid": ["Raw fish", "Unpasteurized dairy", "High mercury fish"]
+        }},
+        "meal_plans": [
+            {{
+                "type": "Balanced Plan",
+                "meals": {{
+                    "breakfast": {{"name": "Nutritious Breakfast", "calories": "400", "items": ["Whole grain toast", "Scrambled eggs", "Fresh fruits"]}},
+                    "lunch": {{"name": "Healthy Lunch", "calories": "500", "items": ["Grilled chicken", "Brown rice", "Steamed vegetables"]}},
+                    "dinner": {{"name": "Light Dinner", "calories": "450", "items": ["Fish", "Quinoa", "Green salad"]}},
+                    "snacks": [{{"name": "Morning Snack", "items": ["Greek yogurt", "Nuts"]}}, {{"name": "Evening Snack", "items": ["Apple", "Peanut butter"]}}]
+                }}
+            }}
+        ],
+        "tips": [
+            "Drink plenty of water throughout the day",
+            "Eat small, frequent meals to manage nausea",
+            "Take prenatal vitamins as recommended by your doctor",
+            "Avoid alcohol and limit caffeine intake"
+        ],
+        "supplements": [
+            {{"name": "Folic Acid", "dosage": "400-800 mcg daily", "reason": "Prevents neural tube defects"}},
+            {{"name": "Iron", "dosage": "27 mg daily", "reason": "Prevents anemia and supports blood volume expansion"}},
+            {{"name": "Calcium", "dosage": "1000 mg daily", "reason": "Supports baby's bone development"}}
+        ]
+    }}
+    """
+
+async def request_diet_plan(trimester, weight, health_conditions, dietary_preference):
+    """Generate a structured diet plan using Gemini AI"""
+    prompt = diet_plan_prompt(trimester, weight, health_conditions, dietary_preference)
+    print(f"Generating diet plan for: {trimester} trimester, {weight}kg")
+    parser = StructuredDietPlan(create_fallback_diet_plan(trimester, weight, dietary_preference))
+    parser.feed(await llm.agenerate(prompt))
+    parser.finish()
+    if not parser.accepted:
+        raise ValueError("Model returned no usable diet plan")
+    if parser.replaced or parser.repaired:
+        print(f"Diet plan sections replaced: {parser.replaced}, repaired: {parser.repaired}")
+    return parser.result()
+
+async def personalize_diet_plan(plan, trimester, weight, health_conditions, dietary_preference):
+    """Put a few LLM-written tips in front of an assembled plan's tips; the plan is kept as is on failure"""
+    key = diet_cache.key('tips', trimester, weight, health_conditions, dietary_preference)
+    try:
+        tips = await diet_cache.get_or_generate_async(
+            key, lambda: request_personal_tips(trimester, weight, health_conditions, dietary_preference)
+        )
+    except Exception as e:
+        print(f"Error personalizing diet plan: {e}")
+        return plan
+    plan['tips'] = tips + [tip for tip in plan['tips'] if tip not in tips]
+    return plan
+
+async def request_personal_tips(trimester, weight, health_conditions, dietary_preference):
+    """Ask the LLM for three short diet tips for this request"""
     prompt = (
-        f"You are a professional dietician and nutritionist. Suggest safe and personalized diet plans for pregnant women.\n"
-        f"Now, generate a diet plan for a woman in her {req.trimester} trimester, weighing {req.weight} kg,\n"
-        f"who is feeling {req.health_conditions} and follows these dietary preferences: {req.dietary_preference}.\n"
-        f"Give two separate diet plans: one vegetarian and one non-vegetarian.\n"
-        f"Do not include anything that violates her preferences.\n"
-        f"Present the results clearly in markdown format with headings and bullet points."
+        f"Give three short, practical diet tips for a pregnant woman in her {trimester} trimester, "
+        f"weighing {weight}kg, with these health conditions: {health_conditions or 'None'}, "
+        f"and this dietary preference: {dietary_preference or 'No specific preference'}. "
+        "Reply with one tip per line and nothing else."
     )
+    lines = [line.strip().lstrip('-*•0123456789.) ').strip() for line in (await llm.agenerate(prompt)).splitlines()]
+    tips = [line for line in lines if line][:3]
+    if not tips:
+        raise ValueError("No tips in model response")
+    return tips
+
+def create_fallback_diet_plan(trimester, weight, dietary_preference):
+    """Create a fallback diet plan when AI generation fails"""
+    if diet_library is not None:
+        try:
+            return diet_library.assemble(trimester, weight, '', dietary_preference)
+        except LookupError:
+            pass
+    return {
+        "overview": {
+            "calories_per_day": "2200-2500",
+            "key_nutrients": ["Folic Acid", "Iron", "Calcium", "Protein", "Omega-3", "Vitamin D"],
+            "foods_to_avoid": ["Raw fish", "Unpasteurized dairy", "High mercury fish", "Raw eggs", "Deli meats"]
+        },
+        "meal_plans": [
+            {
+                "type": "Balanced Plan",
+                "meals": {
+                    "breakfast": {
+                        "name": "Nutritious Morning Start",
+                        "calories": "400",
+                        "items": ["Whole grain cereal with milk", "Fresh berries", "Orange juice"]
+                    },
+                    "lunch": {
+                        "name": "Balanced Midday Meal",
+                        "calories": "500",
+                        "items": ["Grilled chicken salad", "Whole wheat bread", "Mixed vegetables"]
+                    },
+                    "dinner": {
+                        "name": "Light Evening Meal",
+                        "calories": "450",
+                        "items": ["Baked salmon", "Sweet potato", "Steamed broccoli"]
+                    },
+                    "snacks": [
+                        {"name": "Morning Snack", "items": ["Greek yogurt", "Almonds"]},
+                        {"name": "Afternoon Snack", "items": ["Apple slices", "Cheese"]}
+                    ]
+                }
+            }
+        ],
+        "tips": [
+            "Stay hydrated by drinking 8-10 glasses of water daily",
+            "Eat small, frequent meals to help with nausea",
+            "Include a variety of colorful fruits and vegetables",
+            "Choose whole grains over refined grains",
+            "Limit caffeine to 200mg per day"
+        ],
+        "supplements": [
+            {"name": "Prenatal Vitamin", "dosage": "1 tablet daily", "reason": "Comprehensive nutrition support"},
+            {"name": "Folic Acid", "dosage": "400-800 mcg", "reason": "Prevents neural tube defects"},
+            {"name": "Iron", "dosage": "27 mg daily", "reason": "Prevents anemia"}
+        ]
+    }
+
+@app.post('/diet_plan')
+@idempotent(by_body=True)
+async def pregnancy_diet(request: Request):
+    try:
+        data = await request.json()
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        diet_plan = await generate_structured_diet_plan(
+            data['trimester'],
+            data['weight'],
+            data['health_conditions'],
+            data['dietary_preference']
+        )
+
+        await supabase.table('diet_plans').insert({
+            'UID': user_id,
+            'diet_plan': str(diet_plan)  # Convert to string for storage
+        }).execute()
+
+        return JSONResponse({"diet_plan": diet_plan})
+
+    except Exception as e:
+        print(e)
+        return error(str(e), 500)
+
+@app.post('/diet_plan/stream')
+async def pregnancy_diet_stream(request: Request):
+    """Stream a diet plan as server-sent events, one event per section as soon as it is valid"""
+    try:
+        data = await request.json()
+        user_id, denied = await request_user(request)
+        if denied:
+            return denied
+
+        args = (data['trimester'], data['weight'], data['health_conditions'], data['dietary_preference'])
+
+        async def events():
+            status = {}
+            key = diet_cache.key('structured', *args)
+            cached = None if DIET_PLAN_MODE == 'library' else await asyncio.to_thread(diet_cache.get, key)
+            if cached is not None or (diet_library is not None and DIET_PLAN_MODE == 'library'):
+                plan = cached or await generate_structured_diet_plan(*args)
+                for name, payload in plan_events(plan):
+                    yield sse_event(payload, event=name)
+            else:
+                parser = StructuredDietPlan(create_fallback_diet_plan(args[0], args[1], args[3]))
+                try:
+                    async for chunk in llm.astream(diet_plan_prompt(*args)):
+                        for name, payload in parser.feed(chunk):
+                            yield sse_event(payload, event=name)
+                except Exception as e:
+                    # Sections not received yet come from the fallback plan
+                    print(f"Error streaming diet plan: {e}")
+                for name, payload in parser.finish():
+                    yield sse_event(payload, event=name)
+                plan = parser.result()
+                status = {'repaired': parser.repaired, 'replaced': parser.replaced}
+                if parser.accepted:
+                    await asyncio.to_thread(diet_cache.put, key, plan)
+
+            await supabase.table('diet_plans').insert({
+                'UID': user_id,
+                'diet_plan': str(plan)
+            }).execute()
+            yield sse_event({'diet_plan': plan, **status}, event='done')
+
+        return StreamingResponse(
+            events(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+    except Exception as e:
+        print(f"Error in pregnancy_diet_stream: {e}")
+        return error(str(e), 500)
+
+@app.get('/', response_class=HTMLResponse)
+async def ind():
+    return "Hello governer"
+
+# ===== STARTUP AND PROBES =====
+
+async def warm_models():
+    """Load every model, push a dummy row through each batcher and start the batch pool"""
+    await models.awarm()
+    for name in ('maternal', 'fetal'):
+        loaded = models.get(name)
+        await inference_pool.run(
+            predict_matrix, loaded.predictor, loaded.predictor_scaler, np.zeros((2, loaded.n_features))
+        )
+
+async def warm_supabase():
+    """Create the clients and open a connection with one cheap query"""
+    client = await asyncio.to_thread(supabase.get)
+    await asyncio.to_thread(supabase_sync.get)
+    await client.table('chat_sessions').select('id').limit(1).execute()
+
+warmup = WarmUp(retry_interval=float(os.environ.get("WARMUP_RETRY_S", 5)))
+warmup.step('models', warm_models)
+warmup.step('supabase', warm_supabase, required=False)
+warmup.step('llm', llm.awarm, required=False)
+
+def preload():
+    """Load what warm-up would, minus threads and connections, so forked workers share it"""
+    models.preload()
+    supabase.get()
+    supabase_sync.get()
+    llm.load()
+
+# Components' own counters are exported next to the request metrics
+for component, stats in [
+    ('llm', llm.stats), ('auth', token_verifier.stats), ('read_cache', read_cache.stats),
+    ('diet_cache', diet_cache.stats), ('idempotency', idempotency_store.stats),
+    ('write_behind', prediction_writer.stats), ('chat_context', chat_context.stats),
+    ('titles', title_worker.stats), ('models', models.stats), ('inference_pool', inference_pool.stats),
+]:
+    metrics.registry.collect(component, stats)
+
+@app.get('/metrics')
+async def get_metrics():
+    """Request, stage and component metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+@app.get('/healthz')
+async def healthz():
+    """Liveness: the process is up and its event loop answers"""
+    return JSONResponse({'status': 'ok'})
 
-    response = chatmodel.generate_content({"role": "user", "parts": [{"text": prompt}]})
-    diet_plan_text = response.text
+@app.get('/readyz')
+async def readyz():
+    """Readiness: models loaded and warm; client warm-up is reported but not required"""
+    return JSONResponse(warmup.report(), status_code=200 if warmup.ready else 503)
 
-    supabase.table('diet_plans').insert({
-        'UID': user_id,
-        'diet_plan': diet_plan_text
-    }).execute()
+@app.on_event("startup")
+async def startup():
+    # Opened here rather than at import so each forked worker gets its own spool
+    prediction_writer.start()
+    warmup.start()
 
-    return {"diet_plan": diet_plan_text}
+@app.on_event("shutdown")
+async def shutdown():
+    warmup.cancel()
+    await title_worker.shutdown()
+    inference_pool.shutdown(wait=False)
+    prediction_writer.close()
 
-# Run with: uvicorn filename:app --reload
 if __name__ == "__main__":
-    uvicorn.run("filename:app", host="0.0.0.0", port=8000, reload=True)
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,117 @@
+"""Append-only storage for chat messages.
+
+Each message is one row in ``chat_messages`` keyed by ``(session_id, seq)``
+(see ``sql/chat_messages.sql``), so a chat turn costs two small inserts no
+matter how long the conversation is. Concurrent turns can't overwrite each
+other: a clash on ``seq`` is rejected by the primary key and retried with the
+next sequence number.
+
+Sessions created before this table existed keep their history in the
+``chat_sessions.messages`` JSON array. ``import_legacy`` splits such an array
+into rows; handlers call it lazily and ``migrate_chat_messages.py`` does it in
+bulk.
+
+``client`` is an async Supabase client; every method is a coroutine.
+"""
+from datetime import datetime
+
+UNIQUE_VIOLATION = "23505"
+
+
+def _is_unique_violation(error):
+    code = getattr(error, "code", None)
+    return code == UNIQUE_VIOLATION or UNIQUE_VIOLATION in str(error)
+
+
+def _to_message(row):
+    return {"role": row["role"], "content": row["content"]}
+
+
+class ChatMessageStore:
+    def __init__(self, client, table="chat_messages", page_size=500, max_retries=5):
+        self.client = client
+        self.table = table
+        self.page_size = page_size
+        self.max_retries = max_retries
+
+    async def last_seq(self, session_id):
+        result = await self.client.table(self.table).select('seq').eq(
+            'session_id', session_id
+        ).order('seq', desc=True).limit(1).execute()
+        return result.data[0]['seq'] if result.data else 0
+
+    def _rows(self, session_id, start, messages):
+        now = datetime.utcnow().isoformat()
+        return [{
+            'session_id': session_id,
+            'seq': start + i,
+            'role': msg['role'],
+            'content': msg['content'],
+            'created_at': now,
+        } for i, msg in enumerate(messages)]
+
+    async def append(self, session_id, messages):
+        """Appends ``messages`` after the current last message; returns their seqs."""
+        for attempt in range(self.max_retries):
+            rows = self._rows(session_id, await self.last_seq(session_id) + 1, messages)
+            try:
+                await self.client.table(self.table).insert(rows).execute()
+                return [row['seq'] for row in rows]
+            except Exception as e:
+                # Another turn took these sequence numbers first; go after it
+                if not _is_unique_violation(e) or attempt == self.max_retries - 1:
+                    raise
+
+    async def page(self, session_id, before=None, limit=50):
+        """Returns up to ``limit`` messages older than seq ``before`` (oldest first).
+
+        The second value is the cursor for the next (older) page, or ``None``
+        when there is nothing left.
+        """
+        query = self.client.table(self.table).select('seq, role, content, created_at').eq(
+            'session_id', session_id
+        )
+        if before is not None:
+            query = query.lt('seq', before)
+        rows = (await query.order('seq', desc=True).limit(limit + 1).execute()).data
+        has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        cursor = rows[0]['seq'] if has_more and rows else None
+        return rows, cursor
+
+    async def between(self, session_id, after=0, before=None):
+        """Returns rows with ``after < seq < before`` in order, read in keyset pages."""
+        rows, last = [], after
+        while True:
+            query = self.client.table(self.table).select('seq, role, content').eq(
+                'session_id', session_id
+            ).gt('seq', last)
+            if before is not None:
+                query = query.lt('seq', before)
+            page = (await query.order('seq').limit(self.page_size).execute()).data
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            last = page[-1]['seq']
+
+    async def history(self, session_id):
+        """Returns the whole conversation in order."""
+        return [_to_message(row) for row in await self.between(session_id)]
+
+    async def import_legacy(self, session_id, messages):
+        """Copies a legacy ``messages`` array into rows. Returns False if the
+        session already has rows (already migrated, or migrated concurrently)."""
+        messages = [m for m in messages or [] if m.get('role') != 'system']
+        if not messages or await self.last_seq(session_id):
+            return False
+        try:
+            # Always seqs 1..n, so a concurrent import collides instead of duplicating
+            await self.client.table(self.table).insert(self._rows(session_id, 1, messages)).execute()
+        except Exception as e:
+            if _is_unique_violation(e):
+                return False
+            raise
+        return True
+
+    async def delete_session(self, session_id):
+        await self.client.table(self.table).delete().eq('session_id', session_id).execute()
@@ -0,0 +1,380 @@
+"""Per-stage request timings, counters and the Prometheus ``/metrics`` output.
+
+Code that does a distinct piece of work wraps it in ``span(stage)`` (auth,
+db, llm, inference, scale, predict, ...). Inside a request the time is added
+to that request's ``RequestTrace``; ``TraceMiddleware`` observes it once the
+response has been sent, so ``prenova_stage_seconds{route, stage}`` holds the
+time each request spent in each stage. Spans outside a request (the
+micro-batchers, the write-behind flusher) are observed straight away under
+``route="background"``.
+
+``count(item)`` tallies things per request in the same way: Supabase round
+trips, LLM calls and (estimated) tokens, cache hits and misses. Each ends up
+in a per-request histogram and in a running total.
+
+Histograms have fixed buckets; observing is a bisect and a few increments
+under a lock. Quantiles come from the buckets on the Prometheus side, e.g.
+``histogram_quantile(0.99, sum by (le, route) (rate(prenova_request_seconds_bucket[5m])))``.
+
+The numbers are per process. Under serve.py every series carries the
+answering worker's pid as ``worker``, so scrapes landing on different
+workers don't look like counter resets.
+"""
+import asyncio
+import bisect
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds, from sub-millisecond cache hits to LLM calls near their deadline
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Counts per request (round trips, cache lookups, tokens)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+TRACE_HEADER = "X-Request-ID"
+_TRACE_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, n=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + n
+
+    def render(self, const):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, label_values, const)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def quantile(self, q, *label_values):
+        """Estimate of the ``q`` quantile, interpolated within its bucket as Prometheus does."""
+        with self._lock:
+            series = list(self._series.get(label_values, ()))
+        if not series:
+            return None
+        counts = series[:-1]
+        rank = q * sum(counts)
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def render(self, const):
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, values in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), values):
+                cumulative += n
+                le = (("le", _number(float(bound))),)
+                lines.append(f"{self.name}_bucket{_labels(self.labels, label_values, const + le)} {cumulative}")
+            labels = _labels(self.labels, label_values, const)
+            lines.append(f"{self.name}_sum{labels} {_number(float(values[-1]))}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, component, stats):
+        """Exports the numbers in ``stats()`` (a component's existing counters) as gauges."""
+        self._collectors[component] = stats
+
+    def _component_lines(self, const):
+        name = "prenova_component_stat"
+        lines = [f"# HELP {name} Counters and levels reported by the service's components",
+                 f"# TYPE {name} gauge"]
+        for component, stats in sorted(self._collectors.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Metrics: {component} stats failed: {e}")
+                continue
+            for stat, value in _flatten(values):
+                labels = _labels(("component", "stat"), (component, stat), const)
+                lines.append(f"{name}{labels} {_number(value)}")
+        return lines
+
+    def render(self):
+        const = (("worker", os.getpid()),)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(const))
+        lines.extend(self._component_lines(const))
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(values, prefix=""):
+    # Nested stats dicts become dotted names; strings and lists are skipped
+    for key, value in values.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, name + ".")
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+registry = Registry()
+
+request_seconds = registry.add(Histogram(
+    "prenova_request_seconds", "Time from receiving a request to sending its last byte",
+    labels=("route", "method", "status")))
+stage_seconds = registry.add(Histogram(
+    "prenova_stage_seconds", "Time a request spent in each stage",
+    labels=("route", "stage")))
+request_items = registry.add(Histogram(
+    "prenova_request_items", "Database round trips, LLM tokens and cache lookups per request",
+    labels=("route", "item"), buckets=COUNT_BUCKETS))
+items_total = registry.add(Counter(
+    "prenova_items_total", "Database round trips, LLM tokens and cache lookups",
+    labels=("item",)))
+cache_lookups = registry.add(Counter(
+    "prenova_cache_lookups_total", "Cache lookups by cache and result",
+    labels=("cache", "result")))
+
+
+class RequestTrace:
+    __slots__ = ("trace_id", "started", "stages", "items")
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.items = {}
+
+    def server_timing(self):
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items())
+
+
+_current = ContextVar("request_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def observe(stage, seconds):
+    trace = _current.get()
+    if trace is None:
+        stage_seconds.observe(seconds, "background", stage)
+    else:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    """Times the block as ``stage`` of the current request (or as background work)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def count(item, n=1):
+    items_total.inc(item, n=n)
+    trace = _current.get()
+    if trace is not None:
+        trace.items[item] = trace.items.get(item, 0) + n
+
+
+def count_cache(cache, hit):
+    cache_lookups.inc(cache, "hit" if hit else "miss")
+    count("cache_hits" if hit else "cache_misses")
+
+
+class TracedQuery:
+    """A Supabase query builder whose ``execute`` is timed as ``db`` and counted as a round trip."""
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if name == "execute":
+            return self._execute
+        if not callable(attr):
+            # e.g. the ``not_`` property, which returns a builder
+            return TracedQuery(attr) if hasattr(attr, "execute") else attr
+
+        def chain(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return TracedQuery(result) if hasattr(result, "execute") else result
+        return chain
+
+    def _execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        count("db_round_trips")
+        try:
+            result = self._builder.execute(*args, **kwargs)
+        except BaseException:
+            observe("db", time.perf_counter() - started)
+            raise
+        if asyncio.iscoroutine(result):
+            return self._finish(result, started)
+        observe("db", time.perf_counter() - started)
+        return result
+
+    @staticmethod
+    async def _finish(pending, started):
+        try:
+            return await pending
+        finally:
+            observe("db", time.perf_counter() - started)
+
+
+class TracedClient:
+    """Wraps a Supabase client so every table query goes through ``TracedQuery``."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return TracedQuery(self._client.table(name))
+
+    from_ = table
+
+    def rpc(self, *args, **kwargs):
+        return TracedQuery(self._client.rpc(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class TraceMiddleware:
+    """ASGI middleware: one ``RequestTrace`` per HTTP request, observed after the last byte.
+
+    The request's ``X-Request-ID`` is kept as its trace id when it looks sane,
+    otherwise one is generated. With ``headers`` on, the id is returned in
+    ``X-Request-ID`` and the stage timings in ``Server-Timing``. Requests
+    slower than ``slow_after`` seconds are logged with their breakdown.
+    """
+
+    def __init__(self, app, headers=True, slow_after=None):
+        self.app = app
+        self.headers = headers
+        self.slow_after = slow_after
+
+    @classmethod
+    def options_from_env(cls):
+        slow_ms = float(os.environ.get("METRICS_SLOW_REQUEST_MS", 0))
+        return {
+            "headers": os.environ.get("TRACE_HEADERS", "true").lower() == "true",
+            "slow_after": slow_ms / 1000.0 if slow_ms > 0 else None,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                trace_id = value.decode("latin-1")
+                break
+        if not trace_id or not _TRACE_ID.match(trace_id):
+            trace_id = uuid.uuid4().hex
+        trace = RequestTrace(trace_id)
+        token = _current.set(trace)
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.headers:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-request-id", trace_id.encode("latin-1")))
+                    if trace.stages:
+                        headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _current.reset(token)
+            self._finish(scope, trace, status)
+
+    def _finish(self, scope, trace, status):
+        elapsed = time.perf_counter() - trace.started
+        route = scope.get("route")
+        # Route templates, not raw paths, so session ids don't multiply the series
+        route = getattr(route, "path", None) or "unmatched"
+        request_seconds.observe(elapsed, route, scope["method"], str(status))
+        for stage, seconds in trace.stages.items():
+            stage_seconds.observe(seconds, route, stage)
+        for item, n in trace.items.items():
+            request_items.observe(n, route, item)
+        if self.slow_after is not None and elapsed >= self.slow_after:
+            stages = ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in trace.stages.items())
+            print(f"Slow request {trace.trace_id}: {scope['method']} {route} {status} "
+                  f"in {elapsed * 1000:.0f}ms ({stages or 'no stages'}; {trace.items})")
+
+
+def render():
+    return registry.render()
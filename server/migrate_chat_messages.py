@@ -0,0 +1,72 @@
+"""Split legacy chat_sessions.messages arrays into chat_messages rows.
+
+Usage: python migrate_chat_messages.py [--dry-run] [--keep-arrays] [--page-size N]
+
+Create the table first (sql/chat_messages.sql). Sessions that already have
+rows are skipped, so the script can be re-run or interrupted safely. Unless
+``--keep-arrays`` is given, the migrated array is reduced to its system
+prompt so later reads stop pulling the old history.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from dotenv import load_dotenv
+from supabase import acreate_client
+
+from message_store import ChatMessageStore
+
+
+async def migrate(client, store, page_size, dry_run, keep_arrays):
+    migrated = skipped = 0
+    last_id = None
+    while True:
+        query = client.table('chat_sessions').select('id, messages').order('id').limit(page_size)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        sessions = (await query.execute()).data
+        for session in sessions:
+            messages = session.get('messages') or []
+            if not any(msg.get('role') != 'system' for msg in messages):
+                skipped += 1
+                continue
+            if dry_run:
+                migrated += 1
+                continue
+            if await store.import_legacy(session['id'], messages):
+                migrated += 1
+                if not keep_arrays:
+                    system = [msg for msg in messages if msg.get('role') == 'system']
+                    await client.table('chat_sessions').update({'messages': system}).eq(
+                        'id', session['id']
+                    ).execute()
+            else:
+                skipped += 1
+        if len(sessions) < page_size:
+            return migrated, skipped
+        last_id = sessions[-1]['id']
+
+
+async def run(args):
+    client = await acreate_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+    return await migrate(client, ChatMessageStore(client), args.page_size, args.dry_run, args.keep_arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only count sessions to migrate")
+    parser.add_argument("--keep-arrays", action="store_true",
+                        help="leave chat_sessions.messages untouched after copying")
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    load_dotenv()
+    migrated, skipped = asyncio.run(run(args))
+    action = "would migrate" if args.dry_run else "migrated"
+    print(f"{action} {migrated} sessions, skipped {skipped}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
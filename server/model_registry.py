@@ -0,0 +1,324 @@
+"""Versioned model artifacts, loaded lazily and swapped without downtime.
+
+``models.json`` lists the versions of each model and which one is active::
+
+    {"maternal": {"active": "1", "versions": {"1": {
+        "model": "finalized_maternal_model.sav", "model_sha256": "...",
+        "scaler": "scaleX.pkl", "scaler_sha256": "..."}}}}
+
+Paths are relative to the manifest. ``ModelRegistry.get(name)`` returns the
+active ``LoadedModel``, loading it on first use, and every handler shares
+that instance. A ``LoadedModel`` never changes: ``reload`` loads the new
+version alongside the old one and then swaps the registry's reference.
+Requests that already hold the old version finish on it, and its
+micro-batcher thread exits once idle.
+
+The manifest is polled for changes every ``poll_interval`` seconds. To
+deploy a model, copy its files and then register them, e.g.
+``python model_registry.py add maternal 2 model.sav scaler.pkl``. Artifacts
+are read once and checked against the manifest's checksums, so a
+half-copied or unregistered file is refused and the running version kept.
+
+Usage: python model_registry.py add NAME VERSION MODEL SCALER [--manifest PATH] [--inactive]
+       python model_registry.py activate NAME VERSION [--manifest PATH]
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+from batching import MicroBatcher
+from compiled_model import file_checksum, load_compiled
+
+
+class ModelLoadError(Exception):
+    """Raised when a manifest entry is missing or its artifacts don't match it."""
+
+
+class LoadedModel:
+    """One version of a model: its artifacts, fused predictor and micro-batcher.
+
+    ``artifacts`` are the verified model and scaler bytes. With an up-to-date
+    compiled predictor they are only unpickled if ``model``/``scaler`` are
+    asked for, which keeps sklearn, LightGBM and XGBoost out of startup.
+    """
+
+    def __init__(self, name, version, artifacts, checksums, compiled=None):
+        self.name = name
+        self.version = version
+        self.checksums = checksums
+        self._artifacts = artifacts
+        self._objects = {}
+        self._lock = threading.Lock()
+        # What predictions.predict_matrix should be called with (fused when available)
+        if compiled is not None:
+            self.predictor, self.predictor_scaler = compiled, None
+            self.n_features = compiled.n_features
+        else:
+            self.predictor, self.predictor_scaler = self.model, self.scaler
+            self.n_features = int(self.scaler.n_features_in_)
+        self.loaded_at = time.time()
+        self.batcher = MicroBatcher.from_env(self.predictor, self.predictor_scaler, self.n_features,
+                                             name=f"{name}@{version}")
+
+    def _unpickle(self, kind):
+        import joblib
+
+        with self._lock:
+            if kind not in self._objects:
+                self._objects[kind] = joblib.load(io.BytesIO(self._artifacts[kind]))
+            return self._objects[kind]
+
+    @property
+    def model(self):
+        return self._unpickle("model")
+
+    @property
+    def scaler(self):
+        return self._unpickle("scaler")
+
+    def retire(self):
+        self.batcher.retire()
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "fused": self.predictor_scaler is None,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.loaded_at)),
+            **self.checksums,
+        }
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    # Replaced in one step so a polling registry never reads a partial file
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def manifest_entry(manifest, name, version=None):
+    """``(version, entry)`` for ``version`` of ``name``, the active one by default."""
+    try:
+        spec = manifest[name]
+        version = str(version or spec["active"])
+        return version, spec["versions"][version]
+    except (KeyError, TypeError):
+        raise ModelLoadError(f"Model {name} has no version {version or 'active'} in the manifest")
+
+
+def load_version(name, version, entry, base_dir):
+    """Reads and verifies one version's model and scaler and finds its compiled predictor."""
+    paths, artifacts, checksums = {}, {}, {}
+    for kind in ("model", "scaler"):
+        try:
+            path = os.path.join(base_dir, entry[kind])
+            expected = entry[f"{kind}_sha256"]
+        except KeyError as e:
+            raise ModelLoadError(f"{name} {version}: manifest entry has no {e.args[0]}")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            raise ModelLoadError(f"{name} {version}: cannot read {path}: {e}")
+        # Only the very bytes that were checked are ever unpickled
+        actual = hashlib.sha256(data).hexdigest()
+        if actual != expected:
+            raise ModelLoadError(f"{name} {version}: checksum mismatch for {path}")
+        paths[kind], artifacts[kind], checksums[f"{kind}_sha256"] = path, data, actual
+    compiled = load_compiled(paths["model"], paths["scaler"], checksums)
+    return LoadedModel(name, version, artifacts, checksums, compiled)
+
+
+class ModelRegistry:
+    def __init__(self, manifest_path="models.json", poll_interval=5.0):
+        self.manifest_path = manifest_path
+        self.base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        self.poll_interval = poll_interval
+
+        self._active = {}
+        self._manifest_stamp = None
+        # Serializes loads and swaps; readers only look up _active
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+        self._counters = {"loads": 0, "swaps": 0, "failed_loads": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            manifest_path=os.environ.get("MODEL_MANIFEST", "models.json"),
+            poll_interval=float(os.environ.get("MODEL_POLL_S", 5)),
+        )
+
+    def _stamp(self):
+        st = os.stat(self.manifest_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, name, version, entry):
+        try:
+            loaded = load_version(name, version, entry, self.base_dir)
+        except Exception:
+            self._counters["failed_loads"] += 1
+            raise
+        self._counters["loads"] += 1
+        print(f"Loaded model {name} version {version}")
+        return loaded
+
+    def get(self, name):
+        """The active version of ``name``, loaded on first use."""
+        loaded = self._active.get(name)
+        if loaded is None:
+            with self._lock:
+                loaded = self._active.get(name)
+                if loaded is None:
+                    # Stamped before reading so an edit made meanwhile is picked up later
+                    stamp = self._stamp()
+                    version, entry = manifest_entry(read_manifest(self.manifest_path), name)
+                    loaded = self._active[name] = self._load(name, version, entry)
+                    if self._manifest_stamp is None:
+                        self._manifest_stamp = stamp
+        self._ensure_watcher()
+        return loaded
+
+    async def aget(self, name):
+        """``get`` that loads off the event loop."""
+        loaded = self._active.get(name)
+        if loaded is None:
+            return await asyncio.to_thread(self.get, name)
+        self._ensure_watcher()
+        return loaded
+
+    def preload(self, names=None):
+        """Loads ``names`` (every model in the manifest by default) without
+        starting any thread, so it can run in a parent before it forks."""
+        with self._lock:
+            stamp = self._stamp()
+            manifest = read_manifest(self.manifest_path)
+            for name in names or sorted(manifest):
+                if name not in self._active:
+                    version, entry = manifest_entry(manifest, name)
+                    self._active[name] = self._load(name, version, entry)
+            if self._manifest_stamp is None:
+                self._manifest_stamp = stamp
+        return self
+
+    async def awarm(self, names=None):
+        """Loads the models and sends one dummy row through each version's batcher."""
+        await asyncio.to_thread(self.preload, names)
+        for loaded in list(self._active.values()):
+            await loaded.batcher.predict_async([0.0] * loaded.n_features)
+        self._ensure_watcher()
+
+    def reload(self, names=None):
+        """Re-reads the manifest and swaps in every active version that changed.
+
+        ``names`` defaults to the models loaded so far. Returns ``(active,
+        errors)``: the active version per name, and the reason per name
+        whose new version was refused (the previous one then stays active).
+        """
+        with self._lock:
+            stamp = self._stamp()
+            manifest = read_manifest(self.manifest_path)
+            self._manifest_stamp = stamp
+            active, errors = {}, {}
+            for name in names or list(self._active):
+                current = self._active.get(name)
+                try:
+                    version, entry = manifest_entry(manifest, name)
+                    if current is None or current.version != version or any(
+                        current.checksums[k] != entry.get(k) for k in current.checksums
+                    ):
+                        loaded = self._load(name, version, entry)
+                        self._active[name] = loaded
+                        if current is not None:
+                            current.retire()
+                            self._counters["swaps"] += 1
+                            print(f"Swapped model {name} from version {current.version} to {version}")
+                        current = loaded
+                except Exception as e:
+                    print(f"Keeping model {name} version {current.version if current else None}: {e}")
+                    errors[name] = str(e)
+                active[name] = current.version if current else None
+        return active, errors
+
+    def _ensure_watcher(self):
+        # Started lazily so the thread belongs to the process that serves requests;
+        # a thread object inherited through fork reports itself as not alive
+        if self.poll_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        with self._watcher_lock:
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+                self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                if self._stamp() != self._manifest_stamp:
+                    self.reload()
+            except Exception as e:
+                print(f"Model manifest check failed: {e}")
+
+    def describe(self):
+        return {name: loaded.describe() for name, loaded in sorted(self._active.items())}
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["batchers"] = {name: loaded.batcher.stats() for name, loaded in self._active.items()}
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Register and activate model versions.")
+    parser.add_argument("--manifest", default=os.environ.get("MODEL_MANIFEST", "models.json"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="record a version's artifacts and checksums")
+    add.add_argument("name")
+    add.add_argument("version")
+    add.add_argument("model")
+    add.add_argument("scaler")
+    add.add_argument("--inactive", action="store_true", help="register without activating")
+    activate = commands.add_parser("activate", help="make a registered version active")
+    activate.add_argument("name")
+    activate.add_argument("version")
+    args = parser.parse_args(argv)
+
+    manifest = read_manifest(args.manifest) if os.path.exists(args.manifest) else {}
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    spec = manifest.setdefault(args.name, {"versions": {}})
+
+    if args.command == "add":
+        entry = {}
+        for kind in ("model", "scaler"):
+            path = getattr(args, kind)
+            entry[kind] = os.path.relpath(os.path.abspath(path), base_dir)
+            entry[f"{kind}_sha256"] = file_checksum(path)
+        spec["versions"][args.version] = entry
+        if not args.inactive or "active" not in spec:
+            spec["active"] = args.version
+    else:
+        if args.version not in spec["versions"]:
+            print(f"{args.name} has no version {args.version}", file=sys.stderr)
+            return 1
+        spec["active"] = args.version
+
+    write_manifest(args.manifest, manifest)
+    print(f"{args.name}: active version {spec['active']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Feature layouts and vectorized helpers for the maternal and fetal models."""
+import os
+
+import numpy as np
+
+from metrics import span
+
+MATERNAL_FEATURES = [
+    'age', 'systolic_bp', 'diastolic_bp', 'blood_glucose', 'body_temp', 'heart_rate'
+]
+
+FETAL_FEATURES = [
+    'baseline_value', 'accelerations', 'fetal_movement', 'uterine_contractions',
+    'light_decelerations', 'severe_decelerations', 'prolonged_decelerations',
+    'abnormal_short_term_variability', 'mean_value_of_short_term_variability',
+    'percentage_of_time_with_abnormal_long_term_variability', 'mean_value_of_long_term_variability',
+    'histogram_width', 'histogram_min', 'histogram_max', 'histogram_number_of_peaks'
+]
+
+MATERNAL_RISK_LABELS = {0: "Normal", 1: "Suspect", 2: "Pathological"}
+FETAL_HEALTH_LABELS = {0: "Normal", 1: "Suspect", 2: "Pathological"}
+
+MAX_BATCH_ROWS = int(os.environ.get("PREDICT_BATCH_MAX_ROWS", 1000))
+
+
+def _to_float(value):
+    # bool is an int subclass but never a meaningful reading
+    if isinstance(value, bool) or value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _row_values(record, feature_names):
+    """Pulls the raw feature values out of a record.
+
+    Accepts a dict keyed by feature name, a ``{"features": [...]}`` dict, or a
+    bare list. Returns ``None`` when the record has the wrong shape.
+    """
+    if isinstance(record, dict) and "features" in record:
+        record = record["features"]
+    if isinstance(record, dict):
+        return [record.get(name) for name in feature_names]
+    if isinstance(record, (list, tuple)) and len(record) == len(feature_names):
+        return list(record)
+    return None
+
+
+def records_to_matrix(records, feature_names):
+    """Builds an (n, k) float matrix from ``records`` and validates it in one pass.
+
+    Returns ``(X, valid, errors)`` where ``valid`` is a boolean mask over the rows
+    and ``errors`` maps a row index to a human readable message.
+    """
+    n, k = len(records), len(feature_names)
+    X = np.full((n, k), np.nan)
+    shape_ok = np.ones(n, dtype=bool)
+    for i, record in enumerate(records):
+        values = _row_values(record, feature_names)
+        if values is None:
+            shape_ok[i] = False
+            continue
+        X[i] = [_to_float(v) for v in values]
+
+    finite = np.isfinite(X)
+    valid = shape_ok & finite.all(axis=1)
+
+    errors = {}
+    for i in np.flatnonzero(~valid):
+        if not shape_ok[i]:
+            errors[int(i)] = f"Invalid record, expected {k} features"
+        else:
+            bad = [feature_names[j] for j in np.flatnonzero(~finite[i])]
+            errors[int(i)] = f"Missing or non-numeric values for: {', '.join(bad)}"
+    return X, valid, errors
+
+
+def predict_matrix(model, scaler, X):
+    """Scales and scores every row of ``X`` with a single transform/predict call.
+
+    ``scaler`` is ``None`` for fused predictors that take raw features.
+    """
+    if X.shape[0] == 0:
+        return np.empty(0, dtype=int)
+    if scaler is not None:
+        with span("scale"):
+            X = scaler.transform(X)
+    with span("predict"):
+        return model.predict(X).astype(int)
+
+
+def score_records(records, feature_names, model, scaler):
+    """Validates and scores a batch of records.
+
+    Returns ``(X, scored, errors)`` where ``scored`` is a list of
+    ``(row_index, prediction)`` pairs for the rows that passed validation.
+    """
+    X, valid, errors = records_to_matrix(records, feature_names)
+    rows = np.flatnonzero(valid)
+    predictions = predict_matrix(model, scaler, X[rows])
+    scored = [(int(i), int(p)) for i, p in zip(rows, predictions)]
+    return X, scored, errors
@@ -0,0 +1,159 @@
+"""Per-user cache of session read responses, with ETags.
+
+Responses of the session list and session detail endpoints are kept, by
+user, kind (``chat`` / ``diet``), session and query string, in an LRU bounded
+by total body bytes. Every response carries an ETag derived from its body so
+clients can revalidate with ``If-None-Match`` and get a 304.
+
+Writes call ``invalidate``, which drops the user's lists of that kind and
+the written session. To stop a read that raced with a write from caching
+what it read before the write, a fill starts with ``begin()`` and ``put``
+only stores it if no invalidation for that user and kind happened since.
+
+Entries are per process, so each one also keeps the ``version`` of the data
+it was filled from (see ``session_version`` in main.py: the session's
+``updated_at``, or for a list the user's counter in ``session_versions``).
+``get`` only returns an entry whose version matches the one the caller just
+read, which catches writes made through other workers; ``ttl`` only bounds
+memory held by entries nobody reads.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "headers", "expires", "version")
+
+    def __init__(self, body, etag, headers, expires, version=None):
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+        self.expires = expires
+        self.version = version
+
+
+def body_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """True if an ``If-None-Match`` header value covers ``etag`` (weak comparison)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/").strip('"') == etag:
+            return True
+    return False
+
+
+class ReadCache:
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=30.0, max_stamps=10000, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_stamps = max_stamps
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._bytes = 0
+        self._seq = 0
+        # Last invalidation per (user, kind); older stamps fold into _floor
+        self._stamps = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "stale_fills": 0,
+                          "outdated": 0, "invalidations": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(float(os.environ.get("READ_CACHE_MB", 32)) * 1024 * 1024),
+            ttl=float(os.environ.get("READ_CACHE_TTL_S", 30)),
+        )
+
+    @staticmethod
+    def key(user_id, kind, session_id=None, query=b""):
+        return (user_id, kind, session_id, query)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def get(self, key, version=None):
+        """The cached entry for ``key`` if it was filled from ``version``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= self.clock():
+                self._drop(key)
+                entry = None
+            elif entry is not None and entry.version != version:
+                # Written since, possibly through another worker
+                self._drop(key)
+                self._counters["outdated"] += 1
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry
+
+    def begin(self):
+        """Token for a fill that is about to read from the database."""
+        with self._lock:
+            return self._seq
+
+    def put(self, key, token, body, headers=None, version=None):
+        """Returns the response entry for ``body``. It is only cached if the
+        user's data of this kind wasn't invalidated after ``token``.
+        ``version`` must have been read before the body."""
+        entry = CachedResponse(body, body_etag(body), dict(headers or {}), self.clock() + self.ttl, version)
+        with self._lock:
+            if token < max(self._floor, self._stamps.get(key[:2], 0)):
+                self._counters["stale_fills"] += 1
+                return entry
+            if len(body) > self.max_bytes:
+                return entry
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._by_user.setdefault(key[0], set()).add(key)
+            self._bytes += len(body)
+            self._counters["stores"] += 1
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+        return entry
+
+    def invalidate(self, user_id, kind, session_id=None):
+        """Drops ``user_id``'s cached lists of ``kind`` and, if given, that session."""
+        with self._lock:
+            self._seq += 1
+            stamp = (user_id, kind)
+            self._stamps[stamp] = self._seq
+            self._stamps.move_to_end(stamp)
+            while len(self._stamps) > self.max_stamps:
+                _, oldest = self._stamps.popitem(last=False)
+                self._floor = max(self._floor, oldest)
+            for key in list(self._by_user.get(user_id, ())):
+                if key[1] == kind and (key[2] is None or key[2] == session_id):
+                    self._drop(key)
+            self._counters["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,242 @@
+"""Recompute the stored prediction of vitals and ctg rows with a model version.
+
+Usage: python rescore_predictions.py [vitals|ctg|all] [--version V] [--dry-run]
+                                     [--chunk-size N] [--workers N] [--checkpoint-dir DIR]
+                                     [--restart] [--report FILE] [--manifest PATH]
+
+Run it after registering a retrained model (``model_registry.py add``). The
+table is read in ``id`` order, ``--chunk-size`` rows at a time, each page
+starting after the last id of the previous one. Every chunk is scored with
+one transform/predict call in a pool of ``--workers`` processes (0 scores
+in this process) while the next chunks are fetched, and at most two chunks
+per worker are held at once, so memory stays bounded however large the
+table is.
+
+Scored rows get the new prediction and ``model_version`` in bulk updates,
+one per predicted class and batch of ids. After each chunk is written the
+last id and the running counts are saved to a checkpoint, and a re-run
+with the same table, version and mode continues from there (``--restart``
+starts over). ``--dry-run`` writes nothing and reports how many labels
+would change, old label to new.
+
+Rows missing a feature are skipped and counted as unscorable: vitals rows
+only hold ``age`` since sql/vitals_age.sql. Rows already scored by the
+version are left alone. The weekly class counts of /vitals/trends and
+/ctg/trends are kept by insert triggers, so re-run sql/prediction_trends.sql
+after a real run to recount them.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from model_registry import load_version, manifest_entry, read_manifest, write_manifest
+from predictions import FETAL_FEATURES, MATERNAL_FEATURES, predict_matrix, records_to_matrix
+
+# table -> (model name, feature columns in model order)
+TABLES = {
+    "vitals": ("maternal", MATERNAL_FEATURES),
+    "ctg": ("fetal", FETAL_FEATURES),
+}
+
+# Ids per update; each batch goes in the request URL
+UPDATE_BATCH = 500
+
+_model = None
+
+
+def _load_model(name, version, manifest_path):
+    global _model
+    _, entry = manifest_entry(read_manifest(manifest_path), name, version)
+    _model = load_version(name, version, entry, os.path.dirname(os.path.abspath(manifest_path)))
+
+
+def _score(X):
+    return predict_matrix(_model.predictor, _model.predictor_scaler, X)
+
+
+class InlinePool:
+    """Scores in this process, for ``--workers 0``."""
+
+    def submit(self, fn, *args):
+        return _Done(fn(*args))
+
+    def shutdown(self):
+        pass
+
+
+class _Done:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def fetch_chunks(client, table, columns, chunk_size, after=None):
+    """Yields the table's rows in id order, ``chunk_size`` at a time."""
+    while True:
+        query = client.table(table).select(", ".join(columns)).order("id").limit(chunk_size)
+        if after is not None:
+            query = query.gt("id", after)
+        rows = query.execute().data
+        if rows:
+            yield rows
+            after = rows[-1]["id"]
+        if len(rows) < chunk_size:
+            return
+
+
+def write_predictions(client, table, ids_by_label, version):
+    for label, ids in ids_by_label.items():
+        for start in range(0, len(ids), UPDATE_BATCH):
+            client.table(table).update({"prediction": label, "model_version": version}).in_(
+                "id", ids[start:start + UPDATE_BATCH]
+            ).execute()
+
+
+class Checkpoint:
+    """Progress of one run, saved after every chunk that is done."""
+
+    def __init__(self, path, table, version, dry_run):
+        self.path = path
+        self.state = {"table": table, "version": version, "dry_run": dry_run, "last_id": None,
+                      "finished": False, "counts": {}, "transitions": {}}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return self
+        if all(saved.get(k) == self.state[k] for k in ("table", "version", "dry_run")):
+            self.state = saved
+        return self
+
+    def save(self):
+        # write_manifest replaces the file in one step, so a crash keeps the previous one
+        write_manifest(self.path, self.state)
+
+
+def rescore(client, pool, table, version, checkpoint, chunk_size, workers, dry_run):
+    """Scores the rows after the checkpoint; returns the checkpoint's state."""
+    _, features = TABLES[table]
+    state = checkpoint.state
+    counts, transitions = Counter(state["counts"]), Counter(state["transitions"])
+    in_flight = deque()
+
+    def finish(rows, scorable, future, chunk_counts):
+        predictions = future.result()
+        ids_by_label = {}
+        for row, prediction in zip(scorable, predictions):
+            old, new = row.get("prediction"), int(prediction)
+            if old is None or int(old) != new:
+                chunk_counts["changed"] += 1
+                transitions[f"{'none' if old is None else int(old)}->{new}"] += 1
+            ids_by_label.setdefault(new, []).append(row["id"])
+        if not dry_run:
+            write_predictions(client, table, ids_by_label, version)
+        # Counted only now, so a resumed run doesn't count unfinished chunks twice
+        counts.update(chunk_counts)
+        state.update(last_id=rows[-1]["id"], counts=dict(counts), transitions=dict(transitions))
+        checkpoint.save()
+
+    columns = ["id", "prediction", "model_version"] + list(features)
+    for rows in fetch_chunks(client, table, columns, chunk_size, after=state["last_id"]):
+        pending = [row for row in rows if row.get("model_version") != version]
+        X, valid, _ = records_to_matrix(pending, features)
+        scorable = [row for row, ok in zip(pending, valid) if ok]
+        chunk_counts = Counter(scanned=len(rows), current=len(rows) - len(pending),
+                               unscorable=int((~valid).sum()), scored=len(scorable))
+        in_flight.append((rows, scorable, pool.submit(_score, X[valid]), chunk_counts))
+        while len(in_flight) > max(workers, 1) * 2 - 1:
+            finish(*in_flight.popleft())
+            print(f"{table}: {counts['scanned']} rows done, last id {state['last_id']}", flush=True)
+    while in_flight:
+        finish(*in_flight.popleft())
+
+    state["finished"] = True
+    checkpoint.save()
+    return state
+
+
+def report_lines(state):
+    counts = Counter(state["counts"])
+    action = "would change" if state["dry_run"] else "changed"
+    lines = [
+        f"{state['table']} with version {state['version']}: {counts['scanned']} rows, "
+        f"{counts['scored']} scored, {counts['current']} already current, "
+        f"{counts['unscorable']} unscorable, {action} {counts['changed']} labels"
+    ]
+    for transition, n in sorted(state["transitions"].items()):
+        lines.append(f"  {transition}: {n}")
+    return lines
+
+
+def run(args):
+    from supabase import create_client
+
+    client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+    manifest = read_manifest(args.manifest)
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    tables = list(TABLES) if args.table == "all" else [args.table]
+    results = []
+    for table in tables:
+        name, _ = TABLES[table]
+        version, _ = manifest_entry(manifest, name, args.version)
+        mode = "-dry-run" if args.dry_run else ""
+        path = os.path.join(args.checkpoint_dir, f"{table}-{version}{mode}.json")
+        checkpoint = Checkpoint(path, table, version, args.dry_run)
+        if not args.restart:
+            checkpoint.load()
+        if checkpoint.state["finished"]:
+            print(f"{table}: already rescored with version {version} (--restart to run again)")
+        else:
+            if args.workers > 0:
+                # spawn: the parent holds the Supabase client's connections and threads
+                pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=_load_model, initargs=(name, version, args.manifest))
+            else:
+                _load_model(name, version, args.manifest)
+                pool = InlinePool()
+            started = time.perf_counter()
+            try:
+                rescore(client, pool, table, version, checkpoint, args.chunk_size, args.workers, args.dry_run)
+            finally:
+                pool.shutdown()
+            print(f"{table}: done in {time.perf_counter() - started:.1f}s")
+        results.append(checkpoint.state)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("table", nargs="?", default="all", choices=list(TABLES) + ["all"])
+    parser.add_argument("--version", help="model version to score with (default: the active one)")
+    parser.add_argument("--dry-run", action="store_true", help="only report how many labels would change")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 1) - 1, 1))
+    parser.add_argument("--checkpoint-dir", default="rescore_checkpoints")
+    parser.add_argument("--restart", action="store_true", help="ignore saved progress")
+    parser.add_argument("--report", help="also write the report as JSON to this file")
+    parser.add_argument("--manifest", default=os.environ.get("MODEL_MANIFEST", "models.json"))
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    results = run(args)
+    for state in results:
+        print("\n".join(report_lines(state)))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Prefork launcher: several uvicorn workers sharing one copy of the models.
+
+Usage: python serve.py [--workers N] [--host H] [--port P] [--max-requests N]
+                       [--max-private-mb MB] [--no-preload]
+
+The parent imports the app and loads every model in models.json and the
+SDK clients once (``main.preload``), then forks the workers. The imported libraries, models, scalers and compiled
+predictors are inherited copy-on-write, so each extra worker adds only the
+memory it writes to itself. ``gc.freeze()`` keeps the inherited objects out
+of the workers' garbage collections, which would otherwise touch (and so
+copy) their pages. The app starts no threads and opens no connections or
+spool files at import, so all of that happens in each worker.
+
+Workers accept on one shared listening socket. A worker is replaced when it
+exits, after ``--max-requests`` requests (with jitter, so they don't all
+recycle at once), or when its private memory grows past ``--max-private-mb``.
+SIGHUP replaces the workers one by one; SIGTERM and SIGINT stop them
+gracefully. ``--no-preload`` makes every worker import and load everything
+itself, as separate uvicorn processes would (bench_workers.py compares both).
+"""
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+import uvicorn
+
+
+def smaps_rollup(pid):
+    """Memory counters of a process from /proc, in kB (empty where unavailable)."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        pass
+    return values
+
+
+def private_mb(pid):
+    """Resident memory only this process maps (not shared with the parent or siblings)."""
+    values = smaps_rollup(pid)
+    return (values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)) / 1024
+
+
+def load_app():
+    import main
+    main.preload()
+    return main.app
+
+
+class Arbiter:
+    def __init__(self, sock, app, args):
+        self.sock = sock
+        self.app = app
+        self.args = args
+        self.workers = {}  # pid -> start time
+        self._stopping = False
+        self._recycle = False
+        self._last_memory_check = 0.0
+
+    # --- worker side ---
+
+    def _run_worker(self):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        random.seed()
+        code = 0
+        try:
+            app = self.app or load_app()
+            max_requests = self.args.max_requests
+            if max_requests:
+                max_requests += random.randint(0, self.args.max_requests_jitter)
+            config = uvicorn.Config(
+                app,
+                limit_max_requests=max_requests or None,
+                timeout_graceful_shutdown=self.args.graceful_timeout,
+                log_level=self.args.log_level,
+            )
+            server = uvicorn.Server(config)
+            threading.Thread(target=self._watch_parent, args=(server,), name="parent-watch", daemon=True).start()
+            server.run(sockets=[self.sock])
+        except BaseException as e:
+            print(f"Worker {os.getpid()} failed: {e!r}", file=sys.stderr)
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # Never return into the parent's loop
+            os._exit(code)
+
+    @staticmethod
+    def _watch_parent(server):
+        # Stop gracefully if the parent dies, instead of serving on as an orphan
+        parent = os.getppid()
+        while not server.should_exit:
+            time.sleep(1.0)
+            if os.getppid() != parent:
+                print(f"Worker {os.getpid()}: parent exited, stopping")
+                server.should_exit = True
+
+    # --- parent side ---
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.workers[pid] = time.monotonic()
+        print(f"Started worker {pid}")
+        return pid
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+            if started is not None and time.monotonic() - started < 1.0 and not self._stopping:
+                time.sleep(1.0)  # don't spin on a worker that can't start
+
+    def _replace(self, pid, reason):
+        print(f"Replacing worker {pid}: {reason}")
+        self.spawn()
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _check_memory(self):
+        now = time.monotonic()
+        if not self.args.max_private_mb or now - self._last_memory_check < 5.0:
+            return
+        self._last_memory_check = now
+        for pid in list(self.workers):
+            used = private_mb(pid)
+            if used > self.args.max_private_mb:
+                self._replace(pid, f"{used:.0f} MB private memory")
+
+    def _recycle_all(self):
+        self._recycle = False
+        for pid in list(self.workers):
+            self._replace(pid, "reload requested")
+            time.sleep(1.0)  # keep the other workers serving meanwhile
+
+    def stop(self):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            print(f"Killing worker {pid}")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            self.workers.pop(pid, None)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "_stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "_stopping", True))
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "_recycle", True))
+        while not self._stopping:
+            self._reap()
+            while len(self.workers) < self.args.workers and not self._stopping:
+                self.spawn()
+            if self._recycle:
+                self._recycle_all()
+            self._check_memory()
+            time.sleep(0.2)
+        self.stop()
+
+
+def bind(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API on several forked workers.")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--max-requests", type=int, default=int(os.environ.get("WORKER_MAX_REQUESTS", 0)),
+                        help="recycle a worker after this many requests (0: never)")
+    parser.add_argument("--max-requests-jitter", type=int,
+                        default=int(os.environ.get("WORKER_MAX_REQUESTS_JITTER", 100)))
+    parser.add_argument("--max-private-mb", type=float, default=float(os.environ.get("WORKER_MAX_PRIVATE_MB", 0)),
+                        help="recycle a worker whose private memory exceeds this (0: never)")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.environ.get("WORKER_GRACEFUL_TIMEOUT_S", 30)))
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "info"))
+    parser.add_argument("--no-preload", action="store_true", help="import and load models in each worker instead")
+    args = parser.parse_args(argv)
+
+    sock = bind(args.host, args.port)
+    app = None
+    if not args.no_preload:
+        app = load_app()
+        # Objects loaded so far are shared with the workers; keep GC from writing to them
+        gc.collect()
+        gc.freeze()
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers (parent {os.getpid()})")
+    Arbiter(sock, app, args).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Keyset-paginated, projected listing of a user's sessions.
+
+Sessions are listed newest first by ``(updated_at, id)``. Each page asks the
+database for one row past ``limit`` to learn whether more follow; the next
+page then starts strictly after the last row returned, so a page costs the
+same however deep it is and sessions updated between requests are neither
+skipped nor repeated within the rows already seen.
+
+The cursor is an opaque url-safe token wrapping that last ``(updated_at, id)``.
+``fields`` restricts the selected columns to a whitelist, and ``summary``
+leaves out the heavy ones (such as a diet session's plan JSON). ``client``
+is an async Supabase client.
+"""
+import base64
+import json
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class ListingError(ValueError):
+    """Raised for a malformed cursor, limit or field list."""
+
+
+def encode_cursor(row):
+    raw = json.dumps([row["updated_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        updated_at, session_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ListingError("Invalid cursor")
+    if not isinstance(updated_at, str) or not isinstance(session_id, (str, int)):
+        raise ListingError("Invalid cursor")
+    return updated_at, session_id
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if value in (None, ""):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ListingError("limit must be an integer")
+    if limit < 1:
+        raise ListingError("limit must be positive")
+    return min(limit, maximum)
+
+
+def _quote(value):
+    # PostgREST logic trees split on commas and parentheses; quote the value
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class SessionListing:
+    """Lists one session table.
+
+    ``columns`` are the selectable columns in response order, ``heavy`` the
+    ones dropped in summary mode. ``id`` and ``updated_at`` are always
+    selected because the cursor is built from them.
+    """
+
+    def __init__(self, client, table, columns, heavy=()):
+        self.client = client
+        self.table = table
+        self.columns = list(columns)
+        self.heavy = set(heavy)
+
+    def projection(self, fields=None, summary=False):
+        if fields:
+            requested = [f.strip() for f in fields.split(",") if f.strip()]
+            unknown = [f for f in requested if f not in self.columns]
+            if unknown:
+                raise ListingError(f"Unknown fields: {', '.join(unknown)}")
+        else:
+            requested = [c for c in self.columns if not (summary and c in self.heavy)]
+        return [c for c in self.columns if c in requested or c in ("id", "updated_at")]
+
+    async def page(self, user_id, fields=None, summary=False, limit=DEFAULT_LIMIT, cursor=None):
+        """Returns ``(rows, next_cursor)``; ``next_cursor`` is ``None`` on the last page."""
+        columns = self.projection(fields, summary)
+        query = self.client.table(self.table).select(", ".join(columns)).eq("user_id", user_id)
+        if cursor:
+            updated_at, session_id = decode_cursor(cursor)
+            query = query.or_(
+                f"updated_at.lt.{_quote(updated_at)},"
+                f"and(updated_at.eq.{_quote(updated_at)},id.lt.{_quote(session_id)})"
+            )
+        rows = (await query.order("updated_at", desc=True).order("id", desc=True).limit(limit + 1).execute()).data
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]) if has_more and rows else None
+        return rows, next_cursor
@@ -0,0 +1,4 @@
+-- Rolling summary of the messages that no longer fit in the chat prompt
+-- (maintained by chat_context.ChatContextManager).
+alter table chat_sessions add column if not exists context_summary text;
+alter table chat_sessions add column if not exists context_summary_seq integer not null default 0;
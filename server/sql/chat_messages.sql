@@ -0,0 +1,9 @@
+-- One row per chat message, appended by message_store.ChatMessageStore.
+create table if not exists chat_messages (
+    session_id uuid not null references chat_sessions (id) on delete cascade,
+    seq integer not null,
+    role text not null,
+    content text not null,
+    created_at timestamptz not null default now(),
+    primary key (session_id, seq)
+);
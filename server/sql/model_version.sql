@@ -0,0 +1,4 @@
+-- Model version that produced each stored prediction (model_registry.ModelRegistry).
+-- Apply before deploying the server that writes it; older rows stay null.
+alter table vitals add column if not exists model_version text;
+alter table ctg add column if not exists model_version text;
@@ -0,0 +1,130 @@
+-- Weekly per-user aggregates of vitals and ctg readings for /vitals/trends and
+-- /ctg/trends (trends.TrendReader). Insert triggers fold every new row into its
+-- (user, kind, week) row, whoever inserts it (the server's write-behind buffer
+-- or the app writing to vitals directly), so a trend request reads one row per
+-- week instead of the user's history.
+--
+-- Array columns are in the metric order of trends.TREND_METRICS. Times are in
+-- days since the start of the week; the reader shifts them to combine weeks.
+-- Rows are only ever appended to vitals and ctg, so deletes are not tracked.
+create table if not exists prediction_trends (
+    uid text not null,
+    kind text not null,
+    week date not null,
+    n integer not null,
+    t_sum double precision not null,
+    t_squares double precision not null,
+    sums double precision[] not null,
+    squares double precision[] not null,
+    t_products double precision[] not null,
+    mins double precision[] not null,
+    maxs double precision[] not null,
+    classes integer[] not null,
+    primary key (uid, kind, week)
+);
+
+create or replace function trend_add(a anyarray, b anyarray) returns anyarray
+language sql immutable as $$
+    select array_agg(x + y order by i) from unnest(a, b) with ordinality as u(x, y, i)
+$$;
+
+create or replace function trend_least(a anyarray, b anyarray) returns anyarray
+language sql immutable as $$
+    select array_agg(least(x, y) order by i) from unnest(a, b) with ordinality as u(x, y, i)
+$$;
+
+create or replace function trend_greatest(a anyarray, b anyarray) returns anyarray
+language sql immutable as $$
+    select array_agg(greatest(x, y) order by i) from unnest(a, b) with ordinality as u(x, y, i)
+$$;
+
+-- Adds one reading; concurrent inserts for the same week serialize on its row
+create or replace function accumulate_prediction_trend(
+    p_uid text, p_kind text, p_at timestamptz, p_prediction integer, p_values double precision[]
+) returns void
+language plpgsql as $$
+declare
+    v_week date := date_trunc('week', p_at at time zone 'utc')::date;
+    v_t double precision := extract(epoch from (p_at at time zone 'utc') - v_week::timestamp) / 86400;
+    v_classes integer[] := '{0,0,0}';
+begin
+    -- Readings with a missing value would skew every sum; they are left out
+    if p_uid is null or array_position(p_values, null) is not null then
+        return;
+    end if;
+    if p_prediction between 0 and 2 then
+        v_classes[p_prediction + 1] := 1;
+    end if;
+    insert into prediction_trends as w
+        (uid, kind, week, n, t_sum, t_squares, sums, squares, t_products, mins, maxs, classes)
+    values (
+        p_uid, p_kind, v_week, 1, v_t, v_t * v_t, p_values,
+        array(select x * x from unnest(p_values) with ordinality as u(x, i) order by i),
+        array(select v_t * x from unnest(p_values) with ordinality as u(x, i) order by i),
+        p_values, p_values, v_classes
+    )
+    on conflict (uid, kind, week) do update set
+        n = w.n + 1,
+        t_sum = w.t_sum + excluded.t_sum,
+        t_squares = w.t_squares + excluded.t_squares,
+        sums = trend_add(w.sums, excluded.sums),
+        squares = trend_add(w.squares, excluded.squares),
+        t_products = trend_add(w.t_products, excluded.t_products),
+        mins = trend_least(w.mins, excluded.mins),
+        maxs = trend_greatest(w.maxs, excluded.maxs),
+        classes = trend_add(w.classes, excluded.classes);
+end;
+$$;
+
+-- Trigger arguments: the kind, then the metric columns in order
+create or replace function prediction_trend_trigger() returns trigger
+language plpgsql as $$
+declare
+    v_row jsonb := to_jsonb(new);
+    v_values double precision[];
+begin
+    select array_agg((v_row ->> c.col)::double precision order by c.i)
+      into v_values
+      from unnest(tg_argv[1:]) with ordinality as c(col, i);
+    perform accumulate_prediction_trend(
+        v_row ->> 'UID', tg_argv[0], coalesce((v_row ->> 'created_at')::timestamptz, now()),
+        (v_row ->> 'prediction')::double precision::integer, v_values
+    );
+    return new;
+end;
+$$;
+
+-- Backfill and attach the triggers in one step, with inserts held off meanwhile,
+-- so no row is missed or counted twice. Safe to re-run.
+begin;
+lock table vitals, ctg in share row exclusive mode;
+delete from prediction_trends;
+
+select count(accumulate_prediction_trend(
+    "UID"::text, 'vitals', coalesce(created_at, now()), prediction::integer,
+    array[systolic_bp, diastolic_bp, blood_glucose, body_temp, heart_rate]::double precision[]
+)) from vitals;
+
+select count(accumulate_prediction_trend(
+    "UID"::text, 'ctg', coalesce(created_at, now()), prediction::integer,
+    array[baseline_value, accelerations, fetal_movement, uterine_contractions, light_decelerations,
+          severe_decelerations, prolonged_decelerations, abnormal_short_term_variability,
+          mean_value_of_short_term_variability, percentage_of_time_with_abnormal_long_term_variability,
+          mean_value_of_long_term_variability, histogram_width, histogram_min, histogram_max,
+          histogram_number_of_peaks]::double precision[]
+)) from ctg;
+
+drop trigger if exists vitals_trend on vitals;
+create trigger vitals_trend after insert on vitals for each row
+    execute function prediction_trend_trigger(
+        'vitals', 'systolic_bp', 'diastolic_bp', 'blood_glucose', 'body_temp', 'heart_rate');
+
+drop trigger if exists ctg_trend on ctg;
+create trigger ctg_trend after insert on ctg for each row
+    execute function prediction_trend_trigger(
+        'ctg', 'baseline_value', 'accelerations', 'fetal_movement', 'uterine_contractions',
+        'light_decelerations', 'severe_decelerations', 'prolonged_decelerations',
+        'abnormal_short_term_variability', 'mean_value_of_short_term_variability',
+        'percentage_of_time_with_abnormal_long_term_variability', 'mean_value_of_long_term_variability',
+        'histogram_width', 'histogram_min', 'histogram_max', 'histogram_number_of_peaks');
+commit;
@@ -0,0 +1,6 @@
+-- Keyset indexes for the paged session lists (session_listing.SessionListing):
+-- each page is one index range scan from the cursor, whatever the page depth.
+create index if not exists chat_sessions_user_updated_idx
+    on chat_sessions (user_id, updated_at desc, id desc);
+create index if not exists diet_sessions_user_updated_idx
+    on diet_sessions (user_id, updated_at desc, id desc);
@@ -0,0 +1,31 @@
+-- Per-user version of the chat and diet session lists (main.session_version).
+-- Triggers bump it on every insert, update or delete of a user's sessions,
+-- whichever worker or client makes the change, so a cached list is checked
+-- with one primary-key read instead of counting the user's sessions.
+create table if not exists session_versions (
+    user_id text not null,
+    kind text not null,
+    version bigint not null,
+    primary key (user_id, kind)
+);
+
+-- Trigger argument: the kind
+create or replace function bump_session_version() returns trigger
+language plpgsql as $$
+declare
+    v_user text := case tg_op when 'DELETE' then old.user_id else new.user_id end;
+begin
+    insert into session_versions as v (user_id, kind, version)
+    values (v_user, tg_argv[0], 1)
+    on conflict (user_id, kind) do update set version = v.version + 1;
+    return null;
+end
+$$;
+
+drop trigger if exists chat_sessions_version on chat_sessions;
+create trigger chat_sessions_version after insert or update or delete on chat_sessions for each row
+    execute function bump_session_version('chat');
+
+drop trigger if exists diet_sessions_version on diet_sessions;
+create trigger diet_sessions_version after insert or update or delete on diet_sessions for each row
+    execute function bump_session_version('diet');
@@ -0,0 +1,5 @@
+-- Maternal age of each vitals row, so stored rows hold every feature of the
+-- maternal model and rescore_predictions.py can score them again after a
+-- retrain. Apply before deploying the server that writes it; older rows and
+-- rows the app inserts directly stay null and are skipped by the rescorer.
+alter table vitals add column if not exists age double precision;
@@ -0,0 +1,67 @@
+"""Server-sent event helpers for streaming LLM replies to the client."""
+import asyncio
+import json
+
+# Keeps relay tasks referenced until they finish, even after their client left
+_running = set()
+
+
+def sse_event(data, event=None):
+    """Formats one server-sent event with a JSON payload."""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class StreamRelay:
+    """Forwards model chunks as ``delta`` events and persists the full reply.
+
+    ``chunks`` is any async iterable of text chunks (``LLMGateway.astream``,
+    or a fake that yields chunks with delays).
+    ``on_complete(text)`` is a coroutine function called once with the whole
+    reply; its return value is sent as the final ``done`` event. The model is
+    read by a separate task, so if the client disconnects mid-stream the rest
+    of the reply is still read and persisted, and the stored conversation
+    never has a missing answer.
+    """
+
+    def __init__(self, chunks, on_complete):
+        self.chunks = chunks
+        self.on_complete = on_complete
+
+    async def _pump(self, queue):
+        parts = []
+        try:
+            async for chunk in self.chunks:
+                if chunk:
+                    parts.append(chunk)
+                    queue.put_nowait(("delta", chunk))
+        except Exception as e:
+            print(f"Error while streaming reply: {e}")
+            queue.put_nowait(("error", e))
+            return
+        try:
+            result = await self.on_complete("".join(parts))
+        except Exception as e:
+            print(f"Error saving streamed reply: {e}")
+            queue.put_nowait(("error", e))
+            return
+        queue.put_nowait(("done", result))
+
+    async def events(self):
+        queue = asyncio.Queue()
+        task = asyncio.get_running_loop().create_task(self._pump(queue))
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+        while True:
+            kind, payload = await queue.get()
+            if kind == "delta":
+                yield sse_event({"delta": payload})
+            elif kind == "error":
+                yield sse_event({"error": str(payload)}, event="error")
+                return
+            else:
+                yield sse_event(payload, event="done")
+                return
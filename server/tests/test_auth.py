@@ -0,0 +1,185 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+from auth import SigningKeyCache, TokenVerifier
+
+SECRET = "s" * 64
+AUDIENCE = "authenticated"
+
+
+def claims(**overrides):
+    now = int(time.time())
+    return dict({"sub": "user-1", "aud": AUDIENCE, "exp": now + 3600, "email": "a@example.com"}, **overrides)
+
+
+@pytest.fixture(scope="module")
+def ec_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+@pytest.fixture
+def verifier(ec_key):
+    jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(ec_key.public_key()))
+    jwk.update(kid="key-1", alg="ES256", use="sig")
+    return TokenVerifier(jwt_secret=SECRET, signing_keys=SigningKeyCache(jwks={"keys": [jwk]}))
+
+
+def test_valid_secret_token(verifier):
+    result = verifier.get_user(jwt.encode(claims(), SECRET, algorithm="HS256"))
+    assert result.user.id == "user-1"
+    assert result.user.email == "a@example.com"
+
+
+def test_valid_key_token(verifier, ec_key):
+    token = jwt.encode(claims(), ec_key, algorithm="ES256", headers={"kid": "key-1"})
+    assert verifier.get_user(token).user.id == "user-1"
+
+
+def test_expired_token(verifier):
+    token = jwt.encode(claims(exp=int(time.time()) - 60), SECRET, algorithm="HS256")
+    assert verifier.get_user(token) is None
+
+
+def test_wrong_audience(verifier):
+    assert verifier.get_user(jwt.encode(claims(aud="anon"), SECRET, algorithm="HS256")) is None
+
+
+@pytest.mark.parametrize("alg", ["HS384", "HS512"])
+def test_other_hmac_algorithm(verifier, alg):
+    assert verifier.get_user(jwt.encode(claims(), SECRET, algorithm=alg)) is None
+
+
+def test_algorithm_none(verifier):
+    token = jwt.encode(claims(), None, algorithm="none")
+    assert verifier.get_user(token) is None
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def test_hmac_signed_with_public_key(verifier, ec_key):
+    # Key confusion: HS256 "signed" with the published key; PyJWT won't encode this itself
+    pem = ec_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    signing_input = ".".join([
+        _b64(json.dumps({"alg": "HS256", "typ": "JWT", "kid": "key-1"}).encode()),
+        _b64(json.dumps(claims()).encode()),
+    ])
+    signature = hmac.new(pem, signing_input.encode(), hashlib.sha256).digest()
+    assert verifier.get_user(f"{signing_input}.{_b64(signature)}") is None
+
+
+def test_algorithm_not_matching_key(verifier):
+    # The key id is known but the token uses another algorithm than its JWK
+    other = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    token = jwt.encode(claims(), other, algorithm="RS256", headers={"kid": "key-1"})
+    assert verifier.get_user(token) is None
+
+
+def test_unknown_kid_without_remote_lookup(verifier, ec_key):
+    token = jwt.encode(claims(), ec_key, algorithm="ES256", headers={"kid": "key-2"})
+    assert verifier.get_user(token) is None
+
+
+def test_unknown_kid_falls_back_to_remote_lookup(ec_key):
+    calls = []
+
+    def remote_lookup(token):
+        calls.append(token)
+        return None
+
+    verifier = TokenVerifier(signing_keys=SigningKeyCache(jwks={"keys": []}), remote_lookup=remote_lookup)
+    token = jwt.encode(claims(), ec_key, algorithm="ES256", headers={"kid": "key-2"})
+    assert verifier.get_user(token) is None
+    assert calls == [token]
+
+
+@pytest.mark.parametrize("token", ["", "garbage", "a.b.c"])
+def test_malformed_token(verifier, token):
+    assert verifier.get_user(token) is None
+
+
+def test_valid_token_is_cached(verifier):
+    token = jwt.encode(claims(), SECRET, algorithm="HS256")
+    verifier.get_user(token)
+    verifier.get_user(token)
+    stats = verifier.stats()
+    assert stats["local_verifications"] == 1
+    assert stats["hits"] == 1
+
+
+class Refused(Exception):
+    status = 401
+
+
+class RemoteSessions:
+    """A remote lookup that answers for tokens until their session is signed out."""
+
+    def __init__(self):
+        self.signed_out = set()
+        self.down = False
+        self.calls = 0
+
+    def __call__(self, token):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("auth service unreachable")
+        if token in self.signed_out:
+            raise Refused("session not found")
+        return type("UserResponse", (), {"user": type("User", (), {"id": "user-1"})()})()
+
+
+def revalidating(remote, now):
+    return TokenVerifier(jwt_secret=SECRET, remote_lookup=remote, ttl=60, revalidate=True, clock=lambda: now[0])
+
+
+def test_signed_out_token_is_refused_after_ttl():
+    remote, now = RemoteSessions(), [time.time()]
+    verifier = revalidating(remote, now)
+    token = jwt.encode(claims(), SECRET, algorithm="HS256")
+    assert verifier.get_user(token).user.id == "user-1"
+    remote.signed_out.add(token)
+    assert verifier.get_user(token).user.id == "user-1"  # cached
+    assert remote.calls == 1
+    now[0] += 61
+    assert verifier.get_user(token) is None
+    assert verifier.stats()["revocations"] == 1
+
+
+def test_forged_token_is_refused_without_remote_lookup():
+    remote = RemoteSessions()
+    verifier = revalidating(remote, [time.time()])
+    assert verifier.get_user(jwt.encode(claims(), "x" * 64, algorithm="HS256")) is None
+    assert remote.calls == 0
+
+
+def test_remote_outage_keeps_local_verification():
+    remote, now = RemoteSessions(), [time.time()]
+    remote.down = True
+    verifier = revalidating(remote, now)
+    token = jwt.encode(claims(), SECRET, algorithm="HS256")
+    assert verifier.get_user(token).user.id == "user-1"
+    assert verifier.stats()["revocations"] == 0
+
+
+def test_async_revalidation_refuses_signed_out_token():
+    remote = RemoteSessions()
+
+    async def lookup(token):
+        return remote(token)
+
+    verifier = TokenVerifier(jwt_secret=SECRET, remote_lookup=lookup, revalidate=True)
+    token = jwt.encode(claims(), SECRET, algorithm="HS256")
+    remote.signed_out.add(token)
+    assert asyncio.run(verifier.get_user_async(token)) is None
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+
+
+class FailingModel:
+    """Predicts 1 for a positive first feature and fails any batch with a negative one."""
+
+    def predict(self, X):
+        if (X[:, 0] < 0).any():
+            raise ValueError("bad row")
+        return (X[:, 0] > 0).astype(int)
+
+
+@pytest.fixture
+def batcher():
+    batcher = MicroBatcher(FailingModel(), None, n_features=2, window=0.05)
+    yield batcher
+    batcher.retire()
+
+
+def test_rows_are_scored_in_one_batch(batcher):
+    futures = [batcher.submit([value, 0.0]) for value in (1.0, 0.0, 2.0)]
+    assert [f.result(5) for f in futures] == [1, 0, 1]
+    assert batcher.stats()["batch_size_histogram"] == {3: 1}
+
+
+def test_failing_row_only_fails_its_own_caller(batcher):
+    futures = [batcher.submit([value, 0.0]) for value in (1.0, -1.0, 0.0)]
+    assert futures[0].result(5) == 1
+    with pytest.raises(ValueError, match="bad row"):
+        futures[1].result(5)
+    assert futures[2].result(5) == 0
+
+
+@pytest.mark.parametrize("row", [[np.nan, 0.0], [1.0, np.inf]])
+def test_non_finite_row_is_rejected(batcher, row):
+    with pytest.raises(ValueError, match="finite"):
+        batcher.submit(row)
+
+
+def test_wrong_length_is_rejected(batcher):
+    with pytest.raises(ValueError, match="expected 2"):
+        batcher.submit([1.0])
@@ -0,0 +1,114 @@
+"""The app imported against bench_fakes, so the benchmarks measure code paths that work."""
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+import jwt
+import pytest
+
+import bench_fakes
+import bench_service
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    import google.generativeai as genai
+    import supabase
+
+    scratch = tmp_path_factory.mktemp("bench")
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in {
+            "SUPABASE_URL": "http://127.0.0.1:9",
+            "SUPABASE_KEY": "bench",
+            "SUPABASE_JWT_SECRET": bench_service.JWT_SECRET,
+            "LLM_BACKEND": "gemini",
+            "GEMINI_API_KEY": "bench",
+            "WRITE_BEHIND_SPOOL_DIR": str(scratch / "spool"),
+            "DIET_CACHE_PATH": str(scratch / "diet_plans.sqlite3"),
+            "BENCH_DB_LATENCY_MS": "0",
+            "BENCH_AUTH_LATENCY_MS": "0",
+            "BENCH_LLM_LATENCY_MS": "0",
+            "BENCH_LLM_CHUNK_DELAY_MS": "0",
+        }.items():
+            mp.setenv(name, value)
+        # The app finds models.json and diet_library.json relative to its directory
+        mp.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        # Recorded so the SDK patches are undone with the rest
+        for module, name in ((supabase, "create_client"), (supabase, "AsyncClient"),
+                             (genai, "configure"), (genai, "GenerativeModel")):
+            mp.setattr(module, name, getattr(module, name))
+        mp.delitem(sys.modules, "main", raising=False)
+        tables = bench_fakes.install()
+        import main
+        yield SimpleNamespace(main=main, tables=tables)
+        sys.modules.pop("main", None)
+
+
+def run(app, scenario):
+    async def wrapper():
+        await app.main.startup()
+        try:
+            transport = httpx.ASGITransport(app=app.main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                return await scenario(client)
+        finally:
+            await app.main.shutdown()
+    return asyncio.run(wrapper())
+
+
+def headers(user):
+    token = jwt.encode({"sub": user, "aud": "authenticated", "exp": 4102444800},
+                       bench_service.JWT_SECRET, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.parametrize("workload", sorted(bench_service.WORKLOADS))
+def test_workload_runs_without_errors(app, workload):
+    args = SimpleNamespace(prediction_requests=20, chat_sessions=1, chat_turns=4, diet_requests=20)
+
+    async def scenario(client):
+        bench = bench_service.Bench(client, "", "smoke", concurrency=4)
+        await bench_service.WORKLOADS[workload](bench, args)
+        return bench.samples
+
+    samples = run(app, scenario)
+    assert samples
+    failed = {endpoint: sum(1 for _, ok in values if not ok) for endpoint, values in samples.items()}
+    assert not any(failed.values()), failed
+
+
+def test_session_list_pages_with_the_keyset_filter(app):
+    async def scenario(client):
+        created = [(await client.post("/chat/sessions", headers=headers("pager"))).json()["id"] for _ in range(3)]
+        seen, cursor = [], None
+        while True:
+            url = "/chat/sessions?limit=1" + (f"&cursor={cursor}" if cursor else "")
+            response = await client.get(url, headers=headers("pager"))
+            assert response.status_code == 200
+            seen += [session["id"] for session in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return created, seen
+
+    created, seen = run(app, scenario)
+    assert sorted(seen) == sorted(created) and len(seen) == 3
+
+
+def test_concurrent_appends_retry_on_unique_violation(app):
+    store = app.main.message_store
+    app.tables.latency = 0.001  # both appends read the same last seq before either inserts
+    try:
+        async def append_both():
+            return await asyncio.gather(
+                store.append("clash", [{"role": "user", "content": "a"}]),
+                store.append("clash", [{"role": "user", "content": "b"}]),
+            )
+        seqs = asyncio.run(append_both())
+    finally:
+        app.tables.latency = 0.0
+    assert sorted(seq for pair in seqs for seq in pair) == [1, 2]
+    duplicate = app.main.supabase.table("chat_messages").insert({"session_id": "clash", "seq": 1})
+    with pytest.raises(bench_fakes.UniqueViolation):
+        asyncio.run(duplicate.execute())
@@ -0,0 +1,37 @@
+import pytest
+
+from diet_cache import DietPlanCache, normalize_text
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DietPlanCache(path=str(tmp_path / "diet_plans.sqlite3"))
+
+
+def key(cache, preference, conditions=""):
+    return cache.key("structured", "2nd trimester", 64, conditions, preference)
+
+
+def test_swapped_allergies_get_different_keys(cache):
+    assert key(cache, "allergic to dairy, eat nuts") != key(cache, "allergic to nuts, eat dairy")
+
+
+def test_negation_is_kept(cache):
+    assert key(cache, "I eat eggs") != key(cache, "I don't eat eggs")
+    assert key(cache, "I don't eat eggs") == key(cache, "I don’t eat eggs")
+
+
+def test_equivalent_requests_share_a_key(cache):
+    assert key(cache, "Vegetarian, no eggs.") == key(cache, "  vegetarian , no  eggs")
+    assert cache.key("structured", "second", 62, "none", "") == cache.key("structured", "2", 64.5, "", "ok")
+
+
+def test_plan_is_not_served_for_the_swapped_allergy(cache):
+    cache.put(key(cache, "allergic to dairy, eat nuts"), {"plan": "no dairy"})
+    assert cache.get(key(cache, "allergic to nuts, eat dairy")) is None
+    assert cache.get(key(cache, "allergic to dairy, eat nuts")) == {"plan": "no dairy"}
+
+
+@pytest.mark.parametrize("text", ["", None, "none", "I am fine", "Nil."])
+def test_no_preference(text):
+    assert normalize_text(text) == "none"
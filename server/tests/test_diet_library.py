@@ -0,0 +1,38 @@
+import json
+import os
+
+import pytest
+
+from build_diet_library import PREFERENCE_CASES, check_coverage, check_preferences
+from diet_library import ALLERGENS, DIETS, DietLibrary, parse_preference
+
+LIBRARY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "diet_library.json")
+
+
+@pytest.fixture(scope="module")
+def library():
+    with open(LIBRARY_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_shipped_library_passes_the_build_checks(library):
+    assert check_coverage(library) + check_preferences(library) == []
+
+
+@pytest.mark.parametrize("text, diet, allergens", PREFERENCE_CASES)
+def test_parse_preference(text, diet, allergens):
+    level, allergen_mask = parse_preference(text)
+    assert DIETS[level] == diet
+    assert sorted(a for i, a in enumerate(ALLERGENS) if allergen_mask >> i & 1) == sorted(allergens)
+
+
+def test_nut_allergy_plan_has_no_nuts(library):
+    plan = DietLibrary(library).assemble(2, 65, "", "allergic to milk and nuts")
+    text = json.dumps(plan["meal_plans"]).lower()
+    for food in ("peanut", "almond", "walnut", "nut mix", "paneer", "curd", "yogurt"):
+        assert food not in text
+
+
+def test_unrecognized_allergy_is_left_to_the_model(library):
+    with pytest.raises(LookupError):
+        DietLibrary(library).assemble(2, 65, "", "allergic to strawberries")
@@ -0,0 +1,63 @@
+import json
+
+from diet_schema import JSONSectionScanner, StructuredDietPlan
+
+MEAL = {"name": "Reference meal", "items": ["rice"], "calories": "400"}
+REFERENCE = {
+    "overview": {"calories_per_day": "2200", "key_nutrients": ["iron"], "foods_to_avoid": ["alcohol"]},
+    "meal_plans": [{"type": "Reference", "meals": {"breakfast": MEAL, "lunch": MEAL, "dinner": MEAL, "snacks": []}}],
+    "tips": ["Reference tip"],
+    "supplements": [{"name": "Folic acid", "dosage": "400 mcg", "reason": "reference"}],
+}
+
+
+def run(text):
+    parser = StructuredDietPlan(REFERENCE)
+    parser.feed(text)
+    parser.finish()
+    return parser
+
+
+def closed(text):
+    scanner = JSONSectionScanner(split_arrays=("meal_plans",))
+    scanner.feed(text)
+    return scanner.close()
+
+
+def test_value_cut_mid_string_is_dropped_not_closed():
+    prefix = '{"supplements": [{"name": "Iron", "dosage": "30 mg"}, '
+    assert closed(prefix + '{"name": "Ca", "dosage": "1g') == [
+        ("supplements", None, '[{"name": "Iron", "dosage": "30 mg"}]')]
+    assert closed(prefix + '{"name": "Ca", "dosa') == [
+        ("supplements", None, '[{"name": "Iron", "dosage": "30 mg"}]')]
+    assert closed('{"tips": ["Rest", "Hydr') == [("tips", None, '["Rest"]')]
+    assert closed('{"tips": ["Rest", 12') == [("tips", None, '["Rest"]')]
+
+
+def test_complete_last_element_is_kept():
+    assert closed('{"tips": ["Rest", "Hydrate"') == [("tips", None, '["Rest", "Hydrate"]')]
+    assert closed('{"overview": {"calories_per_day": "2000", "key_n') == [
+        ("overview", None, '{"calories_per_day": "2000"}')]
+
+
+def test_cut_scalar_and_meal_plan_are_dropped():
+    assert closed('{"overview": "Eat we') == [("overview", None, None)]
+    assert closed('{"meal_plans": [{"type": "A"}, {"type": "B", "meals"') == [("meal_plans", 1, None)]
+
+
+def test_truncated_stream_keeps_only_complete_entries():
+    text = json.dumps({"overview": REFERENCE["overview"], "tips": ["Walk daily"], "supplements": [
+        {"name": "Iron", "dosage": "30 mg", "reason": "anaemia"},
+        {"name": "Calcium", "dosage": "1000 mg", "reason": "bones"},
+    ]})
+    parser = run(text[:text.index("1000 mg") + 1])
+    assert parser.result()["supplements"] == [{"name": "Iron", "dosage": "30 mg", "reason": "anaemia"}]
+    assert "supplements" in parser.repaired
+    assert parser.result()["meal_plans"] == REFERENCE["meal_plans"]
+    assert "meal_plans" in parser.replaced
+
+
+def test_truncated_scalar_section_is_replaced():
+    parser = run('{"tips": ["Walk daily"], "overview": {"calories_per_day": "22')
+    assert parser.result()["overview"] == REFERENCE["overview"]
+    assert "overview" in parser.repaired and "overview" in parser.replaced
@@ -0,0 +1,28 @@
+import asyncio
+
+from idempotency import IdempotencyStore, StoredResponse, request_key
+
+READING = b'{"systolic_bp": 120, "diastolic_bp": 80}'
+
+
+def test_identical_bodies_without_a_key_are_not_merged():
+    assert request_key("user-1", "POST", "/predict_maternal", None, READING) is None
+
+
+def test_body_fingerprint_only_where_allowed():
+    key, _, keep = request_key("user-1", "POST", "/diet_plan", None, READING, by_body=True)
+    assert key.endswith(":body:" + request_key("u", "POST", "/p", "k", READING)[1])
+    assert keep is False
+
+
+def test_explicit_key_is_kept_and_replayed():
+    key, fingerprint, keep = request_key("user-1", "POST", "/predict_maternal", "retry-1", READING)
+    assert keep is True
+    store = IdempotencyStore()
+
+    async def twice():
+        assert await store.begin_async(key, fingerprint) is None
+        store.finish(key, StoredResponse(200, b"{}", "application/json"))
+        return await store.begin_async(key, fingerprint)
+
+    assert asyncio.run(twice()).body == b"{}"
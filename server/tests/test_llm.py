@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import pytest
+
+from llm import FakeBackend, LLMGateway, LLMOverloaded, LLMTimeout
+
+
+class ScriptedBackend(FakeBackend):
+    """A FakeBackend whose calls follow ``script``: an exception to raise or
+    seconds to stall before answering. Stalls ignore the timeout, so only the
+    gateway can cut them short."""
+
+    def __init__(self, *script, break_after=None, **kwargs):
+        super().__init__(**kwargs)
+        self.script = list(script)
+        self.break_after = break_after  # chunks streamed before the first stream breaks
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self.cancelled = 0
+
+    async def _step(self):
+        self.calls += 1
+        step = self.script.pop(0) if self.script else 0
+        if isinstance(step, Exception):
+            raise step
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(step)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+    async def agenerate(self, contents, timeout):
+        await self._step()
+        return await super().agenerate(contents, timeout)
+
+    async def astream(self, contents, timeout):
+        await self._step()
+        async for i, text in _enumerate(super().astream(contents, timeout)):
+            if i == self.break_after:
+                self.break_after = None
+                raise ConnectionError("stream reset")
+            yield text
+
+
+async def _enumerate(chunks):
+    i = 0
+    async for chunk in chunks:
+        yield i, chunk
+        i += 1
+
+
+def gateway(backend, **kwargs):
+    return LLMGateway(backend, **dict({"backoff": 0.001, "max_backoff": 0.001, "timeout": 2.0}, **kwargs))
+
+
+def test_transient_errors_are_retried():
+    backend = ScriptedBackend(ConnectionError("reset"), ConnectionError("reset"), reply="ok")
+    llm = gateway(backend, max_retries=2)
+    assert asyncio.run(llm.agenerate("hi")) == "ok"
+    assert backend.calls == 3
+    assert llm.stats()["retries"] == 2 and llm.stats()["errors"] == 0
+
+
+def test_retries_stop_at_max_retries():
+    backend = ScriptedBackend(*[ConnectionError("reset")] * 5)
+    llm = gateway(backend, max_retries=2)
+    with pytest.raises(ConnectionError):
+        asyncio.run(llm.agenerate("hi"))
+    assert backend.calls == 3
+    assert llm.stats()["retries"] == 2 and llm.stats()["errors"] == 1
+
+
+def test_permanent_errors_are_not_retried():
+    backend = ScriptedBackend(ValueError("bad request"))
+    llm = gateway(backend, max_retries=2)
+    with pytest.raises(ValueError):
+        asyncio.run(llm.agenerate("hi"))
+    assert backend.calls == 1
+
+
+def test_deadline_cancels_a_stalled_call():
+    backend = ScriptedBackend(10, 10, 10)
+    llm = gateway(backend, max_retries=2)
+    started = time.monotonic()
+    with pytest.raises(LLMTimeout):
+        asyncio.run(llm.agenerate("hi", timeout=0.2))
+    assert time.monotonic() - started < 1.0
+    assert backend.cancelled == backend.calls >= 1
+    assert backend.active == 0
+    assert llm.stats()["timeouts"] >= 1 and llm.stats()["in_flight"] == 0
+
+
+def test_hedge_winner_cancels_the_loser():
+    backend = ScriptedBackend(10, 0, reply="hedged")
+    llm = gateway(backend, hedge_after=0.05)
+    assert asyncio.run(llm.agenerate("hi")) == "hedged"
+    stats = llm.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    assert backend.cancelled == 1 and backend.active == 0
+    assert stats["in_flight"] == 0
+
+
+def test_fast_primary_is_not_hedged():
+    backend = ScriptedBackend(0, reply="primary")
+    llm = gateway(backend, hedge_after=0.5)
+    assert asyncio.run(llm.agenerate("hi")) == "primary"
+    assert backend.calls == 1 and llm.stats()["hedges"] == 0
+
+
+def test_semaphore_bounds_calls_in_flight():
+    backend = ScriptedBackend(*[0.05] * 6)
+    llm = gateway(backend, max_concurrency=2)
+
+    async def burst():
+        return await asyncio.gather(*(llm.agenerate(f"q{i}") for i in range(6)))
+
+    assert len(asyncio.run(burst())) == 6
+    assert backend.peak == 2
+
+
+def test_no_free_slot_before_the_deadline_is_rejected():
+    backend = ScriptedBackend(10)
+    llm = gateway(backend, max_concurrency=1, max_retries=0)
+
+    async def contend():
+        holder = asyncio.ensure_future(llm.agenerate("slow", timeout=5))
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(LLMOverloaded):
+                await llm.agenerate("second", timeout=0.1)
+        finally:
+            holder.cancel()
+
+    asyncio.run(contend())
+    assert llm.stats()["rejected"] == 1
+
+
+async def collect(chunks):
+    return [text async for text in chunks]
+
+
+def test_slow_stream_is_relayed_chunk_by_chunk():
+    backend = ScriptedBackend(reply="one two three", chunk_delay=0.01)
+    llm = gateway(backend)
+    assert asyncio.run(collect(llm.astream("hi"))) == ["one", " two", " three"]
+    assert llm.stats()["in_flight"] == 0
+
+
+def test_stream_failing_before_the_first_chunk_is_retried():
+    backend = ScriptedBackend(ConnectionError("reset"), reply="one two")
+    llm = gateway(backend, max_retries=1)
+    assert "".join(asyncio.run(collect(llm.astream("hi")))) == "one two"
+    assert backend.calls == 2 and llm.stats()["retries"] == 1
+
+
+def test_stream_failing_after_a_chunk_is_not_replayed():
+    backend = ScriptedBackend(reply="one two three", break_after=1)
+    llm = gateway(backend, max_retries=2)
+    received = []
+
+    async def consume():
+        async for text in llm.astream("hi"):
+            received.append(text)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(consume())
+    assert received == ["one"]
+    assert backend.calls == 1 and llm.stats()["errors"] == 1
+    assert llm.stats()["in_flight"] == 0
@@ -0,0 +1,20 @@
+"""Startup time budgets, measured as check_startup.py does.
+
+Set ``STARTUP_CHECK_RUNS`` to change the number of fresh starts (default 1).
+"""
+import os
+
+import pytest
+
+import check_startup
+
+
+@pytest.fixture(scope="module")
+def startup():
+    return check_startup.measure(int(os.environ.get("STARTUP_CHECK_RUNS", 1)))
+
+
+@pytest.mark.parametrize("name", ["import_s", "first_request_s", "ready_s"])
+def test_within_budget(startup, name):
+    budget = check_startup.default_budgets()[name]
+    assert startup[name] <= budget, f"{name} took {startup[name]:.2f}s, budget {budget:.2f}s"
@@ -0,0 +1,104 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+from postgrest.exceptions import APIError
+
+from write_behind import WriteBehindBuffer, is_rejection
+
+
+class FlakyTables:
+    """Fails the first ``outage`` inserts with a network error, then stores rows.
+
+    Rows with ``"bad": True`` are always rejected like a check constraint would.
+    """
+
+    def __init__(self, outage=0):
+        self.outage = outage
+        self.requests = 0
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        return SimpleNamespace(insert=lambda rows: SimpleNamespace(execute=lambda: self._insert(name, rows)))
+
+    def _insert(self, table, rows):
+        rows = rows if isinstance(rows, list) else [rows]
+        with self.lock:
+            self.requests += 1
+            if self.requests <= self.outage:
+                raise ConnectionError("connection refused")
+            if any(row.get("bad") for row in rows):
+                raise APIError({"code": "23514", "message": "new row violates check constraint"})
+            self.rows.extend((table, row) for row in rows)
+
+
+def buffer(client, spool_dir, **kwargs):
+    options = dict(flush_interval=0.01, max_retries=1, backoff=0.01, max_backoff=0.05)
+    options.update(kwargs)
+    return WriteBehindBuffer(client, spool_dir=str(spool_dir), **options)
+
+
+def failed_rows(writer):
+    try:
+        with open(writer.spool_path + ".failed") as f:
+            return [json.loads(line)["row"] for line in f]
+    except FileNotFoundError:
+        return []
+
+
+@pytest.mark.parametrize("error, rejected", [
+    (APIError({"code": "23505"}), True),
+    (APIError({"code": "42703"}), True),
+    (APIError({"code": "PGRST204"}), True),
+    (APIError({"code": 400}), True),
+    (APIError({"code": 503}), False),
+    (APIError({"code": 429}), False),
+    (APIError({"code": "57014"}), False),
+    (ConnectionError(), False),
+    (TimeoutError(), False),
+])
+def test_is_rejection(error, rejected):
+    assert is_rejection(error) is rejected
+
+
+def test_outage_keeps_rows_until_the_database_recovers(tmp_path):
+    client = FlakyTables(outage=6)
+    writer = buffer(client, tmp_path)
+    writer.write_many("vitals", [{"n": i} for i in range(50)])
+    assert writer.flush(timeout=10)
+    writer.close()
+
+    assert sorted(row["n"] for _, row in client.rows) == list(range(50))
+    assert failed_rows(writer) == []
+    # Retried as whole batches, not one request per row
+    assert client.requests < 20
+    assert writer.stats()["outage_waits"] >= 1
+
+
+def test_rejected_rows_alone_are_dead_lettered(tmp_path):
+    client = FlakyTables()
+    writer = buffer(client, tmp_path)
+    rows = [{"n": i, "bad": i == 3} for i in range(6)]
+    writer.write_many("ctg", rows)
+    assert writer.flush(timeout=10)
+    writer.close()
+
+    assert sorted(row["n"] for _, row in client.rows) == [0, 1, 2, 4, 5]
+    assert failed_rows(writer) == [rows[3]]
+
+
+def test_rows_left_by_an_outage_are_replayed_by_the_next_process(tmp_path):
+    down = FlakyTables(outage=10 ** 6)
+    writer = buffer(down, tmp_path)
+    writer.write("vitals", {"n": 1})
+    assert not writer.flush(timeout=0.3)
+    writer.close(timeout=2)
+    assert down.rows == []
+
+    up = FlakyTables()
+    replay = buffer(up, tmp_path).start()
+    assert replay.flush(timeout=10)
+    replay.close()
+    assert up.rows == [("vitals", {"n": 1})]
@@ -0,0 +1,109 @@
+"""Chat session titles without an extra LLM call on the request path.
+
+A new session is titled immediately with ``heuristic_title`` (a cleaned-up
+prefix of the first message). ``TitleWorker`` then asks the model for a
+better title in the background and writes it to ``chat_sessions.title``
+when it arrives; clients pick it up from the sessions list, or from the
+``title`` event on the streaming endpoint.
+"""
+import asyncio
+import contextvars
+import os
+import re
+from datetime import datetime
+
+MAX_TITLE_LENGTH = 50
+
+_GREETING = re.compile(r"^(hi|hello|hey|hii+|good (morning|afternoon|evening)|namaste)\b[\s,!.]*", re.I)
+_FILLER = re.compile(r"^((can you|could you|please|i want to know|i would like to know|tell me)\b\s*)+", re.I)
+
+
+def clean_title(title):
+    title = title.strip().replace('"', '').replace("'", "")
+    return title[:MAX_TITLE_LENGTH]
+
+
+def heuristic_title(message, max_words=6):
+    """Cheap local title: the first sentence of ``message`` without greetings or filler."""
+    text = " ".join((message or "").split())
+    text = _FILLER.sub("", _GREETING.sub("", text))
+    sentence = re.split(r"(?<=[.?!])\s", text, maxsplit=1)[0].rstrip(".?!,;: ")
+    words = sentence.split()
+    if not words:
+        return "New Chat"
+    title = " ".join(words[:max_words])
+    if len(words) > max_words:
+        title += "..."
+    return clean_title(title[0].upper() + title[1:])
+
+
+class TitleWorker:
+    """Generates LLM titles as tasks on the running event loop.
+
+    ``generate`` is a coroutine function and ``client`` an async Supabase
+    client; at most ``max_workers`` titles are generated at once.
+    """
+
+    def __init__(self, generate, client, max_workers=2, max_pending=256):
+        self.generate = generate
+        self.client = client
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+
+        self._slots = asyncio.Semaphore(max_workers)
+        self._tasks = set()
+        self._counters = {"scheduled": 0, "completed": 0, "failed": 0, "dropped": 0}
+
+    @classmethod
+    def from_env(cls, generate, client):
+        return cls(
+            generate, client,
+            max_workers=int(os.environ.get("TITLE_WORKERS", 2)),
+            max_pending=int(os.environ.get("TITLE_QUEUE_DEPTH", 256)),
+        )
+
+    async def _run(self, session_id, first_message, placeholder):
+        try:
+            async with self._slots:
+                title = clean_title(await self.generate(first_message))
+                if title and title != placeholder:
+                    # Only replace the placeholder, never a title set in the meantime;
+                    # updated_at moves so cached reads in other workers notice
+                    await self.client.table('chat_sessions').update({
+                        'title': title, 'updated_at': datetime.utcnow().isoformat()
+                    }).eq(
+                        'id', session_id
+                    ).eq('title', placeholder).execute()
+            self._counters["completed"] += 1
+            return title or placeholder
+        except Exception as e:
+            print(f"Failed to generate title for {session_id}: {e}")
+            self._counters["failed"] += 1
+            return placeholder
+
+    def schedule(self, session_id, first_message, placeholder):
+        """Starts LLM title generation; returns a task for the final title, or
+        ``None`` when too many titles are already pending. Call from the loop."""
+        if len(self._tasks) >= self.max_pending:
+            self._counters["dropped"] += 1
+            return None
+        self._counters["scheduled"] += 1
+        # In a fresh context: the title is background work, not part of the scheduling request
+        task = asyncio.get_running_loop().create_task(
+            self._run(session_id, first_message, placeholder), context=contextvars.Context()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def shutdown(self, wait=True):
+        tasks = list(self._tasks)
+        if not wait:
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["pending"] = len(self._tasks)
+        return stats
@@ -0,0 +1,180 @@
+"""Weekly trend statistics over a user's vitals or ctg readings.
+
+Readings are folded into one ``prediction_trends`` row per (user, kind, week)
+as they are inserted (see sql/prediction_trends.sql): the count, per-metric
+sums, squares, minima and maxima, time moments for the slope, and the count
+of each predicted class. A trend request reads one row per week and derives
+everything else from those sums with NumPy, so its cost depends on the number
+of weeks asked for and not on how many readings the user has stored.
+
+Rolling statistics cover the trailing ``window`` weeks ending at each week,
+and the weeks before the first one shown are fetched so that every window is
+complete. Slopes are least-squares fits of value against time, in units per
+week. Weeks are Monday-based in UTC; metrics without enough data are ``None``.
+``client`` is an async Supabase client.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from predictions import MATERNAL_FEATURES, FETAL_FEATURES
+
+# Array columns of prediction_trends follow these orders; age is not a reading
+TREND_METRICS = {
+    "vitals": MATERNAL_FEATURES[1:],
+    "ctg": FETAL_FEATURES,
+}
+
+DEFAULT_WEEKS = 12
+MAX_WEEKS = 104
+DEFAULT_WINDOW = 4
+MAX_WINDOW = 26
+
+COLUMNS = "week, n, t_sum, t_squares, sums, squares, t_products, mins, maxs, classes"
+
+
+class TrendError(ValueError):
+    """Raised for a malformed weeks or window parameter."""
+
+
+def parse_weeks(value, name, default, maximum):
+    if value in (None, ""):
+        return default
+    try:
+        weeks = int(value)
+    except (TypeError, ValueError):
+        raise TrendError(f"{name} must be an integer")
+    if weeks < 1:
+        raise TrendError(f"{name} must be positive")
+    return min(weeks, maximum)
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _window_sums(values, window):
+    # Sum of each trailing window along axis 0, as a difference of running sums
+    running = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    return running[window:] - running[:-window]
+
+
+def _window_reduce(values, window, reduce):
+    windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=0)
+    return reduce(windows, axis=-1)
+
+
+def _slope(n, t_sum, t_squares, sums, t_products):
+    """Least-squares slope per week; NaN with fewer than two distinct times."""
+    n, t_sum, t_squares = n[..., None], t_sum[..., None], t_squares[..., None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spread = n * t_squares - t_sum ** 2
+        slope = (n * t_products - t_sum * sums) / spread * 7
+    return np.where((n >= 2) & (spread > 1e-9 * np.maximum(n * t_squares, 1)), slope, np.nan)
+
+
+def _values(array):
+    return [None if not np.isfinite(v) else round(float(v), 4) for v in array]
+
+
+def summarize(rows, metrics, first_week, weeks, window=DEFAULT_WINDOW):
+    """Per-week and overall statistics for the last ``weeks`` of the weekly rows.
+
+    ``rows`` are prediction_trends rows from ``first_week`` on; the
+    ``window - 1`` weeks before the ones shown only feed the rolling windows.
+    """
+    total = weeks + window - 1
+    m = len(metrics)
+    n = np.zeros(total)
+    t_sum = np.zeros(total)
+    t_squares = np.zeros(total)
+    sums = np.zeros((total, m))
+    squares = np.zeros((total, m))
+    t_products = np.zeros((total, m))
+    mins = np.full((total, m), np.inf)
+    maxs = np.full((total, m), -np.inf)
+    classes = np.zeros((total, 3), dtype=np.int64)
+
+    for row in rows:
+        week = row["week"]
+        if isinstance(week, str):
+            week = date.fromisoformat(week[:10])
+        i = (week - first_week).days // 7
+        if not 0 <= i < total or len(row["sums"]) != m:
+            continue
+        n[i], t_sum[i], t_squares[i] = row["n"], row["t_sum"], row["t_squares"]
+        sums[i], squares[i], t_products[i] = row["sums"], row["squares"], row["t_products"]
+        mins[i], maxs[i] = row["mins"], row["maxs"]
+        classes[i] = row["classes"][:3]
+
+    # Rows keep time within their own week; move them onto one axis (days
+    # since first_week) so moments of different weeks can be added
+    offset = np.arange(total) * 7.0
+    t_squares = t_squares + 2 * offset * t_sum + n * offset ** 2
+    t_sum = t_sum + n * offset
+    t_products = t_products + offset[:, None] * sums
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums / n[:, None]
+        rolling_n = _window_sums(n, window)
+        rolling_mean = _window_sums(sums, window) / rolling_n[:, None]
+    rolling_slope = _slope(rolling_n, _window_sums(t_sum, window), _window_sums(t_squares, window),
+                           _window_sums(sums, window), _window_sums(t_products, window))
+    rolling_min = _window_reduce(mins, window, np.min)
+    rolling_max = _window_reduce(maxs, window, np.max)
+
+    shown = slice(window - 1, None)
+    n, t_sum, t_squares = n[shown], t_sum[shown], t_squares[shown]
+    sums, squares, t_products = sums[shown], squares[shown], t_products[shown]
+    mins, maxs, classes, mean = mins[shown], maxs[shown], classes[shown], mean[shown]
+
+    series = []
+    for i in range(weeks):
+        series.append({
+            "week": (first_week + timedelta(weeks=window - 1 + i)).isoformat(),
+            "readings": int(n[i]),
+            "suspect": int(classes[i, 1]),
+            "pathological": int(classes[i, 2]),
+            "mean": dict(zip(metrics, _values(mean[i]))),
+            "min": dict(zip(metrics, _values(mins[i]))),
+            "max": dict(zip(metrics, _values(maxs[i]))),
+            "rolling_mean": dict(zip(metrics, _values(rolling_mean[i]))),
+            "rolling_min": dict(zip(metrics, _values(rolling_min[i]))),
+            "rolling_max": dict(zip(metrics, _values(rolling_max[i]))),
+            "slope_per_week": dict(zip(metrics, _values(rolling_slope[i]))),
+        })
+
+    count = n.sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overall_mean = sums.sum(axis=0) / count
+        variance = np.maximum(squares.sum(axis=0) / count - overall_mean ** 2, 0)
+    overall_slope = _slope(np.array(count), np.array(t_sum.sum()), np.array(t_squares.sum()),
+                           sums.sum(axis=0), t_products.sum(axis=0))
+    summary = {
+        "readings": int(count),
+        "suspect": int(classes[:, 1].sum()),
+        "pathological": int(classes[:, 2].sum()),
+        "mean": dict(zip(metrics, _values(overall_mean))),
+        "min": dict(zip(metrics, _values(mins.min(axis=0)))),
+        "max": dict(zip(metrics, _values(maxs.max(axis=0)))),
+        "std": dict(zip(metrics, _values(np.sqrt(variance)))),
+        "slope_per_week": dict(zip(metrics, _values(overall_slope))),
+    }
+    return {"weeks": weeks, "window": window, "series": series, "summary": summary}
+
+
+class TrendReader:
+    """Reads a user's weekly rows for one kind and summarizes them."""
+
+    def __init__(self, client, table="prediction_trends"):
+        self.client = client
+        self.table = table
+
+    async def trends(self, user_id, kind, weeks=DEFAULT_WEEKS, window=DEFAULT_WINDOW, today=None):
+        metrics = TREND_METRICS[kind]
+        today = today or datetime.now(timezone.utc).date()
+        first_week = week_start(today) - timedelta(weeks=weeks + window - 2)
+        rows = (await self.client.table(self.table).select(COLUMNS)
+                .eq("uid", user_id).eq("kind", kind).gte("week", first_week.isoformat())
+                .order("week").execute()).data
+        return summarize(rows, metrics, first_week, weeks, window)
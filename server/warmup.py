@@ -0,0 +1,72 @@
+"""Background warm-up after startup, and the state behind the readiness probe.
+
+The app answers liveness probes as soon as it is imported; loading models,
+running dummy predictions and opening client connections happen afterwards
+in ``WarmUp.run``. Each step is a coroutine function. Required steps (the
+models) are retried until they succeed and decide readiness; optional ones
+(connections to Supabase and the LLM) are tried once and only reported, since
+those clients also connect on first use.
+"""
+import asyncio
+import time
+
+
+class WarmUp:
+    def __init__(self, retry_interval=5.0):
+        self.retry_interval = retry_interval
+        self._steps = []
+        self._status = {}
+        self._task = None
+        self._started = None
+        self._finished = None
+
+    def step(self, name, fn, required=True):
+        self._steps.append((name, fn, required))
+        self._status[name] = {"state": "pending", "required": required}
+        return self
+
+    async def _attempt(self, name, fn):
+        started = time.perf_counter()
+        try:
+            await fn()
+        except Exception as e:
+            self._status[name].update(state="failed", error=str(e))
+            print(f"Warm-up step {name} failed: {e}")
+            return False
+        self._status[name].update(state="done", seconds=round(time.perf_counter() - started, 3))
+        self._status[name].pop("error", None)
+        return True
+
+    async def _required(self, name, fn):
+        while not await self._attempt(name, fn):
+            await asyncio.sleep(self.retry_interval)
+
+    async def run(self):
+        self._started = time.perf_counter()
+        # Optional steps run alongside the required ones but never hold up readiness
+        await asyncio.gather(*(
+            self._required(name, fn) if required else self._attempt(name, fn)
+            for name, fn, required in self._steps
+        ))
+        self._finished = time.perf_counter()
+        print(f"Warm-up finished in {self._finished - self._started:.2f}s")
+
+    def start(self):
+        """Runs the steps as a background task of the running loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    @property
+    def ready(self):
+        return all(status["state"] == "done" for status in self._status.values() if status["required"])
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "steps": {name: dict(status) for name, status in self._status.items()},
+        }
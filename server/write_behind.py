@@ -0,0 +1,396 @@
+"""Write-behind buffer for prediction rows (``vitals`` / ``ctg``).
+
+The client never sees the stored row, so handlers hand it to
+``WriteBehindBuffer.write`` and return immediately. Rows are appended to a
+local spool file first (so a crash doesn't lose them), kept in a bounded
+in-memory queue and bulk-inserted by a background flusher with retry and
+backoff. When the queue is full, ``write`` blocks for a short while and then
+falls back to a synchronous insert, so callers slow down instead of dropping
+data. Coroutines use ``awrite``/``awrite_many``, which do all of that (spool
+append included) on a worker thread.
+
+A batch that keeps failing with a network error, timeout or 5xx stays
+queued and spooled, and the flusher backs off until the database answers
+again. Only when the database rejects a batch (a constraint or schema error,
+see ``is_rejection``) are its rows inserted one by one, and the rows it
+rejects on their own go to ``<spool>.failed``.
+
+Each buffer owns one locked spool file in ``spool_dir``. It is opened by
+``start()`` or the first write, in the process that writes, so a buffer
+created before a server forks its workers gives each worker its own spool.
+Opening it also replays the spool files left behind by processes that are no
+longer running.
+"""
+import asyncio
+import atexit
+import fcntl
+import glob
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+
+
+def is_rejection(error):
+    """True if the database refused the rows themselves, so retrying can't help.
+
+    PostgREST reports Postgres errors by SQLSTATE: classes 22 (bad data),
+    23 (constraint) and 42 (unknown column, permissions), or PGRST1xx/2xx for
+    a request it can't run. Errors without a body carry the HTTP status.
+    Anything else (network, timeouts, 5xx, 429) is transient.
+    """
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return 400 <= code < 500 and code not in (408, 429)
+    code = str(code or "")
+    return code[:2] in ("22", "23", "42") or re.fullmatch(r"PGRST[12]\d\d", code) is not None
+
+
+class WriteBehindBuffer:
+    def __init__(self, client, spool_dir="spool", max_queue=10000, batch_size=500,
+                 flush_interval=0.2, max_retries=5, backoff=0.5, max_backoff=30.0,
+                 block_timeout=1.0, fsync=False):
+        self.client = client
+        self.spool_dir = spool_dir
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.block_timeout = block_timeout
+        self.fsync = fsync
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._spool_lock = threading.Lock()
+        self._next_id = 0
+        self._pending = {}
+        self._acked_since_compact = 0
+        self._in_flight = 0
+        self._closed = False
+        self._worker = None
+        self._latencies = deque(maxlen=1000)
+        self._spool = None
+        self.spool_path = None
+        self._start_lock = threading.Lock()
+        self._counters = {
+            "enqueued": 0,
+            "flushed_rows": 0,
+            "flush_batches": 0,
+            "retries": 0,
+            "sync_fallbacks": 0,
+            "dead_lettered": 0,
+            "replayed": 0,
+            "outage_waits": 0,
+        }
+
+
+    @classmethod
+    def from_env(cls, client):
+        return cls(
+            client,
+            spool_dir=os.environ.get("WRITE_BEHIND_SPOOL_DIR", "spool"),
+            max_queue=int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 10000)),
+            batch_size=int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 500)),
+            flush_interval=float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL_MS", 200)) / 1000.0,
+            max_retries=int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", 5)),
+            fsync=os.environ.get("WRITE_BEHIND_FSYNC", "false").lower() == "true",
+        )
+
+    # --- spool ---
+
+    def start(self):
+        """Opens this process's spool and replays rows from dead processes' spools."""
+        if self._spool is not None:
+            return self
+        with self._start_lock:
+            if self._spool is None:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                path = os.path.join(self.spool_dir, f"writes-{os.getpid()}-{uuid.uuid4().hex[:8]}.spool")
+                spool = open(path, "a+", encoding="utf-8")
+                fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.spool_path, self._spool = path, spool
+                self._recover()
+        return self
+
+    def _append(self, entries):
+        with self._spool_lock:
+            if self._spool.closed:
+                return  # a flusher outliving close(); the spool is replayed as it was
+            for entry in entries:
+                self._spool.write(json.dumps(entry, default=str) + "\n")
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+
+    @staticmethod
+    def _read_pending(f):
+        f.seek(0)
+        pending = {}
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn write at crash time
+            if entry.get("op") == "add":
+                pending[entry["id"]] = (entry["table"], entry["row"])
+            elif entry.get("op") == "ack":
+                for i in entry["ids"]:
+                    pending.pop(i, None)
+        return [pending[i] for i in sorted(pending)]
+
+    def _recover(self):
+        """Replays rows from our own spool and from spools of dead processes."""
+        recovered = self._read_pending(self._spool)
+        for path in glob.glob(os.path.join(self.spool_dir, "writes-*.spool")):
+            if path == self.spool_path:
+                continue
+            with open(path, "r+", encoding="utf-8") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # still owned by a live process
+                recovered.extend(self._read_pending(f))
+                os.remove(path)
+
+        with self._spool_lock:
+            self._spool.seek(0)
+            self._spool.truncate()
+        for table, row in recovered:
+            self._enqueue(table, row, force=True)
+        self._counters["replayed"] = len(recovered)
+        if recovered:
+            self._ensure_worker()
+
+    def _ack(self, ids):
+        self._append([{"op": "ack", "ids": ids}])
+        with self._cond:
+            for row_id in ids:
+                self._pending.pop(row_id, None)
+            self._acked_since_compact += len(ids)
+            if self._pending and self._acked_since_compact <= 10 * self.max_queue:
+                return
+            # Rewrite the spool with only the rows that are still waiting. Holding
+            # the condition keeps producers from appending while it is truncated.
+            with self._spool_lock:
+                self._spool.seek(0)
+                self._spool.truncate()
+                for row_id in sorted(self._pending):
+                    table, row = self._pending[row_id]
+                    entry = {"op": "add", "id": row_id, "table": table, "row": row}
+                    self._spool.write(json.dumps(entry, default=str) + "\n")
+                self._spool.flush()
+            self._acked_since_compact = 0
+
+    # --- producer side ---
+
+    def _enqueue(self, table, row, force=False, timeout=None):
+        with self._cond:
+            if not force:
+                deadline = time.monotonic() + (self.block_timeout if timeout is None else timeout)
+                while len(self._queue) >= self.max_queue and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            if self._closed:
+                return False
+            row_id = self._next_id
+            self._next_id += 1
+            self._append([{"op": "add", "id": row_id, "table": table, "row": row}])
+            self._pending[row_id] = (table, row)
+            self._queue.append((row_id, table, row))
+            self._counters["enqueued"] += 1
+            self._cond.notify_all()
+        if not force:
+            self._ensure_worker()
+        return True
+
+    def write(self, table, row):
+        """Queues ``row`` for ``table``; inserts synchronously if the queue stays full."""
+        self.start()
+        if not self._enqueue(table, row):
+            with self._cond:
+                self._counters["sync_fallbacks"] += 1
+            self.client.table(table).insert(row).execute()
+
+    def write_many(self, table, rows):
+        self.start()
+        for i, row in enumerate(rows):
+            if not self._enqueue(table, row):
+                # Backpressure: store the rest of the batch in one synchronous insert
+                with self._cond:
+                    self._counters["sync_fallbacks"] += 1
+                self.client.table(table).insert(rows[i:]).execute()
+                return
+
+    async def awrite(self, table, row):
+        """``write`` for coroutines; the spool append and any wait happen on a worker thread."""
+        await asyncio.to_thread(self.write, table, row)
+
+    async def awrite_many(self, table, rows):
+        await asyncio.to_thread(self.write_many, table, rows)
+
+    # --- flusher ---
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._cond:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._worker.start()
+
+    def _take_batch(self):
+        with self._cond:
+            if not self._queue and not self._closed:
+                self._cond.wait(self.flush_interval)
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            self._in_flight = len(batch)
+            self._cond.notify_all()
+            return batch
+
+    def _insert_with_retry(self, table, rows):
+        """Returns ``None`` once the rows are stored, else the last error."""
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.client.table(table).insert(rows).execute()
+                return None
+            except Exception as e:
+                if is_rejection(e) or attempt == self.max_retries:
+                    print(f"Write-behind insert of {len(rows)} rows into {table} failed: {e}")
+                    return e
+                with self._cond:
+                    self._counters["retries"] += 1
+                # Full jitter keeps many workers from retrying in lockstep
+                time.sleep(random.uniform(0, delay))
+                delay = min(delay * 2, self.max_backoff)
+
+    def _dead_letter(self, table, entries):
+        with open(self.spool_path + ".failed", "a", encoding="utf-8") as f:
+            for row_id, _, row in entries:
+                f.write(json.dumps({"table": table, "row": row}, default=str) + "\n")
+        with self._cond:
+            self._counters["dead_lettered"] += len(entries)
+
+    def _requeue(self, entries):
+        # Still in the spool and in _pending; back to the front of the queue
+        with self._cond:
+            self._queue.extendleft(reversed(entries))
+
+    def _flush(self, batch):
+        """Writes ``batch``; returns True if rows were put back to retry later."""
+        by_table = {}
+        for entry in batch:
+            by_table.setdefault(entry[1], []).append(entry)
+
+        retry_later = False
+        for table, entries in by_table.items():
+            started = time.perf_counter()
+            error = self._insert_with_retry(table, [row for _, _, row in entries])
+            failed, unsent = [], []
+            if error is not None and not is_rejection(error):
+                unsent = entries
+            elif error is not None:
+                # Isolate the rows the database rejects; one row was already tried alone
+                for i, entry in enumerate(entries):
+                    row_error = error if len(entries) == 1 else self._insert_with_retry(table, [entry[2]])
+                    if row_error is None:
+                        continue
+                    if not is_rejection(row_error):
+                        unsent = entries[i:]
+                        break
+                    failed.append(entry)
+            if failed:
+                self._dead_letter(table, failed)
+            done = entries[:len(entries) - len(unsent)]
+            if done:
+                self._ack([row_id for row_id, _, _ in done])
+            if unsent:
+                self._requeue(unsent)
+                retry_later = True
+            with self._cond:
+                self._latencies.append(time.perf_counter() - started)
+                self._counters["flush_batches"] += 1
+                self._counters["flushed_rows"] += len(done) - len(failed)
+        return retry_later
+
+    def _run(self):
+        outage = 0
+        while True:
+            batch = self._take_batch()
+            retry_later = self._flush(batch) if batch else False
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+                if self._closed and (retry_later or not self._queue):
+                    return  # rows still waiting stay in the spool for the next process
+                if retry_later:
+                    # The database is down: wait before the next batch, longer each time
+                    outage += 1
+                    self._counters["outage_waits"] += 1
+                    pause = random.uniform(0.5, 1) * min(self.backoff * 2 ** outage, self.max_backoff)
+                    deadline = time.monotonic() + pause
+                    while not self._closed and time.monotonic() < deadline:
+                        self._cond.wait(deadline - time.monotonic())
+                else:
+                    outage = 0
+
+    # --- lifecycle ---
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far has been written."""
+        self._ensure_worker()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10.0):
+        """Flush-on-shutdown hook: drains the queue and stops the flusher."""
+        if self._closed:
+            return
+        if self._spool is None:
+            self._closed = True  # never written to
+            return
+        if self._queue:
+            self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        with self._cond:
+            drained = not self._pending
+        # Unlocks the spool; rows still in it are replayed by the next buffer to start
+        with self._spool_lock:
+            self._spool.close()
+        if drained:
+            os.remove(self.spool_path)
+
+    def install_shutdown_hook(self):
+        atexit.register(self.close)
+        return self
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats["queue_depth"] = len(self._queue)
+            latencies = sorted(self._latencies)
+        if latencies:
+            stats["flush_latency_p50"] = latencies[len(latencies) // 2]
+            stats["flush_latency_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            stats["flush_latency_max"] = latencies[-1]
+        return stats